@@ -0,0 +1,119 @@
+import math
+import threading
+import time
+from collections import namedtuple
+
+# Adaptive bitrate: the server reports its receive rate and how old the newest
+# frame was, the client turns that into an end-to-end latency estimate and
+# walks a ladder of (quality, resolution scale, fps) settings to keep the
+# latency under a budget. The controller has no clock or I/O of its own, so
+# feeding it the same reports always produces the same decisions.
+STATS_MESSAGE = b"STATS"
+DEFAULT_LATENCY_BUDGET = 0.15  # Seconds
+STABLE_REPORTS_TO_RAISE = 3  # Consecutive good reports before stepping back up
+
+StreamSettings = namedtuple("StreamSettings", ["quality", "scale", "fps"])
+
+# Best to worst; quality is capped by what the user picked
+LADDER = [
+    StreamSettings(100, 1.0, 30),
+    StreamSettings(65, 1.0, 30),
+    StreamSettings(50, 1.0, 30),
+    StreamSettings(50, 0.75, 30),
+    StreamSettings(40, 0.75, 20),
+    StreamSettings(40, 0.5, 20),
+    StreamSettings(30, 0.5, 15),
+    StreamSettings(30, 0.5, 10),
+]
+
+
+def format_stats_report(receive_rate, frame_timestamp, frame_age):
+    # Server -> client on the control connection
+    return STATS_MESSAGE + f" rate={receive_rate:.0f};ts={frame_timestamp:.6f};age={frame_age:.6f}".encode()
+
+
+def parse_stats_report(line, now):
+    # Returns (receive rate in bytes/s, latency in seconds), or None for a
+    # malformed report. The latency is the capture-to-report time minus how
+    # long the server held the frame, measured entirely on the client clock,
+    # so it includes the report's trip back.
+    params = {}
+    try:
+        for item in line[len(STATS_MESSAGE):].decode(errors="ignore").strip().split(";"):
+            if "=" in item:
+                key, value = item.split("=", 1)
+                params[key] = float(value)
+        rate, latency = params["rate"], now - params["ts"] - params["age"]
+    except (ValueError, KeyError):
+        return None
+    if not (math.isfinite(rate) and math.isfinite(latency)):
+        return None
+    return rate, max(latency, 0.0)
+
+
+class AdaptiveBitrateController:
+    def __init__(self, max_quality, latency_budget=DEFAULT_LATENCY_BUDGET, ladder=LADDER):
+        self.max_quality = max_quality
+        self.latency_budget = latency_budget
+        self.ladder = ladder
+        self.level = 0
+        self.good_reports = 0
+
+    def settings(self):
+        level = self.ladder[self.level]
+        return level._replace(quality=min(level.quality, self.max_quality))
+
+    def update(self, latency, receive_rate=None, send_rate=None):
+        # Step down right away when over budget (two steps if far over, or if the
+        # server receives much less than we send), step up only after a run of
+        # reports comfortably under budget
+        if latency > self.latency_budget:
+            steps = 2 if latency > 2 * self.latency_budget else 1
+            if receive_rate is not None and send_rate and receive_rate < 0.7 * send_rate:
+                steps = 2
+            self.level = min(self.level + steps, len(self.ladder) - 1)
+            self.good_reports = 0
+        elif latency < 0.5 * self.latency_budget:
+            self.good_reports += 1
+            if self.good_reports >= STABLE_REPORTS_TO_RAISE:
+                self.level = max(self.level - 1, 0)
+                self.good_reports = 0
+        else:
+            self.good_reports = 0
+        return self.settings()
+
+
+class ThrottledSocket:
+    # Simulation shim: a socket whose sendall and send_parts are limited to a
+    # fixed bandwidth, e.g. ClientPipeline(capture, ThrottledSocket(sock, 2_000_000), ...).
+    # clock and sleep can be replaced to run a simulated link without waiting.
+    def __init__(self, sock, bytes_per_second, clock=time.perf_counter, sleep=time.sleep):
+        self.sock = sock
+        self.bytes_per_second = bytes_per_second
+        self.clock = clock
+        self.sleep = sleep
+        self.lock = threading.Lock()
+        self.available_at = clock()
+
+    def wait(self, size):
+        # Sleep until the link has room for size more bytes
+        with self.lock:
+            now = self.clock()
+            self.available_at = max(self.available_at, now) + size / self.bytes_per_second
+            delay = self.available_at - now
+        self.sleep(delay)
+
+    def sendall(self, data):
+        self.wait(len(data))
+        self.sock.sendall(data)
+
+    def send_parts(self, parts):
+        # Defined here rather than forwarded, so ClientPipeline's send_parts path is throttled too
+        self.wait(sum(memoryview(part).nbytes for part in parts))
+        if hasattr(self.sock, "send_parts"):
+            self.sock.send_parts(parts)
+        else:
+            self.sock.sendall(b"".join(parts))
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
@@ -0,0 +1,129 @@
+import argparse
+import json
+import struct
+import threading
+import time
+from channels import PRIORITY_BULK, PRIORITY_INTERRUPT, VIDEO_CHANNEL, MuxProtocol
+from net_engine import MuxChannelSocket, NetworkEngine
+from pipeline import LatencySeries
+
+# Small-message latency on a multiplexed stream connection under video load.
+# A bulk channel (raw-frame-sized messages, as fast as the connection takes
+# them) and an interrupt channel (small HID-style reports at a fixed rate)
+# share one loopback connection, sender and receiver on their own event loops.
+#   python bench_channels.py --seconds 5
+# Report latency is send -> receiver handler on one clock. Modes:
+#   idle  reports only
+#   mux   bulk at bulk priority, reports at interrupt priority, default windows
+#   fifo  both at the same priority and the bulk window opened wide, which is
+#         what interleaving the reports into one plain stream would give
+MODES = ("idle", "mux", "fifo")
+REPORT_CHANNEL = 1
+REPORT_HEADER = struct.Struct("<d")  # Send time, perf_counter
+FIFO_WINDOW = 1 << 30
+
+
+class BenchReceiver(MuxProtocol):
+    def __init__(self, mode, latency, bulk_bytes):
+        super().__init__("Server")
+        self.mode = mode
+        self.on_message(VIDEO_CHANNEL, lambda message, elapsed: bulk_bytes.append(len(bytes(message))))
+        self.on_message(REPORT_CHANNEL, lambda message, elapsed: latency.add(
+            time.perf_counter() - REPORT_HEADER.unpack_from(message)[0]))
+
+    def connection_made(self, transport):
+        super().connection_made(transport)
+        if self.mode == "fifo":
+            self.grant(VIDEO_CHANNEL, FIFO_WINDOW)
+
+
+def send_bulk(sock, size, stopping):
+    payload = bytes(size)
+    while not stopping.is_set():
+        try:
+            sock.sendall(payload)
+        except ConnectionError:
+            return
+
+
+def send_reports(sock, size, rate, stopping):
+    padding = bytes(max(size - REPORT_HEADER.size, 0))
+    interval = 1 / rate
+    next_time = time.perf_counter()
+    while not stopping.is_set():
+        sock.sendall(REPORT_HEADER.pack(time.perf_counter()) + padding)
+        next_time += interval
+        time.sleep(max(next_time - time.perf_counter(), 0))
+
+
+def run_case(mode, args):
+    receiver_engine = NetworkEngine()
+    sender_engine = NetworkEngine()
+    latency = LatencySeries(window=int(args.seconds * args.report_hz) + 1)
+    bulk_bytes = []
+    stopping = threading.Event()
+    server = receiver_engine.submit(receiver_engine.loop.create_server(
+        lambda: BenchReceiver(mode, latency, bulk_bytes), "127.0.0.1", args.port)).result()
+    _, mux = sender_engine.submit(sender_engine.loop.create_connection(
+        lambda: MuxProtocol("Client"), "127.0.0.1", args.port)).result()
+    # Queued on the sender's loop ahead of any message
+    sender_engine.call(mux.channel, VIDEO_CHANNEL, PRIORITY_BULK)
+    sender_engine.call(mux.channel, REPORT_CHANNEL, PRIORITY_BULK if mode == "fifo" else PRIORITY_INTERRUPT)
+    threads = [threading.Thread(target=send_reports, args=(MuxChannelSocket(sender_engine, mux, REPORT_CHANNEL),
+                                                           args.report_size, args.report_hz, stopping))]
+    if mode != "idle":
+        threads.append(threading.Thread(target=send_bulk, args=(MuxChannelSocket(sender_engine, mux, VIDEO_CHANNEL),
+                                                                args.bulk_size, stopping)))
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stopping.set()
+    elapsed = time.perf_counter() - start
+    for thread in threads:
+        thread.join(timeout=2)
+    sender_engine.call(mux.close)
+    receiver_engine.call(server.close)
+    sender_engine.stop()
+    receiver_engine.stop()
+
+    snapshot = latency.snapshot()
+    values = [value for _, value in latency.samples]
+    return {"mode": mode, "reports": snapshot["total"], "bulk_mb_per_s": round(sum(bulk_bytes) / elapsed / 1e6, 1),
+            "latency_ms": {**{key: value for key, value in snapshot.items() if key.endswith("_ms")},
+                           "max_ms": round(max(values, default=0) * 1000, 2)}}
+
+
+def format_result(result):
+    latency = result["latency_ms"]
+    return (f"{result['mode']:>5}  bulk {result['bulk_mb_per_s']:7.1f} MB/s  {result['reports']:5d} reports  "
+            f"latency p50 {latency.get('p50_ms', 0):6.2f} p95 {latency.get('p95_ms', 0):6.2f} "
+            f"p99 {latency.get('p99_ms', 0):6.2f} max {latency['max_ms']:6.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Interrupt-channel latency under bulk load on one multiplexed link")
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--bulk-size", type=int, default=1280 * 720 * 3, help="bytes per bulk message")
+    parser.add_argument("--report-size", type=int, default=64, help="bytes per interrupt report")
+    parser.add_argument("--report-hz", type=int, default=250)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--port", type=int, default=9996)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    print(f"bulk {args.bulk_size} B messages, {args.report_size} B reports @ {args.report_hz} Hz, "
+          f"{args.seconds:g} s per mode")
+    results = []
+    for mode in args.modes.split(","):
+        result = run_case(mode, args)
+        print(format_result(result), flush=True)
+        results.append(result)
+
+    if args.json:
+        with open(args.json, "w") as output:
+            json.dump({"params": vars(args), "results": results}, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import argparse
+import socket
+import threading
+import time
+from frame_codecs import get_codec
+from net_engine import NetworkEngine, ServerNetwork
+from pipeline import ClientPipeline
+from sessions import SessionRegistry, send_session_hello
+from sinks import NullSink
+from synthetic_camera import SyntheticCamera, make_frames
+
+# Load test for the multi-client server: N synthetic cameras stream over
+# loopback TCP into the network engine's stream server, each ingested by its
+# own ClientSession with a null sink. Reports decoded fps per session, total
+# throughput, CPU use and the number of threads.
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream N synthetic cameras into one server over loopback")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--codec", default="jpeg")
+    parser.add_argument("--quality", type=int, default=80)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--port", type=int, default=9999)
+    args = parser.parse_args()
+
+    registry = SessionRegistry()
+    engine = NetworkEngine()
+    server = ServerNetwork(engine, registry, "127.0.0.1", lambda session: NullSink)
+    engine.submit(server.start(args.port)).result()
+
+    frames = make_frames(args.width, args.height)
+    clients = []
+    for index in range(args.clients):
+        session = registry.create(("127.0.0.1", 0), get_codec(args.codec, args.quality), "tcp", False, None)
+        sock = socket.create_connection(("127.0.0.1", args.port))
+        send_session_hello(sock, session.id, session.token)
+        camera = SyntheticCamera(frames, args.fps, offset=index)
+        pipeline = ClientPipeline(camera, sock, get_codec(args.codec, args.quality),
+                                  on_error=lambda error: print(f"Client error: {error}"))
+        pipeline.start()
+        clients.append((sock, pipeline))
+
+    # Let every session come up, then measure a clean window
+    time.sleep(2)
+    sessions = [session for session in registry.all() if session.pipeline is not None]
+    for session in sessions:
+        session.pipeline.take_counters()
+        session.pipeline.stats["decode"].reset()
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    time.sleep(args.seconds)
+    elapsed = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+
+    total_bytes = 0
+    rates = []
+    for session in sessions:
+        received, _ = session.pipeline.take_counters()
+        decoded, _ = session.pipeline.stats["decode"].reset()
+        total_bytes += received
+        rates.append(decoded / elapsed)
+    print(f"{len(sessions)}/{args.clients} sessions, {args.width}x{args.height} @ {args.fps} fps, {args.codec}")
+    print(f"decoded fps per session: min {min(rates, default=0):.1f}, "
+          f"avg {sum(rates) / max(len(rates), 1):.1f}, max {max(rates, default=0):.1f}")
+    print(f"throughput {total_bytes / elapsed / 1_000_000:.1f} MB/s, CPU {cpu / elapsed:.2f} cores (clients and server), "
+          f"{threading.active_count()} threads")
+
+    for sock, pipeline in clients:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        pipeline.stop()
+        sock.close()
+    engine.submit(server.stop()).result()
+    engine.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import argparse
+import time
+import cv2
+from PIL import Image, ImageTk
+from preview import PREVIEW_MAX_FPS, PREVIEW_MAX_HEIGHT, PREVIEW_MAX_WIDTH, prepare_preview
+from synthetic_camera import make_frames
+
+# CPU cost of the GUI preview: the old path (full-size cvtColor + fromarray +
+# a new PhotoImage for every stream frame) against preview.py (downscale
+# first, reuse one PhotoImage via paste, capped at PREVIEW_MAX_FPS).
+#   python bench_preview.py --width 1920 --height 1080 --fps 30
+# Without a display Tk can't create images, so only the pixel work is measured.
+
+
+def old_draw(frame, label):
+    image = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+    if label is not None:
+        photo = ImageTk.PhotoImage(image=image)
+        label.configure(image=photo)
+        label.image = photo
+
+
+def new_draw(frame, label, state):
+    image = prepare_preview(frame, PREVIEW_MAX_WIDTH, PREVIEW_MAX_HEIGHT)
+    if label is not None:
+        if state.get("photo") is None:
+            state["photo"] = ImageTk.PhotoImage(image=image)
+            label.configure(image=state["photo"])
+        else:
+            state["photo"].paste(image)
+
+
+def measure(draw, frames, count):
+    # CPU seconds per draw
+    start = time.process_time()
+    for index in range(count):
+        draw(frames[index % len(frames)])
+    return (time.process_time() - start) / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU per second spent on the GUI preview, old vs new path")
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--fps", type=int, default=30, help="stream frame rate")
+    parser.add_argument("--draws", type=int, default=100, help="draws measured per path")
+    args = parser.parse_args()
+
+    label = None
+    try:
+        import tkinter as tk
+        root = tk.Tk()
+        root.withdraw()
+        label = tk.Label(root)
+    except Exception as e:
+        print(f"No Tk display ({e}); measuring the pixel work without PhotoImage")
+
+    frames = make_frames(args.width, args.height, count=8)
+    state = {}
+    old = measure(lambda frame: old_draw(frame, label), frames, args.draws)
+    new = measure(lambda frame: new_draw(frame, label, state), frames, args.draws)
+    new_fps = min(args.fps, PREVIEW_MAX_FPS)
+    print(f"{args.width}x{args.height} stream @ {args.fps} fps")
+    print(f"  old: {old * 1000:6.2f} ms/draw x {args.fps} draws/s = {old * args.fps * 100:5.1f}% of a core")
+    print(f"  new: {new * 1000:6.2f} ms/draw x {new_fps} draws/s = {new * new_fps * 100:5.1f}% of a core")
+    print("  off:   0.00 ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+import argparse
+import socket
+import threading
+import time
+import tracemalloc
+from stream_io import FRAME_HEADER, FrameHeader, FrameReader, pack_frame_header, unpack_frame_header
+
+# Micro-benchmark for the server receive path: the old bytes-concatenation
+# reader against FrameReader, over a loopback socketpair.
+
+
+def send_frames(sock, payload, count):
+    # Nothing is decoded here, so only the payload length in the header matters
+    header = FrameHeader(0, 0, 1, 0, 0, 0, 0.0, 0, len(payload))
+    message = pack_frame_header(header) + payload
+    for _ in range(count):
+        sock.sendall(message)
+    sock.shutdown(socket.SHUT_WR)
+
+
+class ConcatReader:
+    # The receive loop get_next_frame used before FrameReader
+    def __init__(self, sock):
+        self.sock = sock
+        self.data = b""
+        self.payload_size = FRAME_HEADER.size
+
+    def read_frame(self):
+        while len(self.data) < self.payload_size:
+            packet = self.sock.recv(4 * 1024)
+            if not packet:
+                return None
+            self.data += packet
+        msg_size = unpack_frame_header(self.data[:self.payload_size]).payload_length
+        self.data = self.data[self.payload_size:]
+        while len(self.data) < msg_size:
+            self.data += self.sock.recv(4 * 1024)
+        frame_data = self.data[:msg_size]
+        self.data = self.data[msg_size:]
+        return frame_data
+
+
+def run(reader_class, frame_size, count):
+    receiver, sender = socket.socketpair()
+    payload = bytes(frame_size)
+    reader = reader_class(receiver)
+    sender_thread = threading.Thread(target=send_frames, args=(sender, payload, count), daemon=True)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    sender_thread.start()
+    frames = 0
+    while reader.read_frame() is not None:
+        frames += 1
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    sender_thread.join()
+    receiver.close()
+    sender.close()
+    return frames, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare receive paths over a loopback socketpair")
+    parser.add_argument("--frame-size", type=int, default=1920 * 1080 * 3, help="Payload bytes per frame")
+    parser.add_argument("--count", type=int, default=50, help="Number of frames")
+    args = parser.parse_args()
+
+    print(f"{args.count} frames of {args.frame_size / 1_000_000:.2f} MB")
+    for name, reader_class in (("concat", ConcatReader), ("recv_into", FrameReader)):
+        frames, elapsed, peak = run(reader_class, args.frame_size, args.count)
+        throughput = frames * args.frame_size / elapsed / 1_000_000
+        print(f"{name:>10}: {throughput:8.1f} MB/s, {frames / elapsed:7.1f} frames/s, peak allocations {peak / 1_000_000:.2f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import argparse
+import socket
+import threading
+import time
+from delta_codec import DeltaEncoder
+from frame_codecs import get_codec
+from net_engine import NetworkEngine, ServerNetwork
+from pipeline import ClientPipeline
+from relay import RELAY_MAGIC
+from sessions import SessionRegistry, send_session_hello
+from sinks import NullSink
+from stream_io import FrameReader
+from synthetic_camera import SyntheticCamera, make_frames
+
+# Relay fan-out: one synthetic camera streams into the server over loopback
+# TCP and the server relays it to N viewers, plus one slow viewer that takes
+# --slow-ms per frame. Viewers only read frames (no decoding), so the numbers
+# are the relay's: frames each viewer got, what the slow one skipped, and CPU
+# for the whole process per viewer count.
+#   python bench_relay.py --viewers 0,1,4,16
+# The ring must fill once per received frame whatever the viewer count.
+
+
+def read_frames(sock, counts, index, delay, stopping):
+    reader = FrameReader(sock)
+    try:
+        while not stopping.is_set():
+            if reader.read_frame() is None:
+                return
+            counts[index] += 1
+            if delay:
+                time.sleep(delay)
+    except OSError:
+        pass
+
+
+def run_case(viewers, args, frames):
+    registry = SessionRegistry()
+    engine = NetworkEngine()
+    server = ServerNetwork(engine, registry, "127.0.0.1", lambda session: NullSink)
+    engine.submit(server.start(args.port)).result()
+    session = registry.create(("127.0.0.1", 0), get_codec(args.codec, args.quality), "tcp", args.delta, None)
+    sock = socket.create_connection(("127.0.0.1", args.port))
+    send_session_hello(sock, session.id, session.token)
+    client = ClientPipeline(SyntheticCamera(frames, args.fps), sock, get_codec(args.codec, args.quality),
+                            on_error=lambda error: None, delta=DeltaEncoder() if args.delta else None)
+    client.start()
+
+    stopping = threading.Event()
+    delays = [0.0] * viewers + ([args.slow_ms / 1000] if viewers else [])
+    counts = [0] * len(delays)
+    sockets = []
+    threads = []
+    for index, delay in enumerate(delays):
+        viewer = socket.create_connection(("127.0.0.1", args.port))
+        if delay:
+            viewer.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 64 * 1024)
+        send_session_hello(viewer, session.id, session.view_token, RELAY_MAGIC)
+        sockets.append(viewer)
+        threads.append(threading.Thread(target=read_frames, args=(viewer, counts, index, delay, stopping), daemon=True))
+    for thread in threads:
+        thread.start()
+
+    time.sleep(1)  # Let the stream and the viewers come up
+    counts[:] = [0] * len(counts)
+    relayed_start = session.relay.frames
+    received_start = session.pipeline.received
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    time.sleep(args.seconds)
+    elapsed = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    received = session.pipeline.received - received_start
+    relayed = session.relay.frames - relayed_start
+    skipped = [viewer.skipped for viewer in session.relay.viewers]
+    got = list(counts)
+
+    stopping.set()
+    for viewer in sockets:
+        viewer.close()
+    sock.shutdown(socket.SHUT_RDWR)
+    client.stop()
+    sock.close()
+    engine.submit(server.stop()).result()
+    engine.stop()
+
+    fast = got[:viewers]
+    line = f"{viewers:3d} viewers  received {received / elapsed:5.1f} fps, ring {relayed / elapsed:5.1f} fps"
+    if viewers:
+        line += (f"  viewers min {min(fast) / elapsed:5.1f} avg {sum(fast) / len(fast) / elapsed:5.1f} fps"
+                 f"  slow {got[-1] / elapsed:5.1f} fps, skipped {max(skipped, default=0)}")
+    print(f"{line}  CPU {cpu / elapsed:.2f} cores", flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fan one stream out to N relay viewers over loopback")
+    parser.add_argument("--viewers", default="0,1,4,16", help="viewer counts to run, plus one slow viewer each")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--codec", default="jpeg")
+    parser.add_argument("--quality", type=int, default=80)
+    parser.add_argument("--delta", action="store_true")
+    parser.add_argument("--slow-ms", type=float, default=200, help="time the slow viewer takes per frame")
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--port", type=int, default=9999)
+    args = parser.parse_args()
+
+    frames = make_frames(args.width, args.height)
+    print(f"{args.width}x{args.height} @ {args.fps} fps, {args.codec}{' delta' if args.delta else ''}, "
+          f"{args.seconds:g} s per run")
+    for viewers in (int(value) for value in args.viewers.split(",")):
+        run_case(viewers, args, frames)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+import argparse
+import json
+import time
+import numpy as np
+from frame_codecs import CODEC_PNG, CODECS, DEFAULT_JPEG_QUALITY, DEFAULT_PNG_COMPRESSION
+from udp_transport import TRANSPORTS
+from frame_buffers import COLOR_FORMAT_RGB, COLOR_FORMATS, frame_shape
+from sinks import VIRTUAL_CAM_FORMATS, NullSink
+from streamer_core import DEFAULT_PORT, StreamClient, StreamServer
+from synthetic_camera import DEFAULT_MOTION, DEFAULT_NOISE, SyntheticCamera, make_frames
+
+# Throughput/latency benchmark over loopback. A synthetic camera feeds the real
+# client path (handshake, capture/encode/send pipeline, network engine) into
+# the real server path (stream protocol, decode pipeline) with a fake virtual
+# camera sink, once per codec/transport combination. Runs headless, no camera.
+#   python bench_stream.py --width 1280 --height 720 --seconds 10 --json results.json
+#
+# Latency is capture -> first written to the sink; client and server share a
+# clock here, so it is exact. Percentiles come from the pipelines' rolling
+# metrics window (the last ~300 frames). CPU covers client and server together.
+# Copies and allocations are frame-sized ones per frame, see frame_buffers.CopyCounter.
+START_TIMEOUT = 10  # Seconds for a session to come up
+
+
+class FakeVirtualCam(NullSink):
+    # Copies each frame into its own buffer, like pyvirtualcam handing it to the driver, and takes the
+    # same color formats as sinks.VirtualCamSink
+    def __init__(self, width, height, fps, color_format=COLOR_FORMAT_RGB):
+        super().__init__(width, height, fps)
+        if color_format not in VIRTUAL_CAM_FORMATS:
+            color_format = COLOR_FORMAT_RGB
+        self.color_formats = (color_format,)
+        self.buffer = np.empty(frame_shape(color_format, width, height), dtype=np.uint8)
+
+    def send(self, frame):
+        np.copyto(self.buffer, frame)
+        self.frames += 1
+
+
+def ignore(event, *args):
+    pass
+
+
+def pump(cores, seconds, condition=None):
+    # Run the cores' event handling until condition() holds or time runs out
+    end = time.time() + seconds
+    while time.time() < end:
+        for core in cores:
+            core.handle_events(timeout=0.01)
+        if condition is not None and condition():
+            return True
+    return condition is None
+
+
+def count_drops(server_metrics, client_metrics):
+    # Queue drops on both sides, plus frames the server decoded or lost but never wrote
+    dropped = sum(stage.get("dropped", 0) for stage in client_metrics["stages"].values())
+    dropped += server_metrics["stages"]["decode"]["dropped"]
+    return dropped + sum(server_metrics["dropped"].values())
+
+
+def copies_per_frame(copies):
+    # (copies, allocations) per frame over all stages of one pipeline
+    stages = copies["stages"].values()
+    return round(sum(stage["copies"] for stage in stages), 2), round(sum(stage["allocations"] for stage in stages), 2)
+
+
+def run_case(codec, transport, frames, args):
+    result = {"codec": codec, "transport": transport}
+    server = StreamServer(ignore, port=args.port, color_format=args.color)
+    server.network.sink_factory_for = lambda session: FakeVirtualCam
+    # One run covers several codecs, and PNG's knob is a compression level rather than a quality
+    quality = args.png_level if codec == CODEC_PNG else args.quality
+    client = StreamClient(ignore, host="127.0.0.1", port=args.port, codec_name=codec, quality=quality,
+                          transport=transport, delta=args.delta, adaptive=False, passthrough=args.passthrough,
+                          open_capture=lambda index: SyntheticCamera(frames, args.fps, jpeg_quality=args.quality))
+    cores = (server, client)
+    try:
+        server.start()
+        pump(cores, START_TIMEOUT, lambda: server.network.control_server is not None)
+        client.start()
+        if not pump(cores, START_TIMEOUT, lambda: server.active_sessions() and client.pipeline is not None):
+            result["error"] = "session did not start"
+            return result
+        pump(cores, args.warmup)
+
+        session = server.active_sessions()[0]
+        start_metrics = session.pipeline.metrics()
+        start_client = client.pipeline.metrics()
+        session.pipeline.take_counters()
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        pump(cores, args.seconds)
+        elapsed = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+
+        received, _ = session.pipeline.take_counters()
+        metrics = session.pipeline.metrics()
+        client_metrics = client.pipeline.metrics()
+        written = metrics["latency"]["written"]["total"] - start_metrics["latency"]["written"]["total"]
+        sent = client_metrics["stages"]["send"]["total"] - start_client["stages"]["send"]["total"]
+        dropped = count_drops(metrics, client_metrics) - count_drops(start_metrics, start_client)
+        latency = metrics["latency"]["end_to_end"]
+        result.update({
+            "sent_fps": round(sent / elapsed, 1),
+            "fps": round(written / elapsed, 1),
+            "mb_per_s": round(received / elapsed / 1_000_000, 2),
+            "cpu_ms_per_frame": round(cpu / written * 1000, 2) if written else None,
+            "latency_ms": {key: value for key, value in latency.items() if key.endswith("_ms")},
+            "dropped": dropped,
+            "copies": {"client": copies_per_frame(client_metrics["copies"]),
+                       "server": copies_per_frame(metrics["copies"])},
+        })
+        return result
+    finally:
+        client.shutdown()
+        server.shutdown()
+
+
+def format_result(result):
+    name = f"{result['codec']:>5} {result['transport']:>4}"
+    if "error" in result:
+        return f"{name}  {result['error']}"
+    latency = result["latency_ms"]
+    return (f"{name}  {result['fps']:6.1f} fps ({result['sent_fps']:.1f} sent)  {result['mb_per_s']:7.2f} MB/s  "
+            f"CPU {result['cpu_ms_per_frame'] or 0:6.2f} ms/frame  latency p50 {latency.get('p50_ms', 0):6.1f} "
+            f"p95 {latency.get('p95_ms', 0):6.1f} p99 {latency.get('p99_ms', 0):6.1f} ms  dropped {result['dropped']}  "
+            f"copies/allocs client {'/'.join(map(str, result['copies']['client']))} "
+            f"server {'/'.join(map(str, result['copies']['server']))}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Loopback throughput/latency benchmark per codec and transport")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--motion", type=int, default=DEFAULT_MOTION, help="pixels the scene moves per frame")
+    parser.add_argument("--noise", type=int, default=DEFAULT_NOISE, help="per-pixel noise amplitude")
+    parser.add_argument("--codecs", default=",".join(CODECS))
+    parser.add_argument("--transports", default=",".join(TRANSPORTS))
+    parser.add_argument("--quality", type=int, default=DEFAULT_JPEG_QUALITY, help="JPEG quality 1-100")
+    parser.add_argument("--png-level", type=int, default=DEFAULT_PNG_COMPRESSION, help="PNG compression level 0-9")
+    parser.add_argument("--delta", action="store_true", help="enable delta mode in every case")
+    parser.add_argument("--passthrough", action="store_true", help="send the camera's MJPEG frames (jpeg cases)")
+    parser.add_argument("--color", choices=COLOR_FORMATS, help="color format raw frames are sent in "
+                                                               "(default: the virtual camera's, RGB)")
+    parser.add_argument("--warmup", type=float, default=2)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    frames = make_frames(args.width, args.height, count=args.fps, motion=args.motion, noise=args.noise)
+    print(f"{args.width}x{args.height} @ {args.fps} fps, motion {args.motion}, noise {args.noise}, "
+          f"quality {args.quality}, png level {args.png_level}{', delta' if args.delta else ''}"
+          f"{', passthrough' if args.passthrough else ''}, "
+          f"{args.seconds:g} s per case")
+    results = []
+    for codec in args.codecs.split(","):
+        for transport in args.transports.split(","):
+            result = run_case(codec, transport, frames, args)
+            print(format_result(result), flush=True)
+            results.append(result)
+
+    if args.json:
+        with open(args.json, "w") as output:
+            json.dump({"params": vars(args), "results": results}, output, indent=2)
+
+
+if __name__ == "__main__":
+    main()
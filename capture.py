@@ -0,0 +1,77 @@
+import time
+import cv2
+import numpy as np
+
+# Camera setup on the client. Resolution, frame rate and pixel format are
+# requested through capture properties before streaming; drivers fall back to
+# the closest mode they support, so the actual values are read back. In MJPEG
+# passthrough the camera's own JPEG bytes are read without decoding
+# (CAP_PROP_CONVERT_RGB off) and sent as-is, so the client does no JPEG work.
+FOURCC_MJPEG = "MJPG"
+FIRST_FRAME_TIMEOUT = 5  # Seconds to wait for the camera's first frame
+
+
+def fourcc_name(value):
+    value = int(value)
+    return "".join(chr((value >> 8 * shift) & 0xFF) for shift in range(4)).strip("\0 ")
+
+
+def negotiate_capture(capture, width=0, height=0, fps=0, pixel_format=None, passthrough=False):
+    # Requests a mode and returns the one the camera runs in: width, height, fps, format, passthrough
+    if passthrough:
+        pixel_format = FOURCC_MJPEG
+    # Format first: many cameras only offer their larger sizes and higher rates in MJPEG
+    if pixel_format:
+        capture.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*pixel_format))
+    if width and height:
+        capture.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        capture.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+    if fps:
+        capture.set(cv2.CAP_PROP_FPS, fps)
+    mode = {
+        "width": int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        "height": int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+        "fps": round(capture.get(cv2.CAP_PROP_FPS), 1),
+        "format": fourcc_name(capture.get(cv2.CAP_PROP_FOURCC)),
+    }
+    mode["passthrough"] = bool(passthrough and mode["format"] == FOURCC_MJPEG
+                               and capture.set(cv2.CAP_PROP_CONVERT_RGB, 0))
+    return mode
+
+
+def is_jpeg(frame):
+    # With CONVERT_RGB off, backends that support it return the compressed frame as a flat uint8 array
+    return (frame is not None and frame.dtype == np.uint8 and frame.ndim <= 2 and frame.size > 2
+            and frame.flat[0] == 0xFF and frame.flat[1] == 0xD8)
+
+
+def wait_for_first_frame(capture, timeout=FIRST_FRAME_TIMEOUT):
+    # Instead of a fixed warm-up sleep: returns the first frame as soon as the camera delivers one
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        ret, frame = capture.read()
+        if ret and frame is not None:
+            return frame
+        time.sleep(0.01)
+    raise RuntimeError("Webcam delivered no frames")
+
+
+def confirm_passthrough(capture, mode, first_frame):
+    # Passthrough only holds if the first frame really is JPEG; updates mode with the real frame size
+    if not mode["passthrough"]:
+        return
+    if is_jpeg(first_frame):
+        # Decoded once for the real frame size; drivers don't always report it
+        height, width = cv2.imdecode(first_frame.reshape(-1), cv2.IMREAD_COLOR).shape[:2]
+        mode.update(width=width, height=height)
+    else:
+        # The backend accepted CONVERT_RGB off but still decodes
+        capture.set(cv2.CAP_PROP_CONVERT_RGB, 1)
+        mode["passthrough"] = False
+
+
+def format_capture_mode(mode):
+    text = f"{mode['width']}x{mode['height']} @ {mode['fps']:g} fps {mode['format'] or '?'}"
+    if mode["passthrough"]:
+        text += " (passthrough)"
+    return text
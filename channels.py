@@ -0,0 +1,274 @@
+import asyncio
+import struct
+import time
+from collections import deque
+from stream_io import INITIAL_BUFFER_SIZE
+
+# Multiplexed channels on one TCP stream connection, so video and other device
+# traffic (HID or serial style reports, bulk transfers) share a link. Every
+# message on a channel is split into chunks of at most CHUNK_SIZE, each with a
+# small header: channel id, kind and length. Two mechanisms keep a busy bulk
+# channel from starving a latency-sensitive one:
+#   - Priority: queued chunks are written lowest priority number first, and
+#     only as fast as the socket takes them, so a small report waits for at
+#     most the chunk being written, not for a whole video frame.
+#   - Flow control: a sender may have at most its window of bytes on the way
+#     per channel; the receiver returns credit (a CREDIT chunk) as it takes
+#     the bytes off the connection. That bounds how much of any one channel
+#     can sit in the socket buffers ahead of another channel's chunks.
+# Both ends start every channel with DEFAULT_WINDOW; a receiver can grant
+# more with grant(). Channel 0 carries the video frames (frame header plus
+# payload, as on a plain stream connection); device channels use 1-255.
+# Only channels with a handler (on_message) receive: chunks for any other id
+# are read into scratch space, credited and dropped, so a peer can't make
+# this end buffer messages for channels it never opened.
+CHUNK_HEADER = struct.Struct("<BBI")  # Channel id, kind, payload length (granted bytes for CREDIT)
+KIND_DATA = 0  # Part of a message, more follows
+KIND_END = 1  # Last part of a message
+KIND_CREDIT = 2  # The receiver took this many bytes of the channel; no payload
+CHUNK_SIZE = 64 * 1024
+DEFAULT_WINDOW = 256 * 1024
+MAX_MESSAGE_SIZE = 64 << 20
+WRITE_BUFFER_HIGH = 64 * 1024  # Bytes the transport may buffer before queued chunks wait
+QUEUE_LIMIT = 64 * 1024  # Bytes queued per priority before senders of that priority wait
+
+VIDEO_CHANNEL = 0
+PRIORITY_INTERRUPT = 0  # Small latency-sensitive messages
+PRIORITY_CONTROL = 1
+PRIORITY_BULK = 2  # Video and bulk transfers
+PRIORITY_LEVELS = 3
+
+
+class MuxChannel:
+    def __init__(self, channel_id, priority):
+        self.id = channel_id
+        self.priority = priority
+        self.handler = None  # Called with (message view, seconds spent receiving it); the view is reused
+        # Sending
+        self.credit = DEFAULT_WINDOW
+        self.credit_available = asyncio.Event()
+        self.send_lock = asyncio.Lock()  # Chunks of two messages must not interleave
+        self.credit_wait = 0.0  # Seconds senders spent waiting for the window
+        self.bytes_sent = 0
+        self.messages_sent = 0
+        # Receiving
+        self.buffer = bytearray()
+        self.filled = 0
+        self.message_start = None
+        self.unacknowledged = 0  # Received bytes not yet returned as credit
+        self.bytes_received = 0
+        self.messages_received = 0
+        self.unhandled = 0  # Messages dropped because the channel had no handler
+
+    def metrics(self):
+        return {"priority": self.priority, "bytes_sent": self.bytes_sent, "messages_sent": self.messages_sent,
+                "bytes_received": self.bytes_received, "messages_received": self.messages_received,
+                "credit": self.credit, "credit_wait_ms": round(self.credit_wait * 1000, 1),
+                "unhandled": self.unhandled}
+
+
+class MuxProtocol(asyncio.BufferedProtocol):
+    # One multiplexed connection, used the same way on both ends. Receiving
+    # reads chunk payloads straight into the channel's reassembly buffer.
+    # send() and the other methods run on the loop; see net_engine's
+    # MuxChannelSocket for pipeline threads. Pass transport when taking over
+    # a connection from another protocol (transport.set_protocol).
+    def __init__(self, role, transport=None, on_closed=None):
+        self.role = role  # "Server" or "Client", for log lines
+        self.on_closed = on_closed  # Called with the error, or None when the peer closed
+        self.channels = {}
+        self.queues = [deque() for _ in range(PRIORITY_LEVELS)]
+        self.queued = [0] * PRIORITY_LEVELS
+        self.writable = asyncio.Event()  # Set whenever queued chunks were written
+        self.paused = False
+        self.closed = False
+        self.transport = None
+        self.header_buffer = bytearray(CHUNK_HEADER.size)
+        self.target = memoryview(self.header_buffer)
+        self.filled = 0
+        self.chunk = None  # (channel id, channel or None to drop it, kind, length) while reading a payload
+        self.scratch = None  # Payloads of dropped chunks are read into this
+        self.unknown_messages = 0  # Dropped on ids this end never used
+        self.unknown_ids = set()  # Logged once each
+        if transport is not None:
+            self.connection_made(transport)
+
+    def connection_made(self, transport):
+        self.transport = transport
+        transport.set_write_buffer_limits(high=WRITE_BUFFER_HIGH)
+
+    def channel(self, channel_id, priority=None):
+        # The channel with this id, created on first use; priority applies to what this end sends
+        channel = self.channels.get(channel_id)
+        if channel is None:
+            channel = self.channels[channel_id] = MuxChannel(channel_id, PRIORITY_INTERRUPT)
+        if priority is not None:
+            channel.priority = min(max(priority, 0), PRIORITY_LEVELS - 1)
+        return channel
+
+    def on_message(self, channel_id, handler, priority=None):
+        self.channel(channel_id, priority).handler = handler
+
+    def grant(self, channel_id, extra):
+        # Receiver side: let the peer have extra bytes on the way on this channel, beyond DEFAULT_WINDOW
+        if not self.closed:
+            self.transport.write(CHUNK_HEADER.pack(channel_id, KIND_CREDIT, extra))
+
+    async def send(self, channel_id, *parts):
+        # Queues one message, made of parts sent back to back; returns once it is all queued, which waits for
+        # window and queue space. Queued chunks are views of the parts, so only a mutable one is copied first.
+        channel = self.channel(channel_id)
+        views = [memoryview(part if isinstance(part, bytes) or isinstance(part, memoryview) and part.readonly
+                            else bytes(part)).cast("B") for part in parts]
+        views = [view for view in views if len(view)] or [memoryview(b"")]
+        async with channel.send_lock:
+            for index, view in enumerate(views):
+                final = index == len(views) - 1
+                offset = 0
+                while True:
+                    if self.closed:
+                        raise ConnectionResetError("Multiplexed connection closed")
+                    size = min(CHUNK_SIZE, channel.credit, len(view) - offset)
+                    if size <= 0 and offset < len(view):
+                        start = time.perf_counter()
+                        channel.credit_available.clear()
+                        await channel.credit_available.wait()
+                        channel.credit_wait += time.perf_counter() - start
+                        continue
+                    last = offset + size == len(view)
+                    kind = KIND_END if last and final else KIND_DATA
+                    self.queues[channel.priority].append(
+                        (CHUNK_HEADER.pack(channel.id, kind, size), view[offset:offset + size]))
+                    self.queued[channel.priority] += CHUNK_HEADER.size + size
+                    channel.credit -= size
+                    channel.bytes_sent += size
+                    offset += size
+                    self.pump()
+                    while self.queued[channel.priority] > QUEUE_LIMIT and not self.closed:
+                        self.writable.clear()
+                        await self.writable.wait()
+                    if last:
+                        break
+            channel.messages_sent += 1
+
+    def pump(self):
+        # Hand queued chunks to the transport, most urgent first, until it pushes back
+        while not self.paused and not self.closed:
+            for level, queue in enumerate(self.queues):
+                if queue:
+                    header, payload = queue.popleft()
+                    self.queued[level] -= CHUNK_HEADER.size + len(payload)
+                    self.transport.write(header)
+                    self.transport.write(payload)
+                    self.writable.set()
+                    break
+            else:
+                return
+
+    def pause_writing(self):
+        self.paused = True
+
+    def resume_writing(self):
+        self.paused = False
+        self.pump()
+
+    def get_buffer(self, sizehint):
+        return self.target[self.filled:]
+
+    def buffer_updated(self, nbytes):
+        self.filled += nbytes
+        if self.filled < len(self.target):
+            return
+        self.filled = 0
+        if self.chunk is not None:
+            self.chunk_received()
+            return
+        channel_id, kind, length = CHUNK_HEADER.unpack(self.header_buffer)
+        channel = self.channels.get(channel_id)
+        if kind == KIND_CREDIT:
+            # Credit only matters for a channel this end sends on, which exists already
+            if channel is not None:
+                channel.credit += length
+                channel.credit_available.set()
+            return
+        if kind not in (KIND_DATA, KIND_END) or length > CHUNK_SIZE or \
+                channel is not None and channel.filled + length > MAX_MESSAGE_SIZE:
+            print(f"{self.role}: Bad chunk on the multiplexed connection (channel {channel_id}, kind {kind}, {length} bytes), closing")
+            self.transport.close()
+            return
+        if channel is None or channel.handler is None:
+            if self.scratch is None:
+                self.scratch = bytearray(CHUNK_SIZE)
+            self.chunk = (channel_id, None, kind, length)
+            self.target = memoryview(self.scratch)[:length]
+            if length == 0:
+                self.chunk_received()
+            return
+        if channel.message_start is None:
+            channel.message_start = time.perf_counter()
+        end = channel.filled + length
+        if end > len(channel.buffer):
+            # Grow geometrically, keeping what arrived of the current message
+            buffer = bytearray(max(end, len(channel.buffer) * 2, INITIAL_BUFFER_SIZE if channel.id == VIDEO_CHANNEL
+                                   else CHUNK_SIZE))
+            buffer[:channel.filled] = memoryview(channel.buffer)[:channel.filled]
+            channel.buffer = buffer
+        self.chunk = (channel_id, channel, kind, length)
+        self.target = memoryview(channel.buffer)[channel.filled:end]
+        if length == 0:
+            self.chunk_received()
+
+    def chunk_received(self):
+        channel_id, channel, kind, length = self.chunk
+        self.chunk = None
+        self.target = memoryview(self.header_buffer)
+        if channel is None:
+            self.chunk_dropped(channel_id, kind, length)
+            return
+        channel.filled += length
+        channel.bytes_received += length
+        # Credit goes back in batches; the sender still has 3/4 of its window when one is due
+        channel.unacknowledged += length
+        if channel.unacknowledged >= DEFAULT_WINDOW // 4:
+            self.transport.write(CHUNK_HEADER.pack(channel.id, KIND_CREDIT, channel.unacknowledged))
+            channel.unacknowledged = 0
+        if kind != KIND_END:
+            return
+        message = memoryview(channel.buffer)[:channel.filled]
+        elapsed = time.perf_counter() - channel.message_start
+        channel.filled = 0
+        channel.message_start = None
+        channel.messages_received += 1
+        channel.handler(message, elapsed)
+
+    def chunk_dropped(self, channel_id, kind, length):
+        # Credited right away, so a sender on a channel nothing takes doesn't stall for its window
+        if length:
+            self.transport.write(CHUNK_HEADER.pack(channel_id, KIND_CREDIT, length))
+        if kind != KIND_END:
+            return
+        channel = self.channels.get(channel_id)
+        if channel is not None:
+            channel.unhandled += 1
+        else:
+            self.unknown_messages += 1
+        if channel_id not in self.unknown_ids:
+            self.unknown_ids.add(channel_id)
+            print(f"{self.role}: Dropping messages on channel {channel_id}, nothing handles it")
+
+    def connection_lost(self, exc):
+        self.closed = True
+        # Wake every waiting sender so it sees the connection is gone
+        for channel in self.channels.values():
+            channel.credit_available.set()
+        self.writable.set()
+        if self.on_closed is not None:
+            self.on_closed(exc)
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+    def metrics(self):
+        return {"queued": sum(self.queued), "unknown_messages": self.unknown_messages,
+                "channels": {channel.id: channel.metrics() for channel in list(self.channels.values())}}
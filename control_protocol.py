@@ -0,0 +1,135 @@
+import asyncio
+import struct
+import time
+from frame_codecs import parse_params
+from stream_io import ProtocolError
+
+# Control connection framing. Every message is a 4-byte little-endian length
+# followed by the message: a type word, optionally a space and its parameters
+# (the same key=value;... form as the stream parameters). Reads are exact, so
+# a message never has to be found by scanning for a delimiter and one read can
+# never return half of one or two glued together.
+#
+# Once the handshake agreed on the "heartbeat" capability, both ends send a
+# PING every HEARTBEAT_INTERVAL and answer the other's with a PONG echoing its
+# timestamp, which gives each side the round-trip time. Any message counts as
+# a sign of life; a peer silent for HEARTBEAT_TIMEOUT is treated as gone, so a
+# dead connection is noticed without waiting for a send to fail.
+CONTROL_HEADER = struct.Struct("<I")
+MAX_CONTROL_MESSAGE = 64 * 1024
+PING_MESSAGE = b"PING"
+PONG_MESSAGE = b"PONG"
+HEARTBEAT_INTERVAL = 0.5  # Seconds
+HEARTBEAT_TIMEOUT = 2.0  # Seconds without any message from the peer
+RTT_GAIN = 1 / 8  # Smoothing of the round-trip estimate, as TCP's SRTT
+
+# Capabilities negotiated in the handshake: the client offers a list in caps=,
+# the server answers with the ones both sides support
+CAP_HEARTBEAT = "heartbeat"  # PING/PONG liveness and RTT
+CAP_RESUME = "resume"  # The session survives a lost connection and can be resumed with its token
+CAP_STATS = "stats"  # Periodic STATS reports for the adaptive bitrate controller
+CAP_MUX = "mux"  # The TCP stream connection carries multiplexed channels, see channels.py
+CAPABILITIES = (CAP_HEARTBEAT, CAP_RESUME, CAP_STATS, CAP_MUX)
+
+
+def frame_message(message):
+    return CONTROL_HEADER.pack(len(message)) + message
+
+
+def split_message(message):
+    # (type, parameters) of a received message
+    kind, _, params = message.partition(b" ")
+    return kind, params
+
+
+def format_capabilities(capabilities):
+    return ",".join(sorted(capabilities))
+
+
+def parse_capabilities(params):
+    # The known capabilities in a caps= parameter; unknown ones are ignored
+    offered = parse_params(params).get("caps", "").split(",")
+    return {capability for capability in offered if capability in CAPABILITIES}
+
+
+class ControlChannel:
+    # One control connection on the engine's loop. receive() returns the next
+    # message (None once the connection is closed) and answers heartbeats on
+    # the way; send() and close() must be called on the loop, see
+    # ServerNetwork.send_control for other threads.
+    def __init__(self, reader, writer, role):
+        self.reader = reader
+        self.writer = writer
+        self.role = role  # "Server" or "Client", for log lines
+        self.last_received = time.monotonic()
+        self.heartbeat_task = None
+        self.timed_out = False
+        self.rtt = None  # Smoothed, seconds
+        self.rtt_min = None
+        self.rtt_last = None
+        self.heartbeats = 0  # PONGs received
+
+    def send(self, message):
+        if not self.writer.is_closing():
+            self.writer.write(frame_message(message))
+
+    async def read_message(self):
+        try:
+            length, = CONTROL_HEADER.unpack(await self.reader.readexactly(CONTROL_HEADER.size))
+            if length > MAX_CONTROL_MESSAGE:
+                raise ProtocolError(f"Control message too large: {length} bytes")
+            message = await self.reader.readexactly(length)
+        except asyncio.IncompleteReadError:
+            return None
+        self.last_received = time.monotonic()
+        return message
+
+    async def receive(self):
+        while True:
+            message = await self.read_message()
+            if message is None:
+                return None
+            kind, params = split_message(message)
+            if kind == PING_MESSAGE:
+                self.send(PONG_MESSAGE + b" " + params)
+            elif kind == PONG_MESSAGE:
+                self.add_rtt_sample(params)
+            else:
+                return message
+
+    def add_rtt_sample(self, params):
+        try:
+            sample = time.monotonic() - float(parse_params(params).get("ts", ""))
+        except ValueError:
+            return
+        self.heartbeats += 1
+        self.rtt_last = sample
+        self.rtt_min = sample if self.rtt_min is None else min(self.rtt_min, sample)
+        self.rtt = sample if self.rtt is None else self.rtt + RTT_GAIN * (sample - self.rtt)
+
+    def start_heartbeat(self, interval=HEARTBEAT_INTERVAL, timeout=HEARTBEAT_TIMEOUT):
+        self.heartbeat_task = asyncio.get_running_loop().create_task(self.heartbeat_loop(interval, timeout))
+
+    async def heartbeat_loop(self, interval, timeout):
+        while not self.writer.is_closing():
+            await asyncio.sleep(interval)
+            if time.monotonic() - self.last_received > timeout:
+                print(f"{self.role}: No heartbeat from the peer for {timeout:g} s, dropping the control connection")
+                self.timed_out = True
+                self.writer.close()  # Ends the pending receive() with None
+                return
+            self.send(PING_MESSAGE + f" ts={time.monotonic():.6f}".encode())
+
+    def close(self):
+        if self.heartbeat_task is not None and self.heartbeat_task is not asyncio.current_task():
+            self.heartbeat_task.cancel()
+        self.writer.close()
+
+    def metrics(self):
+        def ms(value):
+            return None if value is None else round(value * 1000, 2)
+        return {"rtt_ms": ms(self.rtt), "rtt_min_ms": ms(self.rtt_min), "rtt_last_ms": ms(self.rtt_last),
+                "heartbeats": self.heartbeats}
+
+    def rtt_report(self):
+        return "" if self.rtt is None else f" | rtt {self.rtt * 1000:.1f} ms"
@@ -0,0 +1,241 @@
+import struct
+import threading
+from collections import namedtuple
+import cv2
+import numpy as np
+from frame_codecs import DTYPE_CODES, decode_frame
+from stream_io import FrameHeader, ProtocolError, pack_frame_header
+
+# Inter-frame delta mode. The frame is split into square tiles; tiles whose
+# mean absolute difference from the last sent version is above a threshold
+# are packed into a mosaic image and encoded with the negotiated codec.
+# Keyframes (full frames) are sent periodically and whenever the chain is
+# broken, e.g. because a delta frame was dropped before it was sent. When the
+# server notices a break (a delta frame lost on the way, or a corrupt one) it
+# sends KEYFRAME on the control channel, so it waits about a round trip for the
+# next keyframe instead of up to DEFAULT_KEYFRAME_INTERVAL frames.
+#
+# Delta payload: DELTA_HEADER, the dirty tile indices as little-endian
+# uint32, then the encoded mosaic (absent when no tile changed).
+FLAG_KEYFRAME = 0x01
+FLAG_DELTA = 0x02
+DELTA_HEADER = struct.Struct("<IHHI")  # base sequence, tile size, mosaic columns, dirty tile count
+DEFAULT_TILE_SIZE = 32
+DEFAULT_KEYFRAME_INTERVAL = 60
+DEFAULT_THRESHOLD = 4.0  # Mean absolute difference (0-255) for a tile to count as changed
+MOSAIC_COLUMNS = 32
+KEYFRAME_MESSAGE = b"KEYFRAME"  # Server -> client: the delta chain is broken, send a keyframe now
+KEYFRAME_REQUEST_INTERVAL = 0.5  # Seconds between KEYFRAME requests while the chain stays broken
+
+PreparedFrame = namedtuple("PreparedFrame", ["flags", "image", "prefix", "dirty", "total"])
+
+
+def padded_shape(frame, tile_size):
+    height, width = frame.shape[:2]
+    rows = -(-height // tile_size)
+    cols = -(-width // tile_size)
+    return rows, cols, (rows * tile_size, cols * tile_size) + frame.shape[2:]
+
+
+def tile_view(buffer, tile_size):
+    # (rows, cols, tile, tile[, channels]) view of a padded buffer, without copying
+    rows, cols = buffer.shape[0] // tile_size, buffer.shape[1] // tile_size
+    tiles = buffer.reshape((rows, tile_size, cols, tile_size) + buffer.shape[2:])
+    return tiles.swapaxes(1, 2)
+
+
+def build_mosaic(tiles, tile_size, columns):
+    # Pack (n, tile, tile[, channels]) tiles into a grid image `columns` tiles wide
+    count = len(tiles)
+    rows = -(-count // columns)
+    if rows * columns > count:
+        padding = np.zeros((rows * columns - count,) + tiles.shape[1:], dtype=tiles.dtype)
+        tiles = np.concatenate([tiles, padding])
+    grid = tiles.reshape((rows, columns) + tiles.shape[1:]).swapaxes(1, 2)
+    return np.ascontiguousarray(grid).reshape((rows * tile_size, columns * tile_size) + tiles.shape[3:])
+
+
+def split_mosaic(mosaic, tile_size, columns, count):
+    tiles = tile_view(mosaic, tile_size)
+    return tiles.reshape((-1,) + tiles.shape[2:])[:count]
+
+
+class DeltaStats:
+    # Dirty-tile ratio and estimated bandwidth saved, using the last keyframe
+    # size as the cost of sending a full frame
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.keyframe_bytes = 0
+        self.reset()
+
+    def reset(self):
+        self.dirty_tiles = 0
+        self.total_tiles = 0
+        self.delta_bytes = 0
+        self.delta_frames = 0
+
+    def record(self, flags, dirty, total, payload_size):
+        with self.lock:
+            if flags & FLAG_KEYFRAME:
+                self.keyframe_bytes = payload_size
+            elif flags & FLAG_DELTA:
+                self.dirty_tiles += dirty
+                self.total_tiles += total
+                self.delta_bytes += payload_size
+                self.delta_frames += 1
+
+    def report(self):
+        with self.lock:
+            dirty = self.dirty_tiles / self.total_tiles * 100 if self.total_tiles else 0
+            full_cost = self.keyframe_bytes * self.delta_frames
+            saved = (1 - self.delta_bytes / full_cost) * 100 if full_cost else 0
+            self.reset()
+        return f"dirty {dirty:.1f}% saved ~{max(saved, 0):.0f}%"
+
+
+class DeltaEncoder:
+    # Stateful, so prepare() must be called in capture order from a single thread;
+    # encoding the returned image can then happen anywhere
+    def __init__(self, tile_size=DEFAULT_TILE_SIZE, keyframe_interval=DEFAULT_KEYFRAME_INTERVAL,
+                 threshold=DEFAULT_THRESHOLD):
+        self.tile_size = tile_size
+        self.keyframe_interval = keyframe_interval
+        self.threshold = threshold
+        self.reference = None  # Padded copy of what the server should be showing
+        self.current = None
+        self.last_sequence = None
+        self.frames_since_keyframe = 0
+        self.keyframe_requested = True
+        self.stats = DeltaStats()
+
+    def force_keyframe(self):
+        self.keyframe_requested = True
+
+    def prepare(self, frame, sequence):
+        rows, cols, shape = padded_shape(frame, self.tile_size)
+        height, width = frame.shape[:2]
+        if self.reference is None or self.reference.shape != shape or self.reference.dtype != frame.dtype:
+            self.reference = np.zeros(shape, dtype=frame.dtype)
+            self.current = np.zeros(shape, dtype=frame.dtype)
+            self.keyframe_requested = True
+
+        if self.keyframe_requested or self.frames_since_keyframe >= self.keyframe_interval:
+            self.reference[:height, :width] = frame
+            self.keyframe_requested = False
+            self.frames_since_keyframe = 0
+            self.last_sequence = sequence
+            return PreparedFrame(FLAG_KEYFRAME, frame, b"", rows * cols, rows * cols)
+
+        # Vectorized change detection: one absdiff over the padded frame, then a per-tile mean
+        self.current[:height, :width] = frame
+        difference = tile_view(cv2.absdiff(self.current, self.reference), self.tile_size)
+        tile_axes = tuple(range(2, difference.ndim))
+        dirty = difference.mean(axis=tile_axes) > self.threshold
+
+        current_tiles = tile_view(self.current, self.tile_size)
+        reference_tiles = tile_view(self.reference, self.tile_size)
+        reference_tiles[dirty] = current_tiles[dirty]
+        indices = np.flatnonzero(dirty).astype("<u4")
+        count = len(indices)
+        columns = min(count, MOSAIC_COLUMNS) or 1
+        mosaic = build_mosaic(current_tiles[dirty], self.tile_size, columns) if count else None
+
+        prefix = DELTA_HEADER.pack(self.last_sequence, self.tile_size, columns, count) + indices.tobytes()
+        self.frames_since_keyframe += 1
+        self.last_sequence = sequence
+        return PreparedFrame(FLAG_DELTA, mosaic, prefix, count, rows * cols)
+
+
+def encode_prepared(codec, frame, prepared, timestamp, sequence):
+    # Like frame_codecs.encode_frame, but the header describes the full frame
+    # while the payload carries the delta prefix and the encoded mosaic
+    if prepared.flags & FLAG_DELTA:
+        payload = prepared.prefix + (bytes(codec.encode(prepared.image)) if prepared.image is not None else b"")
+    else:
+        payload = codec.encode(frame)
+    height, width = frame.shape[:2]
+    channels = frame.shape[2] if frame.ndim == 3 else 1
+    header = FrameHeader(codec.id, prepared.flags, channels, DTYPE_CODES[frame.dtype], width, height,
+                         timestamp, sequence, len(payload))
+    return pack_frame_header(header), payload
+
+
+class DeltaDecoder:
+    # Keeps the server's persistent framebuffer and patches dirty tiles into it.
+    # apply() returns a copy of the patched frame, or None while waiting for a
+    # keyframe after the delta chain was broken; it raises ProtocolError for a
+    # delta payload that doesn't fit the framebuffer.
+    def __init__(self):
+        self.framebuffer = None
+        self.last_sequence = None
+        self.lock = threading.Lock()
+        self.stats = DeltaStats()
+
+    def apply(self, codec, header, payload):
+        with self.lock:
+            if not header.flags & FLAG_DELTA:
+                frame = decode_frame(codec, header, payload)
+                self.stats.record(header.flags, 0, 0, header.payload_length)
+                if header.flags & FLAG_KEYFRAME:
+                    self.store_keyframe(frame, header)
+                return frame
+
+            if len(payload) < DELTA_HEADER.size:
+                raise self.corrupt(f"Delta payload too short: {len(payload)} bytes")
+            base, tile_size, columns, count = DELTA_HEADER.unpack_from(payload)
+            if self.framebuffer is None or base != self.last_sequence:
+                # A frame in the chain was lost; skip deltas until the next keyframe
+                self.last_sequence = None
+                return None
+            if not tile_size or not columns:
+                raise self.corrupt(f"Bad delta header: tile size {tile_size}, {columns} mosaic columns")
+            rows, cols = self.ensure_padded(tile_size, header)
+            offset = DELTA_HEADER.size + 4 * count
+            if count > rows * cols or len(payload) < offset or (count and len(payload) == offset):
+                raise self.corrupt(f"Bad delta payload: {count} of {rows * cols} tiles in {len(payload)} bytes")
+            indices = np.frombuffer(payload, dtype="<u4", count=count, offset=DELTA_HEADER.size)
+            if count:
+                if indices.max() >= rows * cols:
+                    raise self.corrupt(f"Delta tile index {indices.max()} out of {rows * cols} tiles")
+                mosaic_rows = -(-count // columns)
+                mosaic_header = header._replace(width=columns * tile_size, height=mosaic_rows * tile_size,
+                                                payload_length=len(payload) - offset)
+                try:
+                    mosaic = decode_frame(codec, mosaic_header, payload[offset:])
+                except ValueError as e:
+                    raise self.corrupt(f"Bad delta mosaic: {e}")
+                expected = (mosaic_rows * tile_size, columns * tile_size) + self.framebuffer.shape[2:]
+                if mosaic.shape != expected:
+                    raise self.corrupt(f"Delta mosaic is {mosaic.shape}, expected {expected}")
+                tiles = split_mosaic(mosaic, tile_size, columns, count)
+                # Index the (rows, cols) tile view directly so the assignment writes through
+                tile_rows, tile_cols = np.divmod(indices, cols)
+                tile_view(self.framebuffer, tile_size)[tile_rows, tile_cols] = tiles
+            self.last_sequence = header.sequence
+            self.stats.record(header.flags, count, rows * cols, header.payload_length)
+            return self.framebuffer[:header.height, :header.width].copy()
+
+    def corrupt(self, message):
+        # Nothing was patched, but the chain is broken all the same: the next delta is dropped too
+        self.last_sequence = None
+        return ProtocolError(message)
+
+    def store_keyframe(self, frame, header):
+        if self.framebuffer is None or self.framebuffer.shape[2:] != frame.shape[2:] or self.framebuffer.dtype != frame.dtype:
+            self.framebuffer = None
+        if self.framebuffer is not None and self.framebuffer.shape[0] >= frame.shape[0] and \
+                self.framebuffer.shape[1] >= frame.shape[1]:
+            # Reuse the buffer when the frame fits in both dimensions
+            self.framebuffer[:header.height, :header.width] = frame
+        else:
+            self.framebuffer = frame.copy()
+        self.last_sequence = header.sequence
+
+    def ensure_padded(self, tile_size, header):
+        # The framebuffer must be a whole number of tiles; pad it once for this tile size
+        rows, cols, shape = padded_shape(self.framebuffer[:header.height, :header.width], tile_size)
+        if self.framebuffer.shape != shape:
+            padded = np.zeros(shape, dtype=self.framebuffer.dtype)
+            padded[:header.height, :header.width] = self.framebuffer[:header.height, :header.width]
+            self.framebuffer = padded
+        return rows, cols
@@ -0,0 +1,235 @@
+import os
+import struct
+import sys
+import threading
+import time
+from collections import namedtuple
+import cv2
+
+# Camera inventory. Backends list devices from the OS without opening them, so
+# enumeration is fast and never grabs a camera another app is using:
+#   - V4L2 on Linux: /sys/class/video4linux plus a VIDIOC_QUERYCAP ioctl, which
+#     only opens the device node (no streaming) to skip metadata-only nodes
+#   - WMI on Windows: one query for Camera/Image class devices
+# Opening each camera with OpenCV to confirm it delivers frames is optional
+# (probe=True); probes run in parallel, each with a timeout. Results are cached
+# by device id for CACHE_TTL seconds, and watch() re-enumerates in the
+# background when the device list changes (hotplug).
+CACHE_TTL = 30  # Seconds a listing or probe result stays valid
+PROBE_TIMEOUT = 3  # Seconds to wait for one camera to open
+WATCH_INTERVAL = 2  # Seconds between hotplug checks
+
+CameraDevice = namedtuple("CameraDevice", ["id", "index", "name", "backend"])
+
+# struct v4l2_capability: driver[16], card[32], bus_info[32], version, capabilities, device_caps, reserved[3]
+V4L2_CAPABILITY = struct.Struct("<16s32s32sIII12x")
+VIDIOC_QUERYCAP = 0x80685600  # _IOR('V', 0, struct v4l2_capability)
+V4L2_CAP_VIDEO_CAPTURE = 0x00000001
+V4L2_CAP_DEVICE_CAPS = 0x80000000
+
+
+class V4l2Backend:
+    name = "v4l2"
+
+    def __init__(self, sysfs_root="/sys/class/video4linux", dev_root="/dev"):
+        self.sysfs_root = sysfs_root
+        self.dev_root = dev_root
+
+    def available(self):
+        return os.path.isdir(self.sysfs_root)
+
+    def signature(self):
+        # Cheap to compute; changes whenever a node appears or disappears
+        try:
+            return tuple(sorted(os.listdir(self.sysfs_root)))
+        except OSError:
+            return ()
+
+    def read_sysfs(self, node, name):
+        try:
+            with open(os.path.join(self.sysfs_root, node, name)) as source:
+                return source.read().strip()
+        except OSError:
+            return None
+
+    def query_capabilities(self, node):
+        # (card name, bus info, capture capable) from the driver, or None if the node can't be queried
+        try:
+            import fcntl
+            fd = os.open(os.path.join(self.dev_root, node), os.O_RDONLY | os.O_NONBLOCK)
+        except (ImportError, OSError):
+            return None
+        try:
+            buffer = bytearray(V4L2_CAPABILITY.size)
+            fcntl.ioctl(fd, VIDIOC_QUERYCAP, buffer)
+        except OSError:
+            return None
+        finally:
+            os.close(fd)
+        _, card, bus_info, _, capabilities, device_caps = V4L2_CAPABILITY.unpack(buffer)
+        caps = device_caps if capabilities & V4L2_CAP_DEVICE_CAPS else capabilities
+        return (card.split(b"\0", 1)[0].decode(errors="replace"), bus_info.split(b"\0", 1)[0].decode(errors="replace"),
+                bool(caps & V4L2_CAP_VIDEO_CAPTURE))
+
+    def list_devices(self):
+        devices = []
+        for node in self.signature():
+            if not node.startswith("video") or not node[5:].isdigit():
+                continue
+            name = self.read_sysfs(node, "name") or node
+            bus_info = os.path.basename(os.path.realpath(os.path.join(self.sysfs_root, node, "device")))
+            capabilities = self.query_capabilities(node)
+            if capabilities is not None:
+                card, bus_info, capture = capabilities
+                name = card or name
+                if not capture:
+                    continue
+            elif self.read_sysfs(node, "index") not in (None, "0"):
+                # No ioctl access: a camera's extra nodes (metadata) have index 1, 2, ...
+                continue
+            # The bus position plus the node's index is stable across reboots and re-plugging into the same port
+            device_id = f"v4l2:{bus_info}:{self.read_sysfs(node, 'index') or 0}"
+            devices.append(CameraDevice(device_id, int(node[5:]), name, self.name))
+        return sorted(devices, key=lambda device: device.index)
+
+
+class WmiBackend:
+    name = "wmi"
+    QUERY = ("SELECT Name, PNPDeviceID FROM Win32_PnPEntity WHERE ConfigManagerErrorCode = 0 "
+             "AND (PNPClass = 'Camera' OR PNPClass = 'Image')")
+
+    def __init__(self):
+        self.services = threading.local()  # COM objects can't be shared between threads
+
+    def available(self):
+        if sys.platform != "win32":
+            return False
+        try:
+            import win32com.client
+        except ImportError:
+            return False
+        return True
+
+    def connect(self):
+        services = getattr(self.services, "wbem", None)
+        if services is None:
+            import pythoncom
+            import win32com.client
+            pythoncom.CoInitialize()
+            locator = win32com.client.Dispatch("WbemScripting.SWbemLocator")
+            services = self.services.wbem = locator.ConnectServer(".", "root\\cimv2")
+        return services
+
+    def list_devices(self):
+        # DirectShow numbers cameras in the order the system enumerates them, which is also the WMI order
+        devices = []
+        for index, device in enumerate(self.connect().ExecQuery(self.QUERY)):
+            devices.append(CameraDevice(f"wmi:{device.PNPDeviceID}", index, device.Name, self.name))
+        return devices
+
+    def signature(self):
+        return tuple(device.id for device in self.list_devices())
+
+
+def default_backends():
+    return [backend for backend in (V4l2Backend(), WmiBackend()) if backend.available()]
+
+
+def probe_camera(device, results, open_capture=cv2.VideoCapture):
+    # Stores whether the camera opens in results[device.id]
+    capture = open_capture(device.index)
+    try:
+        results[device.id] = capture.isOpened()
+    finally:
+        capture.release()
+
+
+class DeviceInventory:
+    def __init__(self, backends=None, ttl=CACHE_TTL, probe=False, probe_timeout=PROBE_TIMEOUT,
+                 open_capture=cv2.VideoCapture):
+        self.backends = default_backends() if backends is None else backends
+        self.ttl = ttl
+        self.probe = probe
+        self.probe_timeout = probe_timeout
+        self.open_capture = open_capture  # Camera index -> cv2.VideoCapture-like object, for probes
+        self.lock = threading.Lock()
+        self.listing = None  # (time, devices) of the last enumeration
+        self.probed = {}  # device id -> (time, opened)
+        self.watching = False
+        self.watch_thread = None
+
+    def devices(self):
+        # Cached devices, enumerated again once the cache is older than ttl
+        with self.lock:
+            listing = self.listing
+        if listing is not None and time.monotonic() - listing[0] < self.ttl:
+            return listing[1]
+        return self.refresh()
+
+    def refresh(self):
+        devices = []
+        for backend in self.backends:
+            try:
+                devices.extend(backend.list_devices())
+            except Exception as e:
+                print(f"Client: Listing cameras with {backend.name} failed: {e}")
+        if self.probe:
+            devices = self.probe_devices(devices)
+        with self.lock:
+            self.listing = (time.monotonic(), devices)
+        return devices
+
+    def probe_devices(self, devices):
+        # Open every camera without a fresh probe result at once, then keep the ones that opened
+        now = time.monotonic()
+        with self.lock:
+            known = {device_id: opened for device_id, (probed_time, opened) in self.probed.items()
+                     if now - probed_time < self.ttl}
+        pending = [device for device in devices if device.id not in known]
+        # Daemon threads with one shared deadline: some drivers block in open for a long time,
+        # and a stuck probe must neither delay the listing nor keep the process alive
+        results = {}
+        threads = [threading.Thread(target=probe_camera, args=(device, results, self.open_capture), daemon=True)
+                   for device in pending]
+        for thread in threads:
+            thread.start()
+        deadline = time.monotonic() + self.probe_timeout
+        for thread in threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+        with self.lock:
+            for device in pending:
+                self.probed[device.id] = (now, results.get(device.id, False))
+                known[device.id] = results.get(device.id, False)
+        return [device for device in devices if known[device.id]]
+
+    def signature(self):
+        signature = []
+        for backend in self.backends:
+            try:
+                signature.append(backend.signature())
+            except Exception:
+                signature.append(None)
+        return tuple(signature)
+
+    def watch(self, on_change, interval=WATCH_INTERVAL):
+        # Calls on_change(devices) from a background thread whenever a camera is added or removed
+        self.watching = True
+        self.watch_thread = threading.Thread(target=self.watch_loop, args=(on_change, interval), daemon=True)
+        self.watch_thread.start()
+
+    def watch_loop(self, on_change, interval):
+        signature = self.signature()
+        while self.watching:
+            time.sleep(interval)
+            current = self.signature()
+            if current != signature:
+                signature = current
+                on_change(self.refresh())
+
+    def stop(self):
+        self.watching = False
+
+
+def format_device(device):
+    # Dropdown label; the index in parentheses is what cv2.VideoCapture opens
+    return f"{device.name} ({device.index})"
@@ -0,0 +1,157 @@
+import asyncio
+import socket
+import time
+from control_protocol import format_capabilities, parse_capabilities, split_message
+from frame_codecs import parse_params
+
+# Server discovery by query and unicast answer. Servers no longer broadcast
+# their presence every second: a searching client broadcasts a DISCOVER query
+# to DISCOVERY_PORT, and every server that hears it answers that client alone
+# with a SERVER reply carrying its address, ports, capabilities and load (the
+# number of sessions). A subnet with nobody searching carries no discovery
+# traffic at all. The client repeats its query with a doubling delay while
+# no server answers, so a server started later is still found within
+# QUERY_RETRY_MAX. Replies are kept in a ServerDirectory for DISCOVERY_TTL
+# seconds: a client that stops and searches again picks from what it already
+# knows without asking, and of several servers it takes the least loaded.
+DISCOVERY_PORT = 9998
+DISCOVER_MESSAGE = b"DISCOVER"  # Client -> broadcast: DISCOVER id=N
+SERVER_MESSAGE = b"SERVER"  # Server -> client: SERVER id=N;ip=...;control=...;stream=...;sessions=...;caps=...
+QUERY_RETRY_MIN = 0.25  # Seconds before the first repeat of an unanswered query, doubled per repeat
+QUERY_RETRY_MAX = 2.0
+COLLECT_TIME = 0.2  # Seconds to wait for other servers after the first reply
+DISCOVERY_TTL = 10  # Seconds a reply is trusted
+
+cached_local_ip = None
+
+
+def get_local_ip():
+    # Retrieve the local IP address, once: connecting the UDP socket sends nothing but still costs a
+    # socket and a route lookup. The loopback fallback isn't kept, so a machine that starts before its
+    # network is up finds its address on a later call.
+    global cached_local_ip
+    if cached_local_ip is not None:
+        return cached_local_ip
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        # Try to connect to an external IP address to get the local IP
+        s.connect(('8.8.8.8', 80))
+        cached_local_ip = s.getsockname()[0]
+        return cached_local_ip
+    except Exception:
+        # Fallback to '127.0.0.1'
+        return '127.0.0.1'
+    finally:
+        s.close()
+
+
+def format_query(query_id):
+    return DISCOVER_MESSAGE + f" id={query_id}".encode()
+
+
+def format_server_reply(query_id, ip, control_port, stream_port, sessions, capabilities):
+    return SERVER_MESSAGE + (f" id={query_id};ip={ip};control={control_port};stream={stream_port};"
+                             f"sessions={sessions};caps={format_capabilities(capabilities)}").encode()
+
+
+class ServerInfo:
+    def __init__(self, ip, control_port, stream_port, sessions, capabilities, rtt, seen):
+        self.ip = ip
+        self.control_port = control_port
+        self.stream_port = stream_port
+        self.sessions = sessions
+        self.capabilities = capabilities
+        self.rtt = rtt  # Seconds from our query to this reply, None for a reply to another query
+        self.seen = seen  # time.monotonic() of the last reply
+
+    def load_key(self):
+        # Fewest sessions first, then the quickest to answer
+        return self.sessions, self.rtt if self.rtt is not None else float("inf")
+
+    def describe(self):
+        return {"ip": self.ip, "control_port": self.control_port, "stream_port": self.stream_port,
+                "sessions": self.sessions, "caps": sorted(self.capabilities),
+                "rtt_ms": round(self.rtt * 1000, 2) if self.rtt is not None else None}
+
+
+def format_server(server):
+    rtt = f", {server.rtt * 1000:.1f} ms" if server.rtt is not None else ""
+    return (f"{server.ip}  control {server.control_port}, stream {server.stream_port}, "
+            f"{server.sessions} session(s){rtt}  caps {format_capabilities(server.capabilities)}")
+
+
+def parse_server_reply(params, addr, sent_times, now):
+    # ServerInfo for a SERVER reply, or None if it is malformed. sent_times maps our query ids to when they went out.
+    # The server is where the reply came from: the ip= it reports about itself can be the wrong interface, or
+    # anything at all, so it is ignored. A port of 0 means it wasn't advertised.
+    values = parse_params(params)
+    try:
+        control_port = int(values.get("control", 0))
+        stream_port = int(values.get("stream", 0))
+        sessions = int(values.get("sessions", 0))
+        query_id = int(values.get("id", -1))
+    except ValueError:
+        return None
+    if not (0 <= control_port <= 0xFFFF and 0 <= stream_port <= 0xFFFF):
+        return None
+    sent = sent_times.get(query_id)
+    return ServerInfo(addr[0], control_port, stream_port, sessions, parse_capabilities(params),
+                      now - sent if sent is not None else None, now)
+
+
+class ServerDirectory:
+    # Servers that answered recently, by address
+    def __init__(self, ttl=DISCOVERY_TTL):
+        self.ttl = ttl
+        self.servers = {}
+
+    def add(self, server):
+        self.servers[server.ip] = server
+
+    def forget(self, ip):
+        self.servers.pop(ip, None)
+
+    def available(self, exclude=()):
+        # Fresh entries, least loaded first
+        now = time.monotonic()
+        for ip in [ip for ip, server in self.servers.items() if now - server.seen > self.ttl]:
+            del self.servers[ip]
+        return sorted((server for server in self.servers.values() if server.ip not in exclude),
+                      key=ServerInfo.load_key)
+
+    def best(self, exclude=()):
+        servers = self.available(exclude)
+        return servers[0] if servers else None
+
+
+class DiscoveryResponder(asyncio.DatagramProtocol):
+    # Server side: answers each query with reply(query_id)
+    def __init__(self, reply):
+        self.reply = reply
+        self.transport = None
+        self.queries = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        kind, params = split_message(data)
+        if kind != DISCOVER_MESSAGE:
+            return
+        try:
+            query_id = int(parse_params(params).get("id", 0))
+        except ValueError:
+            return
+        self.queries += 1
+        self.transport.sendto(self.reply(query_id), addr)
+
+
+class DiscoveryClientProtocol(asyncio.DatagramProtocol):
+    # Client side: passes each SERVER reply to on_reply(params, addr)
+    def __init__(self, on_reply):
+        self.on_reply = on_reply
+
+    def datagram_received(self, data, addr):
+        kind, params = split_message(data)
+        if kind == SERVER_MESSAGE:
+            self.on_reply(params, addr)
@@ -0,0 +1,165 @@
+import threading
+import cv2
+import numpy as np
+
+# Frame buffers and color formats. A frame is one contiguous uint8 array in
+# one of COLOR_FORMATS:
+#   bgr   (height, width, 3), what OpenCV captures and decodes to
+#   rgb   (height, width, 3), pyvirtualcam's default
+#   i420  (height * 3 // 2, width): the Y plane, then the U and V planes at
+#         quarter size; half the bytes of the other two
+# The raw codec can carry any of them, so a stream can arrive in the format
+# its sink takes and the server converts nothing. The format travels in the
+# frame header flags, bgr as 0 so streams without it read as before; other
+# codecs always decode to bgr. Conversions go through FrameConverter, which
+# writes into buffers it keeps instead of allocating one per frame and skips
+# frames already in a format the consumer takes. CopyCounter tallies the
+# frame-sized copies and allocations a pipeline makes, by stage, so the cost
+# per frame shows in the metrics.
+COLOR_FORMAT_BGR = "bgr"
+COLOR_FORMAT_RGB = "rgb"
+COLOR_FORMAT_I420 = "i420"
+COLOR_FORMATS = (COLOR_FORMAT_BGR, COLOR_FORMAT_RGB, COLOR_FORMAT_I420)  # Index is the flags value
+COLOR_SHIFT = 6  # Flags bits 6-7; bits 4-5 are the simulcast layer
+COLOR_MASK = 0xC0
+
+CONVERSIONS = {
+    (COLOR_FORMAT_BGR, COLOR_FORMAT_RGB): cv2.COLOR_BGR2RGB,
+    (COLOR_FORMAT_RGB, COLOR_FORMAT_BGR): cv2.COLOR_RGB2BGR,
+    (COLOR_FORMAT_BGR, COLOR_FORMAT_I420): cv2.COLOR_BGR2YUV_I420,
+    (COLOR_FORMAT_RGB, COLOR_FORMAT_I420): cv2.COLOR_RGB2YUV_I420,
+    (COLOR_FORMAT_I420, COLOR_FORMAT_BGR): cv2.COLOR_YUV2BGR_I420,
+    (COLOR_FORMAT_I420, COLOR_FORMAT_RGB): cv2.COLOR_YUV2RGB_I420,
+}
+
+
+def color_flags(color_format):
+    return COLOR_FORMATS.index(color_format) << COLOR_SHIFT
+
+
+def frame_color(flags):
+    index = (flags & COLOR_MASK) >> COLOR_SHIFT
+    if index >= len(COLOR_FORMATS):
+        raise ValueError(f"Unknown color format in frame flags: {flags:#x}")
+    return COLOR_FORMATS[index]
+
+
+def format_color_formats(color_formats):
+    return ",".join(color_formats)
+
+
+def parse_color_formats(text):
+    # Known formats from a comma-separated list, in order
+    return tuple(name for name in (item.strip() for item in text.split(",")) if name in COLOR_FORMATS)
+
+
+def frame_shape(color_format, width, height):
+    if color_format == COLOR_FORMAT_I420:
+        return height * 3 // 2, width
+    return height, width, 3
+
+
+def frame_size(frame, color_format):
+    # (width, height) of the image a frame holds
+    if color_format == COLOR_FORMAT_I420:
+        return frame.shape[1], frame.shape[0] * 2 // 3
+    return frame.shape[1], frame.shape[0]
+
+
+def convert_frame(frame, source, target, dst=None):
+    # frame in the target format, written into dst when given. I420 needs an even size, so an odd
+    # last row or column is dropped.
+    if source == target:
+        return frame
+    if target == COLOR_FORMAT_I420 and (frame.shape[0] | frame.shape[1]) & 1:
+        frame = frame[:frame.shape[0] & ~1, :frame.shape[1] & ~1]
+    return cv2.cvtColor(frame, CONVERSIONS[(source, target)], dst=dst)
+
+
+class FrameConverter:
+    # Color conversion and resizing for one consumer thread, into one reused
+    # buffer per target. A result stays valid until the next call for the same
+    # target, so whoever gets it must be done with it by then (sinks are: they
+    # copy or write out the frame before send returns).
+    def __init__(self, copies=None):
+        self.copies = copies  # Optional CopyCounter
+        self.buffers = {}  # target -> array
+
+    def buffer(self, target, shape, stage):
+        # The buffer for target, new only when there was none of this shape; counted as one copy into it
+        buffer = self.buffers.get(target)
+        allocated = buffer is None or buffer.shape != shape
+        if allocated:
+            buffer = self.buffers[target] = np.empty(shape, dtype=np.uint8)
+        if self.copies is not None:
+            self.copies.copy(stage, buffer.nbytes, allocated)
+        return buffer
+
+    def convert(self, frame, source, targets):
+        # (frame, format) in one of targets: frame itself if its format is one, else converted to the first
+        if source in targets:
+            return frame, source
+        target = targets[0]
+        width, height = frame_size(frame, source)
+        if target == COLOR_FORMAT_I420:
+            width, height = width & ~1, height & ~1
+        buffer = self.buffer(target, frame_shape(target, width, height), "convert")
+        return convert_frame(frame, source, target, dst=buffer), target
+
+    def resize(self, frame, size):
+        # A bgr or rgb frame scaled to size (width, height)
+        buffer = self.buffer("resize", (size[1], size[0], frame.shape[2]), "resize")
+        return cv2.resize(frame, size, dst=buffer, interpolation=cv2.INTER_LINEAR)
+
+
+class CopyCounter:
+    # Frame-sized copies and allocations by stage, averaged per frame. copy() is
+    # a copy into a buffer (allocated when that buffer is new), allocate() a new
+    # buffer filled some other way, e.g. by a decoder or the camera; frame()
+    # counts the frames the averages are taken over.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.frames = 0
+        self.stages = {}  # name -> [copies, allocations, bytes copied, bytes allocated]
+
+    def frame(self):
+        with self.lock:
+            self.frames += 1
+
+    def copy(self, stage, nbytes, allocated=True):
+        with self.lock:
+            counts = self.stages.setdefault(stage, [0, 0, 0, 0])
+            counts[0] += 1
+            counts[2] += nbytes
+            if allocated:
+                counts[1] += 1
+                counts[3] += nbytes
+
+    def allocate(self, stage, nbytes):
+        with self.lock:
+            counts = self.stages.setdefault(stage, [0, 0, 0, 0])
+            counts[1] += 1
+            counts[3] += nbytes
+
+    def snapshot(self):
+        with self.lock:
+            return self.frames, {name: list(counts) for name, counts in self.stages.items()}
+
+    def metrics(self):
+        frames, stages = self.snapshot()
+        per_frame = max(frames, 1)
+        result = {"frames": frames, "stages": {}}
+        for name, (copies, allocations, copied, allocated) in stages.items():
+            result["stages"][name] = {"copies": round(copies / per_frame, 2), "allocations": round(allocations / per_frame, 2),
+                            "copied_mb": round(copied / per_frame / 1e6, 2),
+                            "allocated_mb": round(allocated / per_frame / 1e6, 2)}
+        return result
+
+    def report(self):
+        # Totals per frame over all stages, e.g. "copies 1.0 (2.8 MB), allocations 1.0 per frame"
+        frames, stages = self.snapshot()
+        per_frame = max(frames, 1)
+        copies = sum(counts[0] for counts in stages.values()) / per_frame
+        allocations = sum(counts[1] for counts in stages.values()) / per_frame
+        copied = sum(counts[2] for counts in stages.values()) / per_frame
+        return f"copies {copies:.1f} ({copied / 1e6:.1f} MB), allocations {allocations:.1f} per frame"
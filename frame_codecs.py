@@ -0,0 +1,180 @@
+import cv2
+import numpy as np
+from frame_buffers import COLOR_FORMAT_BGR, COLOR_FORMAT_I420, frame_color, frame_shape, frame_size
+from stream_io import FrameHeader, pack_frame_header
+
+# Codec names used on the control channel
+CODEC_RAW = "raw"
+CODEC_JPEG = "jpeg"
+CODEC_PNG = "png"
+DEFAULT_CODEC = CODEC_JPEG
+DEFAULT_JPEG_QUALITY = 80
+DEFAULT_PNG_COMPRESSION = 3
+
+# Sample types carried in the frame header's dtype field
+DTYPE_CODES = {np.dtype(np.uint8): 0, np.dtype(np.uint16): 1}
+DTYPES = {code: dtype for dtype, code in DTYPE_CODES.items()}
+
+
+class FrameCodec:
+    # Base class for frame codecs; subclasses turn a BGR ndarray into bytes and back.
+    # decode gets the frame header so it knows the target shape and dtype.
+    name = None
+    id = None
+    quality_range = None  # (lowest, highest) quality, for codecs that have the knob
+    default_quality = None
+
+    def __init__(self, quality=None):
+        self.quality = quality
+
+    def encode(self, frame):
+        raise NotImplementedError
+
+    def decode(self, data, header):
+        raise NotImplementedError
+
+    def params(self):
+        return {"codec": self.name, "quality": self.quality}
+
+
+class RawCodec(FrameCodec):
+    # Uncompressed passthrough; the shape comes from the frame header, so decoding
+    # is a np.frombuffer view over the received payload with no copy. Frames
+    # keep the color format they were sent in (see frame_buffers.py). The
+    # encoded payload is a read-only view of the frame, which senders may queue
+    # without copying, so the frame must not change once it is encoded.
+    name = CODEC_RAW
+    id = 0
+
+    def encode(self, frame):
+        return np.ascontiguousarray(frame).data.cast("B").toreadonly()
+
+    def decode(self, data, header):
+        frame = np.frombuffer(data, dtype=DTYPES[header.dtype])
+        if frame_color(header.flags) == COLOR_FORMAT_I420:
+            return frame.reshape(frame_shape(COLOR_FORMAT_I420, header.width, header.height))
+        if header.channels == 1:
+            return frame.reshape(header.height, header.width)
+        return frame.reshape(header.height, header.width, header.channels)
+
+
+class JpegCodec(FrameCodec):
+    # Lossy JPEG, quality 1-100
+    name = CODEC_JPEG
+    id = 1
+    quality_range = (1, 100)
+    default_quality = DEFAULT_JPEG_QUALITY
+
+    def __init__(self, quality=None):
+        if quality is None:
+            quality = self.default_quality
+        super().__init__(max(1, min(100, int(quality))))
+
+    def encode(self, frame):
+        ok, buf = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        if not ok:
+            raise ValueError("JPEG encoding failed")
+        return buf.tobytes()
+
+    def decode(self, data, header):
+        frame = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            raise ValueError("JPEG decoding failed")
+        return frame
+
+
+class PngCodec(FrameCodec):
+    # Lossless PNG, quality is the zlib compression level 0-9. It doesn't share
+    # JPEG's scale, so callers pass None unless a level was asked for: JPEG's
+    # default 80 would clamp to level 9, the slowest.
+    name = CODEC_PNG
+    id = 2
+    quality_range = (0, 9)
+    default_quality = DEFAULT_PNG_COMPRESSION
+
+    def __init__(self, quality=None):
+        if quality is None:
+            quality = self.default_quality
+        super().__init__(max(0, min(9, int(quality))))
+
+    def encode(self, frame):
+        ok, buf = cv2.imencode(".png", frame, [cv2.IMWRITE_PNG_COMPRESSION, self.quality])
+        if not ok:
+            raise ValueError("PNG encoding failed")
+        return buf.tobytes()
+
+    def decode(self, data, header):
+        frame = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+        if frame is None:
+            raise ValueError("PNG decoding failed")
+        return frame
+
+
+CODECS = {
+    CODEC_RAW: RawCodec,
+    CODEC_JPEG: JpegCodec,
+    CODEC_PNG: PngCodec,
+}
+CODECS_BY_ID = {codec.id: codec for codec in CODECS.values()}
+
+
+def get_codec(name, quality=None):
+    if name not in CODECS:
+        raise ValueError(f"Unknown codec: {name}")
+    return CODECS[name](quality)
+
+
+def encode_frame(codec, frame, timestamp, sequence, flags=0, color_format=COLOR_FORMAT_BGR):
+    # Encode a frame and build its wire header; returns (header bytes, payload). The header has the image
+    # size, which for I420 isn't the array's; flags must carry a color format other than BGR.
+    payload = codec.encode(frame)
+    width, height = frame_size(frame, color_format)
+    channels = frame.shape[2] if frame.ndim == 3 else 1
+    header = FrameHeader(codec.id, flags, channels, DTYPE_CODES[frame.dtype], width, height,
+                         timestamp, sequence, len(payload))
+    return pack_frame_header(header), payload
+
+
+def wrap_encoded(codec, payload, width, height, timestamp, sequence):
+    # Header for a payload that is already encoded, e.g. the camera's own MJPEG frames; no work on the pixels
+    header = FrameHeader(codec.id, 0, 3, DTYPE_CODES[np.dtype(np.uint8)], width, height,
+                         timestamp, sequence, len(payload))
+    return pack_frame_header(header), payload
+
+
+def decode_frame(codec, header, payload):
+    # Decode with the negotiated codec, or whichever codec the header names
+    if header.codec_id != codec.id:
+        if header.codec_id not in CODECS_BY_ID:
+            raise ValueError(f"Unknown codec id: {header.codec_id}")
+        codec = CODECS_BY_ID[header.codec_id]()
+    return codec.decode(payload, header)
+
+
+def format_codec_params(codec):
+    # Serialize codec parameters for the control handshake, e.g. b"codec=jpeg;quality=80"
+    return ";".join(f"{key}={value}" for key, value in codec.params().items() if value is not None).encode()
+
+
+def parse_params(data):
+    # Parse b"key=value;key=value" from the control handshake into a dict
+    params = {}
+    for item in data.decode(errors="ignore").split(";"):
+        if "=" in item:
+            key, value = item.split("=", 1)
+            params[key.strip()] = value.strip()
+    return params
+
+
+def parse_codec_params(data):
+    # Parse parameters sent by format_codec_params, falling back to the default codec
+    params = parse_params(data)
+    name = params.get("codec", DEFAULT_CODEC)
+    if name not in CODECS:
+        name = DEFAULT_CODEC
+    quality = params.get("quality")
+    try:
+        quality = int(quality) if quality is not None else None
+    except ValueError:
+        quality = None
+    return get_codec(name, quality)
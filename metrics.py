@@ -0,0 +1,92 @@
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Metrics export for the streaming core. collect() returns a JSON-serializable
+# snapshot (per-stage percentiles, fps, queue depths, drops and per-frame
+# latencies, see pipeline.collect_metrics); the exporter serves it at
+# http://127.0.0.1:<port>/metrics and/or appends it to a JSON-lines log every
+# interval. Both run as tasks on the network engine's event loop; the log's
+# file I/O goes to a thread of its own so a slow disk never stalls the loop.
+DEFAULT_METRICS_INTERVAL = 5  # Seconds between log lines
+METRICS_HOST = "127.0.0.1"  # Local only; put a reverse proxy in front to scrape remotely
+
+
+def append_line(log, line):
+    log.write(line + "\n")
+    log.flush()
+
+
+class MetricsExporter:
+    def __init__(self, engine, collect, port=None, log_path=None, interval=DEFAULT_METRICS_INTERVAL):
+        self.engine = engine
+        self.collect = collect
+        self.port = port
+        self.log_path = log_path
+        self.interval = interval
+        self.server = None
+        self.log_task = None
+        self.log_executor = None  # One thread, so the log's writes and close happen in order
+
+    def snapshot(self):
+        return {"time": round(time.time(), 3), **self.collect()}
+
+    def start(self):
+        self.engine.submit(self.start_async()).result()
+
+    async def start_async(self):
+        if self.port is not None:
+            self.server = await asyncio.start_server(self.handle_request, METRICS_HOST, self.port)
+            print(f"Metrics: Serving http://{METRICS_HOST}:{self.port}/metrics")
+        if self.log_path is not None:
+            self.log_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="metrics-log")
+            self.log_task = asyncio.get_running_loop().create_task(self.write_log())
+            print(f"Metrics: Logging to {self.log_path} every {self.interval} s")
+
+    async def handle_request(self, reader, writer):
+        # Just enough HTTP/1.0 for curl and scrapers: GET /metrics returns the current snapshot
+        try:
+            request = await asyncio.wait_for(reader.readline(), 5)
+            while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request.split()
+            if len(parts) >= 2 and parts[0] == b"GET" and parts[1] in (b"/", b"/metrics"):
+                status, body = b"200 OK", json.dumps(self.snapshot()).encode()
+            else:
+                status, body = b"404 Not Found", b"{}"
+            writer.write(b"HTTP/1.0 " + status + b"\r\nContent-Type: application/json\r\n" +
+                         f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+            await writer.drain()
+        except (OSError, asyncio.TimeoutError):
+            pass
+        finally:
+            writer.close()
+
+    async def write_log(self):
+        # The snapshot is taken on the loop, the file is opened, written and closed on the log thread
+        loop = asyncio.get_running_loop()
+        log = await loop.run_in_executor(self.log_executor, open, self.log_path, "a")
+        try:
+            while True:
+                await asyncio.sleep(self.interval)
+                await loop.run_in_executor(self.log_executor, append_line, log, json.dumps(self.snapshot()))
+        finally:
+            self.log_executor.submit(log.close)
+
+    def stop(self):
+        self.engine.submit(self.stop_async()).result()
+
+    async def stop_async(self):
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+        if self.log_task is not None:
+            self.log_task.cancel()
+            try:
+                await self.log_task
+            except (asyncio.CancelledError, OSError):
+                pass  # Cancelled, or the log couldn't be opened or written
+            self.log_task = None
+            self.log_executor.shutdown(wait=False)
+            self.log_executor = None
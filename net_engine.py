@@ -0,0 +1,954 @@
+import asyncio
+import hmac
+import queue
+import socket
+import struct
+import threading
+import time
+from channels import PRIORITY_BULK, PRIORITY_INTERRUPT, VIDEO_CHANNEL, MuxProtocol
+from control_protocol import CAP_HEARTBEAT, CAP_MUX, CAP_RESUME, CAPABILITIES, ControlChannel, format_capabilities, \
+    parse_capabilities, split_message
+from delta_codec import KEYFRAME_MESSAGE
+from discovery import COLLECT_TIME, DISCOVERY_PORT, QUERY_RETRY_MAX, QUERY_RETRY_MIN, DiscoveryClientProtocol, \
+    DiscoveryResponder, ServerDirectory, format_query, format_server_reply, parse_server_reply
+from frame_buffers import COLOR_FORMAT_BGR, parse_color_formats
+from frame_codecs import CODEC_RAW, format_codec_params, parse_codec_params, parse_params
+from relay import RELAY_MAGIC, WATCH_FAILED_MESSAGE, WATCH_MESSAGE
+from stream_io import FRAME_HEADER, INITIAL_BUFFER_SIZE, MAX_PAYLOAD_SIZE, ProtocolError, unpack_frame_header
+from sessions import SERVER_BACKLOG, SESSION_HELLO, SESSION_MAGIC, pack_session_hello
+from simulcast import format_layers, parse_layers
+from udp_transport import SOCKET_BUFFER_SIZE, TRANSPORT_TCP, TRANSPORT_UDP, TRANSPORTS, UdpFrameSender, UdpReassembler
+
+# All networking runs as coroutines and protocols on one asyncio event loop in
+# a single background thread, instead of a daemon thread per socket: the
+# discovery responder/queries, the control connections, the TCP stream server
+# and the UDP stream endpoints. Encoding and decoding stay on the pipeline
+# worker threads; the loop only moves bytes. Pipeline threads reach the loop
+# through the Loop*Socket adapters, and the loop reports back to the GUI
+# through NetworkEngine.events, a queue of (name, args) it drains with after().
+#
+# Control messages are length-prefixed, see control_protocol.py. A client
+# opens with START_STREAMING (or RESUME for a session it already has) and
+# ends its session with CLOSE; a connection that just drops leaves a
+# resumable session waiting RESUME_GRACE seconds for the client to come back.
+# A viewer sends WATCH instead and then reads the session's relayed frames.
+CONTROL_PORT = 9997
+START_MESSAGE = b"START_STREAMING"
+STOP_MESSAGE = b"STOP_STREAMING"
+RESUME_MESSAGE = b"RESUME"  # Client -> server: RESUME session=N;token=T
+RESUMED_MESSAGE = b"RESUMED"  # Server -> client, with the same parameters as the START_STREAMING reply
+RESUME_FAILED_MESSAGE = b"RESUME_FAILED"
+CLOSE_MESSAGE = b"CLOSE"  # Client -> server: the session is over, don't wait for a resume
+REFUSED_MESSAGE = b"REFUSED"  # Server -> client instead of START_STREAMING, with the reason
+CONNECT_TIMEOUT = 5
+RESUME_GRACE = 10  # Seconds a detached session waits for its client to resume it
+RESUME_RETRY_MIN = 0.05  # First client retry delay, doubled per failed attempt
+RESUME_RETRY_MAX = 1.0
+
+
+def format_stream_params(codec, transport, delta_enabled, layers=(), color_format=COLOR_FORMAT_BGR):
+    params = format_codec_params(codec) + f";transport={transport};delta={int(delta_enabled)}".encode()
+    if layers:
+        params += f";layers={format_layers(layers)}".encode()
+    if color_format != COLOR_FORMAT_BGR:
+        params += f";color={color_format}".encode()
+    return params
+
+
+def parse_color_format(data):
+    # The color format a START_STREAMING reply names for raw frames
+    return (parse_color_formats(parse_params(data).get("color", "")) or (COLOR_FORMAT_BGR,))[0]
+
+
+def parse_transport(data):
+    transport = parse_params(data).get("transport", TRANSPORT_TCP)
+    return transport if transport in TRANSPORTS else TRANSPORT_TCP
+
+
+class NetworkEngine:
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.events = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro):
+        # Schedule a coroutine from any thread; returns a concurrent.futures.Future
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def call(self, callback, *args):
+        self.loop.call_soon_threadsafe(callback, *args)
+
+    def post(self, name, *args):
+        # Event for the GUI thread, see take_events
+        self.events.put((name, args))
+
+    def take_events(self, timeout=None):
+        # All pending events; with a timeout, waits up to that long for the first one
+        events = []
+        if timeout is not None:
+            try:
+                events.append(self.events.get(timeout=timeout))
+            except queue.Empty:
+                return events
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                return events
+
+    def stop(self, timeout=1):
+        # Cancel whatever is still pending (reconnects, readers), then stop the loop
+        try:
+            self.submit(self.cancel_tasks()).result(timeout)
+        except Exception:
+            pass
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    async def cancel_tasks(self):
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class LoopStreamSocket:
+    # Blocking sendall() for pipeline threads on top of an asyncio StreamWriter.
+    # The caller waits for drain(), so TCP backpressure still reaches the pipeline.
+    # send_parts() writes several buffers, e.g. a frame header and its payload,
+    # one after the other instead of joining them into a copy first.
+    def __init__(self, engine, writer):
+        self.engine = engine
+        self.writer = writer
+
+    def sendall(self, data):
+        self.engine.submit(self.send(data)).result()
+
+    def send_parts(self, parts):
+        self.engine.submit(self.send(*parts)).result()
+
+    async def send(self, *parts):
+        if self.writer.is_closing():
+            raise ConnectionResetError("Stream connection closed")
+        for part in parts:
+            self.writer.write(part)
+        await self.writer.drain()
+
+    def shutdown(self, how):
+        self.engine.call(self.writer.close)
+
+    def close(self):
+        self.engine.call(self.writer.close)
+
+
+class MuxChannelSocket:
+    # Blocking sendall() for pipeline threads on one channel of a multiplexed connection.
+    # Like LoopStreamSocket the caller waits, here until the message is queued within the channel's window.
+    def __init__(self, engine, mux, channel_id):
+        self.engine = engine
+        self.mux = mux
+        self.channel_id = channel_id
+
+    def sendall(self, data):
+        self.engine.submit(self.mux.send(self.channel_id, data)).result()
+
+    def send_parts(self, parts):
+        self.engine.submit(self.mux.send(self.channel_id, *parts)).result()
+
+    def shutdown(self, how):
+        self.engine.call(self.mux.close)
+
+    def close(self):
+        self.engine.call(self.mux.close)
+
+
+class LoopDatagramSocket:
+    # sendto() for UdpFrameSender on top of a connected asyncio datagram transport
+    def __init__(self, engine, transport):
+        self.engine = engine
+        self.transport = transport
+
+    def sendto(self, data, address):
+        # The sender reuses its datagram buffer, so the loop gets a copy
+        if self.transport.is_closing():
+            raise ConnectionResetError("Datagram transport closed")
+        self.engine.call(self.send, bytes(data))
+        return len(data)
+
+    def send(self, data):
+        # Fragments still queued on the loop when the transport closes are dropped, not each logged
+        if not self.transport.is_closing():
+            self.transport.sendto(data)
+
+    def setsockopt(self, *args):
+        self.transport.get_extra_info("socket").setsockopt(*args)
+
+    def shutdown(self, how):
+        self.engine.call(self.transport.close)
+
+    def close(self):
+        self.engine.call(self.transport.close)
+
+
+class FrameStreamProtocol(asyncio.BufferedProtocol):
+    # Server side of a TCP stream connection: a session hello, then frames (or,
+    # for a viewer's VIEW hello, nothing more: the relay takes the connection over).
+    # asyncio reads straight into the header buffer or the reusable payload
+    # buffer, like stream_io.FrameReader's recv_into.
+    def __init__(self, on_hello):
+        self.on_hello = on_hello  # Called with (protocol, hello magic, session id, token); returns False to reject
+        self.on_frame = None  # Set by on_hello: (header, payload view, frame size, seconds spent receiving)
+        self.on_closed = None  # Set by on_hello: (error or None)
+        self.transport = None
+        self.header_buffer = bytearray(max(FRAME_HEADER.size, SESSION_HELLO.size))
+        self.buffer = bytearray(INITIAL_BUFFER_SIZE)
+        self.target = memoryview(self.header_buffer)[:SESSION_HELLO.size]
+        self.reading_hello = True
+        self.header = None
+        self.filled = 0
+        self.frame_start = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def get_buffer(self, sizehint):
+        return self.target[self.filled:]
+
+    def buffer_updated(self, nbytes):
+        if self.filled == 0 and self.frame_start is None:
+            self.frame_start = time.perf_counter()
+        self.filled += nbytes
+        if self.filled < len(self.target):
+            return
+        self.filled = 0
+        if self.reading_hello:
+            magic, session_id, token = SESSION_HELLO.unpack(self.target)
+            if magic not in (SESSION_MAGIC, RELAY_MAGIC) or not self.on_hello(self, magic, session_id, token):
+                print("Server: Stream connection without a matching session, closing it")
+                self.transport.close()
+                return
+            self.reading_hello = False
+            if self.on_frame is None:
+                return  # Handed over to another protocol
+            self.expect_header()
+        elif self.header is None:
+            try:
+                self.header = unpack_frame_header(self.target)
+            except ProtocolError as e:
+                print(f"Server: {e}")
+                self.transport.close()
+                return
+            size = self.header.payload_length
+            if size > len(self.buffer):
+                self.buffer = bytearray(min(max(size, len(self.buffer) * 2), MAX_PAYLOAD_SIZE))
+            self.target = memoryview(self.buffer)[:size]
+            if size == 0:
+                self.deliver()
+        else:
+            self.deliver()
+
+    def deliver(self):
+        # The payload view is only valid until the next frame; the pipeline copies it
+        self.on_frame(self.header, self.target, FRAME_HEADER.size + len(self.target),
+                      time.perf_counter() - self.frame_start)
+        self.expect_header()
+
+    def expect_header(self):
+        self.target = memoryview(self.header_buffer)[:FRAME_HEADER.size]
+        self.header = None
+        self.frame_start = None
+
+    def connection_lost(self, exc):
+        if self.on_closed is not None:
+            self.on_closed(exc)
+
+
+class UdpStreamProtocol(asyncio.DatagramProtocol):
+    # Server side of a UDP session: reassembles fragments into frames. Datagrams
+    # count only from the address that last sent the session hello with the
+    # session's token; everything else is dropped as a bad datagram. A valid
+    # hello from a new address moves the session there (e.g. a NAT rebinding).
+    def __init__(self, reassembler, on_frame, session_id, token):
+        self.reassembler = reassembler
+        self.on_frame = on_frame
+        self.session_id = session_id
+        self.token = token.encode()
+        self.peer = None
+
+    def datagram_received(self, data, addr):
+        if len(data) == SESSION_HELLO.size and data[:len(SESSION_MAGIC)] == SESSION_MAGIC:
+            _, session_id, token = SESSION_HELLO.unpack(data)
+            if session_id == self.session_id and hmac.compare_digest(self.token, token):
+                if addr != self.peer:
+                    print(f"Server: UDP stream of session #{session_id} from {addr[0]}:{addr[1]}")
+                    self.peer = addr
+            else:
+                self.reassembler.reject()
+            return
+        if addr != self.peer:
+            self.reassembler.reject()
+            return
+        start = time.perf_counter()
+        frame = self.reassembler.add(memoryview(data), time.time())
+        if frame is not None:
+            header, payload, size = frame
+            self.on_frame(header, payload, size, time.perf_counter() - start)
+
+
+class ServerNetwork:
+    # Discovery responder, control server and shared TCP stream server for the server mode.
+    # sink_factory_for(session) returns the sink factory for a new session's pipeline,
+    # recorder_for(session) an optional RecordingWriter for its received frames,
+    # refusal_for(addr) the reason to refuse a new session, or None to accept it.
+    # channel_handlers maps a device channel id to handler(session, message) for
+    # multiplexed sessions; channel_socket() sends the other way.
+    def __init__(self, engine, sessions, local_ip, sink_factory_for, recorder_for=None, refusal_for=None):
+        self.engine = engine
+        self.sessions = sessions
+        self.local_ip = local_ip
+        self.sink_factory_for = sink_factory_for
+        self.recorder_for = recorder_for
+        self.refusal_for = refusal_for
+        self.color_formats = (COLOR_FORMAT_BGR,)  # Formats the sinks take, preferred first, for raw streams
+        self.stream_port = None
+        self.control_server = None
+        self.stream_server = None
+        self.responder = None  # discovery.DiscoveryResponder
+        self.closing = set()  # close_session tasks started from callbacks, awaited by stop
+        self.control_tasks = set()  # Running handle_control coroutines, awaited by stop
+        self.stopping = False  # Lost connections end their sessions instead of waiting for a resume
+        self.channel_handlers = {}
+
+    async def start(self, stream_port):
+        loop = asyncio.get_running_loop()
+        self.stream_port = stream_port
+        self.stopping = False
+        try:
+            self.control_server = await asyncio.start_server(self.handle_control, "", CONTROL_PORT,
+                                                             backlog=SERVER_BACKLOG, reuse_address=True)
+            self.stream_server = await loop.create_server(lambda: FrameStreamProtocol(self.attach_stream), "",
+                                                          stream_port, backlog=SERVER_BACKLOG, reuse_address=True)
+        except OSError as e:
+            await self.stop()
+            self.engine.post("server_error", e)
+            return
+        print("Server: Control listener started")
+        print(f"Server: Listening on {self.local_ip}:{stream_port}")
+        # Shared with other servers on this host: each gets its own copy of a broadcast query
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            sock.bind(("", DISCOVERY_PORT))
+            _, self.responder = await loop.create_datagram_endpoint(lambda: DiscoveryResponder(self.discovery_reply),
+                                                                    sock=sock)
+            print("Server: Answering discovery queries")
+        except OSError as e:
+            sock.close()
+            print(f"Server: Cannot answer discovery queries, clients need --host: {e}")
+
+    def discovery_reply(self, query_id):
+        return format_server_reply(query_id, self.local_ip, CONTROL_PORT, self.stream_port, len(self.sessions),
+                                   CAPABILITIES)
+
+    def discovery_metrics(self):
+        responder = self.responder
+        return {"queries": responder.queries} if responder is not None else None
+
+    async def handle_control(self, reader, writer):
+        addr = writer.get_extra_info("peername")
+        print(f"Server: Received control connection from {addr}")
+        task = asyncio.current_task()
+        self.control_tasks.add(task)
+        task.add_done_callback(self.control_tasks.discard)
+        channel = ControlChannel(reader, writer, "Server")
+        session = None
+        ended = False
+        try:
+            message = await asyncio.wait_for(channel.receive(), CONNECT_TIMEOUT)
+            kind, params = split_message(message or b"")
+            if kind == START_MESSAGE:
+                print("Server: Received start command from client")
+                session = await self.start_session(channel, addr, params)
+            elif kind == RESUME_MESSAGE:
+                session = await self.resume_session(channel, addr, params)
+            elif kind == WATCH_MESSAGE:
+                self.watch_session(channel, addr, params)
+                await channel.writer.drain()
+            elif kind == STOP_MESSAGE:
+                print("Server: Received stop command from client")
+                self.engine.post("stop_requested")
+                channel.send(STOP_MESSAGE)
+            elif message is not None:
+                print("Server: Unknown control message:", message)
+            while session is not None:
+                message = await channel.receive()
+                if message is None:
+                    break
+                if split_message(message)[0] == CLOSE_MESSAGE:
+                    ended = True
+                    break
+                print(f"Server: Unknown control message from {session.label()}:", message)
+        except (OSError, asyncio.TimeoutError, ProtocolError) as e:
+            print(f"Server: Control connection error from {addr}: {e}")
+        finally:
+            channel.close()
+            if session is not None:
+                await self.control_lost(session, channel, ended)
+
+    async def start_session(self, channel, addr, params):
+        reason = self.refusal_for(addr) if self.refusal_for is not None else None
+        if reason is not None:
+            print(f"Server: Refusing session from {addr}: {reason}")
+            channel.send(REFUSED_MESSAGE + b" " + reason.encode())
+            await channel.writer.drain()
+            return None
+        # Accept the client's codec (unknown codecs fall back to the default), transport and delta mode
+        delta_enabled = parse_params(params).get("delta") == "1"
+        session = self.sessions.create(addr, parse_codec_params(params), parse_transport(params), delta_enabled,
+                                       channel)
+        session.capabilities = parse_capabilities(params)
+        if session.transport != TRANSPORT_TCP:
+            session.capabilities.discard(CAP_MUX)  # Channels need the reliable stream connection
+        # Simulcast layers are accepted as offered; delta frames patch one framebuffer, so not with delta mode
+        if not delta_enabled:
+            session.layers = parse_layers(parse_params(params).get("layers", ""))
+        # Raw frames come in the first format the sinks take that the client offers (colors=...), so the
+        # server has nothing to convert; delta tiles are patched as BGR
+        if session.codec.name == CODEC_RAW and not delta_enabled:
+            offered = parse_color_formats(parse_params(params).get("colors", ""))
+            session.color_format = next((color_format for color_format in self.color_formats
+                                         if color_format in offered), COLOR_FORMAT_BGR)
+        print(f"Server: Session {session.id} from {addr} using {self.session_params(session).decode()}")
+        try:
+            # Be ready to receive before confirming so the client can connect right away
+            stream_port = await self.open_session_stream(session)
+            channel.send(START_MESSAGE + b" " + self.session_reply(session, stream_port))
+            await channel.writer.drain()
+        except Exception as e:
+            print(f"Server: Error starting session {session.id}: {e}")
+            await self.close_session(session.id, e)
+            return None
+        self.start_heartbeat(session, channel)
+        self.engine.post("session_started", session)
+        return session
+
+    def session_params(self, session):
+        return format_stream_params(session.codec, session.transport, session.delta_enabled, session.layers,
+                                    session.color_format) + \
+            f";caps={format_capabilities(session.capabilities)}".encode()
+
+    def session_reply(self, session, stream_port):
+        return self.session_params(session) + \
+            f";session={session.id};token={session.token};stream_port={stream_port}".encode()
+
+    def start_heartbeat(self, session, channel):
+        if CAP_HEARTBEAT in session.capabilities:
+            channel.start_heartbeat()
+
+    async def resume_session(self, channel, addr, params):
+        # Hand a detached (or about to be) session to the client's new connection
+        params = parse_params(params)
+        session_id = params.get("session", "")
+        session = self.sessions.get(int(session_id)) if session_id.isdigit() else None
+        if session is None or CAP_RESUME not in session.capabilities or \
+                not hmac.compare_digest(session.token, params.get("token", "")):
+            print(f"Server: Cannot resume session {session_id or '?'} for {addr}")
+            channel.send(RESUME_FAILED_MESSAGE)
+            return None
+        if session.resume_timer is not None:
+            session.resume_timer.cancel()
+            session.resume_timer = None
+        old_channel, session.control_conn = session.control_conn, channel
+        if old_channel is not None:
+            old_channel.close()
+        session.address = addr
+        session.resumes += 1
+        session.subscription = None  # The client's new pipeline needs its layer subscription again
+        session.layers_sent = None
+        # The client opens a new stream: a TCP one attaches with its hello, a UDP one gets a fresh endpoint
+        old_transport, session.stream_transport = session.stream_transport, None
+        if old_transport is not None:
+            old_transport.close()
+        try:
+            stream_port = await self.open_session_stream(session)
+            channel.send(RESUMED_MESSAGE + b" " + self.session_reply(session, stream_port))
+            await channel.writer.drain()
+        except Exception as e:
+            print(f"Server: Error resuming session {session.label()}: {e}")
+            await self.close_session(session.id, e)
+            return None
+        print(f"Server: Session {session.label()} resumed")
+        self.start_heartbeat(session, channel)
+        self.engine.post("session_resumed", session)
+        return session
+
+    def watch_session(self, channel, addr, params):
+        # A viewer wants the frames of a session (the oldest if it names none); they come on its own stream
+        # connection, so the control connection ends with the reply
+        session_id = parse_params(params).get("session", "")
+        if session_id.isdigit():
+            session = self.sessions.get(int(session_id))
+        else:
+            session = next((session for session in self.sessions.all() if session.pipeline is not None), None)
+        if session is None:
+            print(f"Server: No session {session_id or 'to watch'} for viewer {addr}")
+            channel.send(WATCH_FAILED_MESSAGE)
+            return
+        print(f"Server: Viewer {addr} watching session {session.label()}")
+        channel.send(WATCH_MESSAGE + b" " + format_stream_params(session.codec, TRANSPORT_TCP, session.delta_enabled) +
+                     f";session={session.id};token={session.view_token};stream_port={self.stream_port}".encode())
+
+    async def control_lost(self, session, channel, ended):
+        # The session's control connection is gone: ended on purpose, or dropped
+        if session.control_conn is not channel:
+            return  # Already resumed on a newer connection
+        session.control_conn = None
+        if ended or self.stopping or CAP_RESUME not in session.capabilities:
+            await self.close_session(session.id, None)
+        else:
+            print(f"Server: Lost the control connection of session {session.label()}, "
+                  f"keeping it {RESUME_GRACE} s for a resume")
+            self.hold_session(session)
+
+    def hold_session(self, session):
+        if session.resume_timer is None:
+            session.resume_timer = self.engine.loop.call_later(
+                RESUME_GRACE, self.schedule_close, session.id, ConnectionError("Client did not resume the session"))
+
+    def stream_lost(self, session, transport, error):
+        # A TCP stream connection closed; a resumable session waits for the client to reconnect it
+        if session.stream_transport is not transport:
+            return  # Replaced by a resume
+        session.stream_transport = None
+        if self.stopping or CAP_RESUME not in session.capabilities:
+            self.schedule_close(session.id, error)
+        else:
+            print(f"Server: Lost the stream connection of session {session.label()}, waiting for a resume")
+            self.hold_session(session)
+
+    async def open_session_stream(self, session):
+        # Returns the port the client should stream to
+        if session.transport != TRANSPORT_UDP:
+            return self.stream_port
+        # Each UDP session gets its own endpoint, so datagrams never need demultiplexing; a resumed
+        # session gets a new one too, so datagrams still in flight from the old sender can't interfere
+        reassembler = UdpReassembler()
+        session.stream_transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+            lambda: UdpStreamProtocol(reassembler, lambda *frame: session.pipeline.feed(*frame), session.id,
+                                      session.token),
+            local_addr=("0.0.0.0", 0))
+        try:
+            session.stream_transport.get_extra_info("socket").setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                                                                          SOCKET_BUFFER_SIZE)
+        except OSError:
+            pass
+        if session.pipeline is None:
+            self.start_pipeline(session, reassembler)
+        else:
+            session.pipeline.loss_stats = reassembler
+        return session.stream_transport.get_extra_info("sockname")[1]
+
+    def attach_stream(self, protocol, magic, session_id, token):
+        # The session ids are sequential, so the hello must also carry the session's token (a viewer's for VIEW)
+        session = self.sessions.get(session_id)
+        if session is None:
+            return False
+        expected = session.view_token if magic == RELAY_MAGIC else session.token
+        if not hmac.compare_digest(expected.encode(), token):
+            print(f"Server: Wrong token in the stream hello for session {session.label()}")
+            return False
+        if magic == RELAY_MAGIC:
+            session.relay.attach(protocol.transport, protocol.transport.get_extra_info("peername")[0])
+            return True
+        if session.transport != TRANSPORT_TCP or session.stream_transport is not None:
+            return False
+        print(f"Server: Stream connection for session {session.label()}")
+        transport = session.stream_transport = protocol.transport
+        if session.pipeline is None:
+            self.start_pipeline(session, None)
+        if CAP_MUX in session.capabilities:
+            # From here on the connection carries channels; the frame protocol only read the hello
+            session.mux = MuxProtocol("Server", transport, lambda error: self.stream_lost(session, transport, error))
+            session.mux.on_message(VIDEO_CHANNEL, lambda message, elapsed: self.feed_video(session, message, elapsed),
+                                   PRIORITY_BULK)
+            for channel_id, handler in self.channel_handlers.items():
+                session.mux.on_message(channel_id, lambda message, elapsed, handler=handler: handler(session, message))
+            transport.set_protocol(session.mux)
+            return True
+        protocol.on_frame = session.pipeline.feed
+        protocol.on_closed = lambda error: self.stream_lost(session, transport, error)
+        return True
+
+    def feed_video(self, session, message, elapsed):
+        # One framed message from the video channel, same layout as on a plain stream connection
+        try:
+            header = unpack_frame_header(message[:FRAME_HEADER.size])
+        except (ProtocolError, struct.error) as e:
+            print(f"Server: {e}")
+            session.mux.close()
+            return
+        session.pipeline.feed(header, message[FRAME_HEADER.size:FRAME_HEADER.size + header.payload_length],
+                              len(message), elapsed)
+
+    def channel_socket(self, session, channel_id, priority=PRIORITY_INTERRUPT):
+        # Thread-safe sender for a device channel to one client, or None if its stream isn't multiplexed
+        mux = session.mux
+        if mux is None:
+            return None
+        self.engine.call(mux.channel, channel_id, priority)
+        return MuxChannelSocket(self.engine, mux, channel_id)
+
+    def start_pipeline(self, session, loss_stats):
+        # Decode and output run on the session's own threads; the loop feeds it received frames
+        recorder = self.recorder_for(session) if self.recorder_for is not None else None
+        session.start_pipeline(None, self.sink_factory_for(session), loss_stats=loss_stats, recorder=recorder,
+                               on_closed=lambda error: self.engine.call(self.schedule_close, session.id, error),
+                               request_keyframe=lambda: self.send_control(session, KEYFRAME_MESSAGE))
+
+    def schedule_close(self, session_id, error):
+        task = self.engine.loop.create_task(self.close_session(session_id, error))
+        self.closing.add(task)
+        task.add_done_callback(self.closing.discard)
+
+    async def close_session(self, session_id, error):
+        # Only this client's session ends; the server keeps serving the others
+        session = self.sessions.remove(session_id)
+        if session is None:
+            return
+        if session.resume_timer is not None:
+            session.resume_timer.cancel()
+            session.resume_timer = None
+        if session.stream_transport is not None:
+            session.stream_transport.close()
+        if session.control_conn is not None:
+            session.control_conn.close()
+            session.control_conn = None
+        session.relay.close()
+        # Joining the pipeline threads blocks, so it happens off the loop
+        await asyncio.get_running_loop().run_in_executor(None, session.close)
+        self.engine.post("session_closed", session, error)
+
+    def send_control(self, session, message):
+        # Thread-safe write of a control message to one client
+        self.engine.call(self.write_control, session, message)
+
+    def write_control(self, session, message):
+        channel = session.control_conn
+        if channel is not None:
+            channel.send(message)
+
+    async def stop(self):
+        self.stopping = True
+        if self.responder is not None:
+            self.responder.transport.close()
+            self.responder = None
+            print("Server: Stopped answering discovery queries")
+        for server in (self.control_server, self.stream_server):
+            if server is not None:
+                server.close()
+        self.control_server = None
+        self.stream_server = None
+        print("Server: Control listener stopped")
+        # Send stop command to every client, then end their sessions
+        sessions = self.sessions.all()
+        for session in sessions:
+            self.write_control(session, STOP_MESSAGE)
+            print(f"Server: Sent stop command to client {session.label()}")
+        if not sessions:
+            print("Server: No clients connected")
+        await asyncio.gather(*(self.close_session(session.id, None) for session in sessions), *self.closing)
+        # Closed sessions end their control handlers; let them finish before the loop can be stopped
+        await asyncio.gather(*self.control_tasks, return_exceptions=True)
+        self.engine.post("server_stopped")
+
+
+class ClientNetwork:
+    # Discovery queries, control connection and stream connection for the client mode.
+    # request is the START_STREAMING parameter string, kept current by the GUI.
+    # channel_handlers maps a device channel id to handler(message) for a
+    # multiplexed stream; channel_socket() sends to the server on one.
+    def __init__(self, engine, local_ip):
+        self.engine = engine
+        self.local_ip = local_ip
+        self.request = b""
+        self.searching = False
+        self.discovery_transport = None
+        self.directory = ServerDirectory()  # Servers that answered our queries
+        self.ports = {}  # Server address -> (control port, stream port) it advertised, kept beyond the directory's TTL
+        self.search_task = None
+        self.query_id = 0
+        self.query_times = {}  # Query id -> time.monotonic() it was sent, for the reply RTT
+        self.reply_arrived = asyncio.Event()
+        self.control = None  # ControlChannel to the server
+        self.resume_task = None
+        self.stream = None
+        self.mux = None  # channels.MuxProtocol of a multiplexed stream connection
+        self.channel_handlers = {}
+
+    async def start_discovery(self):
+        # The query socket stays open for the life of the client; a search runs whenever no server is in use
+        await self.open_discovery()
+        self.start_search()
+
+    async def open_discovery(self):
+        if self.discovery_transport is None:
+            self.discovery_transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+                lambda: DiscoveryClientProtocol(self.server_seen), family=socket.AF_INET, allow_broadcast=True)
+
+    def start_search(self):
+        self.searching = True
+        if self.search_task is None or self.search_task.done():
+            print("Client: Searching for servers")
+            self.search_task = self.engine.loop.create_task(self.search())
+
+    async def search(self):
+        # Known servers first; otherwise query until one answers, then give the others COLLECT_TIME to
+        # answer too and connect to the least loaded
+        delay = QUERY_RETRY_MIN
+        while self.searching:
+            if self.directory.best(exclude=(self.local_ip,)) is None:
+                self.send_query()
+                try:
+                    await asyncio.wait_for(self.reply_arrived.wait(), delay)
+                except asyncio.TimeoutError:
+                    delay = min(delay * 2, QUERY_RETRY_MAX)
+                    continue
+                await asyncio.sleep(COLLECT_TIME)
+            server = self.directory.best(exclude=(self.local_ip,))
+            if not self.searching or server is None:
+                continue
+            self.searching = False
+            print(f"Client: Discovered server IP: {server.ip} ({server.sessions} session(s))")
+            self.engine.post("server_discovered", server.ip)
+            self.engine.loop.create_task(self.connect(server.ip))
+
+    def send_query(self):
+        self.query_id += 1
+        self.query_times = {self.query_id: time.monotonic()}  # Replies to older queries carry no RTT
+        self.reply_arrived.clear()
+        try:
+            self.discovery_transport.sendto(format_query(self.query_id), ("<broadcast>", DISCOVERY_PORT))
+        except OSError as e:
+            print(f"Client: Error sending discovery query: {e}")
+
+    def server_seen(self, params, addr):
+        server = parse_server_reply(params, addr, self.query_times, time.monotonic())
+        if server is not None:
+            self.directory.add(server)
+            self.ports[server.ip] = (server.control_port, server.stream_port)
+            # A server on this machine is listed but never connected to by a search
+            if server.ip != self.local_ip:
+                self.reply_arrived.set()
+
+    async def watch(self, server_ip, session_id):
+        # A viewer's request for a relayed session; posts watch_accepted (server ip, stream parameters) or
+        # watch_failed. Without a server address the first server that has a session is asked.
+        try:
+            if server_ip is None:
+                server_ip = next((server.ip for server in await self.find_servers() if server.sessions), None)
+                if server_ip is None:
+                    raise ConnectionError("No server with a session to watch")
+            message = WATCH_MESSAGE + (f" session={session_id}".encode() if session_id is not None else b"")
+            channel, kind, params = await self.open_control(server_ip, message)
+            channel.close()
+            if kind != WATCH_MESSAGE:
+                raise ConnectionError("No such session on the server")
+        except (OSError, asyncio.TimeoutError, ProtocolError) as e:
+            print(f"Client: Cannot watch: {e}")
+            self.engine.post("watch_failed", server_ip, e)
+            return
+        self.engine.post("watch_accepted", server_ip, params)
+
+    async def find_servers(self, wait=QUERY_RETRY_MAX):
+        # One query; every server that answers within wait seconds, least loaded first
+        await self.open_discovery()
+        self.send_query()
+        await asyncio.sleep(wait)
+        return self.directory.available()
+
+    def connect_to(self, server_ip):
+        # Thread-safe: skip discovery and connect to a known server
+        self.engine.call(self.start_connect, server_ip)
+
+    def start_connect(self, server_ip):
+        self.searching = False
+        self.engine.loop.create_task(self.connect(server_ip))
+
+    def control_port(self, server_ip):
+        # The control port the server advertised, or the default for one that never answered a query
+        return self.ports.get(server_ip, (0, 0))[0] or CONTROL_PORT
+
+    def stream_port(self, server_ip, default):
+        # The shared stream port the server advertised; the START_STREAMING reply names the session's own
+        return self.ports.get(server_ip, (0, 0))[1] or default
+
+    async def open_control(self, server_ip, message):
+        # Connects, sends the opening message and returns (channel, reply type, reply parameters)
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(server_ip, self.control_port(server_ip)),
+                                                CONNECT_TIMEOUT)
+        channel = ControlChannel(reader, writer, "Client")
+        try:
+            channel.send(message)
+            await writer.drain()
+            reply = await asyncio.wait_for(channel.receive(), CONNECT_TIMEOUT)
+        except BaseException:
+            channel.close()
+            raise
+        if reply is None:
+            channel.close()
+            raise ConnectionError("Server closed the control connection")
+        return (channel, *split_message(reply))
+
+    async def connect(self, server_ip):
+        try:
+            # Propose a codec and transport; the server answers with the parameters it accepted
+            print("Client: Sending start command to server")
+            channel, kind, params = await self.open_control(server_ip, START_MESSAGE + b" " + self.request)
+            if kind == REFUSED_MESSAGE:
+                channel.close()
+                raise ConnectionError(f"Server refused the session: {params.decode(errors='replace')}")
+            if kind != START_MESSAGE:
+                channel.close()
+                raise ConnectionError(f"Unexpected response from server: {kind}")
+        except Exception as e:
+            print(f"Client: Error sending start command: {e}")
+            # Not picked from the directory again until it answers a query
+            self.directory.forget(server_ip)
+            self.reset_connection()
+            self.engine.post("connect_failed", server_ip, e)
+            return
+        self.control = channel
+        self.engine.post("stream_accepted", server_ip, params)
+        await self.read_control_messages(channel, params)
+
+    def resume(self, server_ip, session_id, token):
+        # Thread-safe: get the session back on a new control connection, straight to the server
+        self.engine.call(self.start_resume, server_ip, session_id, token)
+
+    def start_resume(self, server_ip, session_id, token):
+        self.close_control(ended=False)
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+        self.searching = False
+        self.resume_task = self.engine.loop.create_task(self.resume_session(server_ip, session_id, token))
+
+    async def resume_session(self, server_ip, session_id, token):
+        # Retries right away and then with a doubling delay, for as long as the server keeps the session
+        deadline = time.monotonic() + RESUME_GRACE
+        delay = RESUME_RETRY_MIN
+        message = RESUME_MESSAGE + f" session={session_id};token={token}".encode()
+        while True:
+            try:
+                channel, kind, params = await self.open_control(server_ip, message)
+                break
+            except (OSError, asyncio.TimeoutError, ProtocolError) as e:
+                if time.monotonic() + delay > deadline:
+                    print(f"Client: Cannot resume session {session_id}: {e}")
+                    self.engine.post("resume_failed", server_ip, e)
+                    return
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RESUME_RETRY_MAX)
+        if kind != RESUMED_MESSAGE:
+            channel.close()
+            print(f"Client: Server refused to resume session {session_id}")
+            self.engine.post("resume_failed", server_ip, ConnectionError("Session no longer exists"))
+            return
+        self.control = channel
+        self.engine.post("stream_resumed", server_ip, params)
+        await self.read_control_messages(channel, params)
+
+    async def read_control_messages(self, channel, params):
+        if CAP_HEARTBEAT in parse_capabilities(params):
+            channel.start_heartbeat()
+        try:
+            while True:
+                message = await channel.receive()
+                if self.control is not channel:
+                    return  # We closed it ourselves, see close_control
+                if message is None:
+                    if not channel.timed_out:
+                        print("Client: Control connection closed by server")
+                    self.engine.post("server_disconnected")
+                    return
+                self.engine.post("control_message", message)
+        except (OSError, ProtocolError) as e:
+            if self.control is channel:
+                print(f"Client: Error receiving control message: {e}")
+                self.engine.post("server_disconnected")
+
+    def control_metrics(self):
+        control = self.control
+        return control.metrics() if control is not None else None
+
+    def rtt_report(self):
+        control = self.control
+        return control.rtt_report() if control is not None else ""
+
+    def open_stream(self, transport, address, session_id, token, multiplexed=False):
+        # Blocking; called from the client streaming thread. Returns a socket-like sender for ClientPipeline.
+        return self.engine.submit(self.open_stream_async(transport, address, session_id, token,
+                                                         multiplexed)).result(CONNECT_TIMEOUT)
+
+    async def open_stream_async(self, transport, address, session_id, token, multiplexed):
+        self.mux = None
+        if multiplexed:
+            # Video goes on its channel at bulk priority, device traffic on the others
+            stream_transport, self.mux = await asyncio.get_running_loop().create_connection(
+                lambda: MuxProtocol("Client"), *address)
+            stream_transport.write(pack_session_hello(session_id, token))
+            self.mux.channel(VIDEO_CHANNEL, PRIORITY_BULK)
+            for channel_id, handler in self.channel_handlers.items():
+                self.mux.on_message(channel_id, lambda message, elapsed, handler=handler: handler(message))
+            self.stream = MuxChannelSocket(self.engine, self.mux, VIDEO_CHANNEL)
+        elif transport == TRANSPORT_UDP:
+            # Frames are fragmented into datagrams to the session's own port; there is no connection to set up
+            datagram_transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+                asyncio.DatagramProtocol, remote_addr=address)
+            self.stream = UdpFrameSender(LoopDatagramSocket(self.engine, datagram_transport), address,
+                                         pack_session_hello(session_id, token))
+        else:
+            _, writer = await asyncio.open_connection(*address)
+            # Tell the server which session this stream connection belongs to
+            writer.write(pack_session_hello(session_id, token))
+            self.stream = LoopStreamSocket(self.engine, writer)
+        return self.stream
+
+    def channel_socket(self, channel_id, priority=PRIORITY_INTERRUPT):
+        # Thread-safe sender for a device channel, or None while the stream isn't multiplexed
+        mux = self.mux
+        if mux is None:
+            return None
+        self.engine.call(mux.channel, channel_id, priority)
+        return MuxChannelSocket(self.engine, mux, channel_id)
+
+    def channel_metrics(self):
+        mux = self.mux
+        return mux.metrics() if mux is not None else None
+
+    def reset(self):
+        # Thread-safe: drop the server connection and go back to searching
+        self.engine.call(self.reset_connection)
+
+    def close_control(self, ended):
+        # ended tells the server the session is over rather than interrupted
+        if self.resume_task is not None and self.resume_task is not asyncio.current_task():
+            self.resume_task.cancel()
+        self.resume_task = None
+        if self.control is not None:
+            if ended:
+                self.control.send(CLOSE_MESSAGE)
+            self.control.close()
+            self.control = None
+
+    def reset_connection(self):
+        self.close_control(ended=True)
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+        if self.discovery_transport is not None:
+            self.start_search()
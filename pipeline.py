@@ -0,0 +1,740 @@
+import bisect
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, CancelledError
+import cv2
+from frame_codecs import CODEC_JPEG, encode_frame, decode_frame, wrap_encoded
+from delta_codec import KEYFRAME_REQUEST_INTERVAL, encode_prepared
+from frame_buffers import COLOR_FORMAT_BGR, COLOR_FORMAT_I420, CopyCounter, FrameConverter, color_flags, convert_frame, \
+    frame_color, frame_size
+from simulcast import frame_layer, layer_flags
+from sinks import DEFAULT_SINK_FPS
+
+CAPTURE_QUEUE_SIZE = 2
+SEND_QUEUE_SIZE = 3
+ENCODER_THREADS = 2
+DECODE_QUEUE_SIZE = 2
+DECODER_THREADS = 2
+METRICS_WINDOW = 300  # Samples kept per series, about 10 s at 30 fps
+PERCENTILES = (50, 95, 99)
+JITTER_MIN_DELAY = 0.01  # Seconds of buffering kept even on a perfectly steady network
+JITTER_MAX_DELAY = 0.5
+JITTER_MAX_FRAMES = 16  # Decoded frames held at most; the oldest are dropped beyond that
+SOURCE_FPS_WAIT = 1.0  # Seconds the writer waits for a source fps estimate before opening the sink
+
+
+class DropOldestQueue:
+    # Bounded FIFO that never blocks the producer: when full, the oldest item is
+    # discarded (and passed to on_drop) so latency stays flat under backpressure.
+    def __init__(self, maxsize, on_drop=None):
+        self.items = deque()
+        self.maxsize = maxsize
+        self.on_drop = on_drop
+        self.dropped = 0
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def put(self, item):
+        with self.condition:
+            if len(self.items) >= self.maxsize:
+                oldest = self.items.popleft()
+                self.dropped += 1
+                if self.on_drop:
+                    self.on_drop(oldest)
+            self.items.append(item)
+            self.condition.notify()
+
+    def get(self, timeout=None):
+        # Returns None on timeout or once the queue is closed and empty
+        with self.condition:
+            if not self.items and not self.closed:
+                self.condition.wait(timeout)
+            if not self.items:
+                return None
+            return self.items.popleft()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def qsize(self):
+        return len(self.items)
+
+
+class LatencySeries:
+    # Rolling window of (time, seconds) samples. snapshot() gives percentiles and
+    # the sample rate without resetting anything, so several readers can share it.
+    def __init__(self, window=METRICS_WINDOW):
+        self.samples = deque(maxlen=window)
+        self.lock = threading.Lock()
+        self.total = 0
+
+    def add(self, seconds):
+        with self.lock:
+            self.samples.append((time.perf_counter(), seconds))
+            self.total += 1
+
+    def snapshot(self):
+        with self.lock:
+            samples = list(self.samples)
+            total = self.total
+        result = {"total": total, "fps": 0.0}
+        if not samples:
+            return result
+        span = samples[-1][0] - samples[0][0]
+        if span > 0:
+            result["fps"] = round((len(samples) - 1) / span, 1)
+        values = sorted(value for _, value in samples)
+        for point in PERCENTILES:
+            result[f"p{point}_ms"] = round(values[min(len(values) - 1, len(values) * point // 100)] * 1000, 2)
+        return result
+
+
+class JitterBuffer:
+    # Decoded frames ordered by sender timestamp and released on a playout
+    # clock: a frame is due at timestamp + base transit + target delay, where
+    # base transit is the smallest (ready - sender timestamp) seen recently,
+    # which also cancels any offset between the two clocks, and the target delay
+    # follows the p95 of the transit jitter. take() returns the newest due frame
+    # and drops older due ones, so a burst after a stall doesn't pile up delay;
+    # when nothing new is due the caller repeats the last frame.
+    def __init__(self, min_delay=JITTER_MIN_DELAY, max_delay=JITTER_MAX_DELAY, max_frames=JITTER_MAX_FRAMES,
+                 window=METRICS_WINDOW):
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.max_frames = max_frames
+        self.lock = threading.Lock()
+        self.arrived = threading.Condition(self.lock)
+        self.frames = []  # (timestamp, index, frame, received time), sorted
+        self.transits = deque(maxlen=window)
+        self.intervals = deque(maxlen=30)  # Between consecutive sender timestamps, for the source fps
+        self.last_put = None
+        self.last_released = float("-inf")
+        self.base = 0.0
+        self.delay = min_delay
+        self.underruns = 0  # Sink ticks with the buffer empty
+        self.repeated = 0  # Sink ticks that showed the previous frame again
+        self.dropped = 0  # Frames skipped to hold the delay, beyond max_frames, or duplicates
+        self.late = 0  # Frames that arrived after a newer one was already shown
+
+    def put(self, timestamp, index, frame, received_time, now):
+        with self.lock:
+            if timestamp <= self.last_released:
+                self.late += 1
+                return
+            position = bisect.bisect_left(self.frames, timestamp, key=lambda item: item[0])
+            if position < len(self.frames) and self.frames[position][0] == timestamp:
+                self.dropped += 1  # A second copy of a frame still buffered
+                return
+            self.transits.append(now - timestamp)
+            self.base = min(self.transits)
+            jitter = sorted(self.transits)[len(self.transits) * 95 // 100] - self.base
+            self.delay = min(max(jitter, self.min_delay), self.max_delay)
+            if self.last_put is not None and timestamp > self.last_put:
+                self.intervals.append(timestamp - self.last_put)
+            self.last_put = timestamp if self.last_put is None else max(self.last_put, timestamp)
+            self.frames.insert(position, (timestamp, index, frame, received_time))
+            if len(self.frames) > self.max_frames:
+                self.frames.pop(0)
+                self.dropped += 1
+            self.arrived.notify()
+
+    def take(self, now):
+        # Newest due frame as (timestamp, index, frame, received time), or None
+        with self.lock:
+            due = 0
+            while due < len(self.frames) and self.frames[due][0] + self.base + self.delay <= now:
+                due += 1
+            if not due:
+                if self.frames:
+                    self.repeated += 1
+                else:
+                    self.underruns += 1
+                return None
+            released = self.frames[due - 1]
+            self.dropped += due - 1
+            del self.frames[:due]
+            self.last_released = released[0]
+            return released
+
+    def wait(self, timeout):
+        # Sleeps until the oldest buffered frame is due or timeout passes; a frame arriving meanwhile is waited for too
+        deadline = time.time() + timeout
+        with self.arrived:
+            while True:
+                wake = min(deadline, self.frames[0][0] + self.base + self.delay) if self.frames else deadline
+                now = time.time()
+                if wake <= now:
+                    return
+                self.arrived.wait(wake - now)
+
+    def source_fps(self):
+        # Median sender frame rate, None until a few frames arrived
+        with self.lock:
+            intervals = sorted(self.intervals)
+        if len(intervals) < 3:
+            return None
+        return 1 / intervals[len(intervals) // 2]
+
+    def metrics(self):
+        with self.lock:
+            return {"frames": len(self.frames), "target_ms": round(self.delay * 1000, 1), "underruns": self.underruns,
+                    "repeated": self.repeated, "dropped": self.dropped, "late": self.late}
+
+
+class StageStats:
+    # Per-stage timing, averaged over the frames handled since the last reset,
+    # plus a rolling LatencySeries for the metrics export
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.frames = 0
+        self.total_time = 0.0
+        self.series = LatencySeries()
+
+    def record(self, elapsed):
+        with self.lock:
+            self.frames += 1
+            self.total_time += elapsed
+        self.series.add(elapsed)
+
+    def reset(self):
+        # Returns (frames, average seconds per frame) and starts a new window
+        with self.lock:
+            frames, total_time = self.frames, self.total_time
+            self.frames = 0
+            self.total_time = 0.0
+        return frames, (total_time / frames if frames else 0.0)
+
+
+def format_stage_report(stats, queues):
+    # One-line summary of average time per stage plus depth and drops of its input queue
+    parts = []
+    for name, stage in stats.items():
+        _, average = stage.reset()
+        part = f"{name} {average * 1000:.1f} ms"
+        queue = queues.get(name)
+        if queue is not None:
+            part += f" q{queue.qsize()} drop {queue.dropped}"
+        parts.append(part)
+    return " | ".join(parts)
+
+
+def collect_metrics(stats, queues, latency):
+    # Per-stage duration percentiles, fps, queue depth and drops, plus per-frame
+    # latencies measured from an earlier timestamp of the same frame
+    stages = {}
+    for name, stage in stats.items():
+        entry = stage.series.snapshot()
+        queue = queues.get(name)
+        if queue is not None:
+            entry["queue"] = queue.qsize()
+            entry["dropped"] = queue.dropped
+        stages[name] = entry
+    return {"stages": stages, "latency": {name: series.snapshot() for name, series in latency.items()}}
+
+
+class ClientPipeline:
+    # Capture -> encode (thread pool) -> send, each stage on its own thread(s).
+    # The capture thread feeds a bounded queue of raw frames, the dispatcher
+    # submits them to the encoder pool and queues the futures in capture order,
+    # and the sender waits on each future and writes it to the socket, so
+    # encoding frame N+1 overlaps sending frame N. The GUI only samples
+    # preview_frame() and never touches the network.
+    # With passthrough=(width, height) the capture returns the camera's JPEG
+    # bytes, which are sent without decoding; scale and quality can't change then.
+    # With simulcast layers (scales, see simulcast.py) every frame is encoded once
+    # per subscribed layer, each resize + encode as its own job in the pool.
+    # Raw frames go out in color_format (see frame_buffers.py), converted in the
+    # pool too. Header and payload reach the socket as two buffers where it has
+    # send_parts(), so a frame isn't copied to put its header in front.
+    def __init__(self, capture, sock, codec, on_error, delta=None, max_fps=0, passthrough=None, layers=(),
+                 color_format=COLOR_FORMAT_BGR):
+        self.capture = capture
+        self.sock = sock
+        self.codec = codec
+        self.on_error = on_error
+        self.delta = delta  # Optional DeltaEncoder; its state is only touched by the dispatcher
+        self.running = False
+        self.sequence = 0
+        self.latest_frame = None  # Most recent captured frame (JPEG bytes in passthrough)
+        self.passthrough = passthrough
+        self.layers = layers
+        self.color_format = color_format
+        self.subscribed = (0,)  # Layers the server asked for, full size until it says otherwise
+        self.preview_source = None
+        self.preview = None
+        self.settings = None  # Latest adaptive bitrate settings, see apply_settings
+        self.scale = 1.0
+        self.max_fps = max_fps  # Cap on queued frames per second, 0 for camera rate
+        self.frame_interval = 1 / max_fps if max_fps else 0.0  # Minimum seconds between queued frames
+        self.last_queued_time = 0.0
+
+        self.capture_queue = DropOldestQueue(CAPTURE_QUEUE_SIZE)
+        self.send_queue = DropOldestQueue(SEND_QUEUE_SIZE, on_drop=self.drop_encoded)
+        self.encoder = ThreadPoolExecutor(max_workers=ENCODER_THREADS, thread_name_prefix="encoder")
+        self.stats = {name: StageStats(name) for name in ("capture", "encode", "send")}
+        # Capture -> encoded and capture -> written to the socket, per frame
+        self.latency = {"encoded": LatencySeries(), "sent": LatencySeries()}
+        self.copies = CopyCounter()  # Per captured frame
+        self.send_parts = getattr(sock, "send_parts", None)
+
+        # Counters for the bitrate label, updated by the sender thread
+        self.counter_lock = threading.Lock()
+        self.bytes_sent = 0
+        self.raw_bytes = 0
+        self.threads = []
+
+    def start(self):
+        self.running = True
+        for target in (self.capture_loop, self.dispatch_loop, self.send_loop):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        self.running = False
+        self.capture_queue.close()
+        self.send_queue.close()
+        for thread in self.threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout=1)
+        self.encoder.shutdown(wait=False, cancel_futures=True)
+
+    def fail(self, error):
+        if self.running:
+            self.running = False
+            self.on_error(error)
+
+    def apply_settings(self, settings):
+        # Called from the control thread; each stage picks the new values up on its next frame
+        self.settings = settings
+        self.scale = settings.scale
+        fps = min(settings.fps, self.max_fps) if self.max_fps else settings.fps
+        self.frame_interval = 1 / fps if fps else 0.0
+        if self.codec.name == CODEC_JPEG:
+            self.codec.quality = settings.quality
+
+    def subscribe(self, layers):
+        # Called from the control thread with the layers the server wants
+        layers = tuple(sorted(layer for layer in layers if 0 <= layer < len(self.layers))) or (0,)
+        self.send_queue.maxsize = SEND_QUEUE_SIZE * len(layers)
+        self.subscribed = layers
+
+    def preview_frame(self):
+        # Latest frame for the GUI; passthrough frames are only decoded (at half size) when the preview asks
+        frame = self.latest_frame
+        if self.passthrough is None or frame is None:
+            return frame
+        if frame is not self.preview_source:
+            self.preview_source = frame
+            self.preview = cv2.imdecode(frame.reshape(-1), cv2.IMREAD_REDUCED_COLOR_2)
+        return self.preview
+
+    def scaled(self, frame):
+        scale = self.scale
+        if scale == 1.0:
+            return frame
+        frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        self.copies.copy("scale", frame.nbytes)
+        return frame
+
+    def capture_loop(self):
+        while self.running:
+            start = time.perf_counter()
+            ret, frame = self.capture.read()
+            capture_time = time.time()
+            if not ret:
+                self.fail(RuntimeError("Failed to grab frame from webcam"))
+                break
+            self.stats["capture"].record(time.perf_counter() - start)
+            self.copies.frame()
+            self.copies.allocate("capture", frame.nbytes)
+            self.latest_frame = frame
+            # Below the camera rate, only every frame_interval seconds is a frame queued
+            if capture_time - self.last_queued_time < self.frame_interval * 0.9:
+                continue
+            self.last_queued_time = capture_time
+            self.capture_queue.put((frame, capture_time, self.sequence))
+            self.sequence = (self.sequence + 1) & 0xFFFFFFFF
+
+    def drop_encoded(self, future):
+        future.cancel()
+        if self.delta is not None:
+            # The server never sees this frame, so later deltas would patch the wrong base
+            self.delta.force_keyframe()
+
+    def encode(self, frame, capture_time, sequence, prepared=None, layer=0):
+        start = time.perf_counter()
+        if self.passthrough is not None:
+            width, height = self.passthrough
+            header, payload = wrap_encoded(self.codec, frame.data.cast("B"), width, height, capture_time, sequence)
+            self.stats["encode"].record(time.perf_counter() - start)
+            self.latency["encoded"].add(time.time() - capture_time)
+            return header, payload, width * height * 3, capture_time
+        if prepared is None:
+            # One resize for the adaptive scale and the layer scale together
+            scale = self.scale * (self.layers[layer] if self.layers else 1.0)
+            if scale != 1.0:
+                frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+                self.copies.copy("scale", frame.nbytes)
+            if self.color_format != COLOR_FORMAT_BGR:
+                # Into a new array, not a reused one: the raw codec's payload is a view of it
+                frame = convert_frame(frame, COLOR_FORMAT_BGR, self.color_format)
+                self.copies.copy("color", frame.nbytes)
+            header, payload = encode_frame(self.codec, frame, capture_time, sequence,
+                                           layer_flags(layer) | color_flags(self.color_format), self.color_format)
+        else:
+            header, payload = encode_prepared(self.codec, frame, prepared, capture_time, sequence)
+            self.delta.stats.record(prepared.flags, prepared.dirty, prepared.total, len(payload))
+        self.stats["encode"].record(time.perf_counter() - start)
+        self.latency["encoded"].add(time.time() - capture_time)
+        return header, payload, frame.nbytes, capture_time
+
+    def dispatch_loop(self):
+        while self.running:
+            item = self.capture_queue.get(timeout=0.5)
+            if item is None:
+                continue
+            frame, capture_time, sequence = item
+            # Delta change detection is stateful, so it runs here in capture order;
+            # compressing the result still happens in the encoder pool
+            prepared = None
+            if self.delta is not None:
+                frame = self.scaled(frame)
+                prepared = self.delta.prepare(frame, sequence)
+            try:
+                for layer in (self.subscribed if self.layers else (0,)):
+                    self.send_queue.put(self.encoder.submit(self.encode, frame, capture_time, sequence, prepared, layer))
+            except RuntimeError:
+                # Encoder pool shut down while stopping
+                break
+
+    def send_loop(self):
+        while self.running:
+            future = self.send_queue.get(timeout=0.5)
+            if future is None:
+                continue
+            try:
+                header, payload, raw_size, capture_time = future.result()
+            except CancelledError:
+                continue
+            except Exception as e:
+                self.fail(e)
+                break
+            start = time.perf_counter()
+            try:
+                if self.send_parts is not None:
+                    self.send_parts((header, payload))
+                else:
+                    # A plain socket takes the frame in one piece, which costs a copy
+                    self.sock.sendall(header + payload)
+                    self.copies.copy("send", len(header) + len(payload))
+            except Exception as e:
+                self.fail(e)
+                break
+            self.stats["send"].record(time.perf_counter() - start)
+            self.latency["sent"].add(time.time() - capture_time)
+            with self.counter_lock:
+                self.bytes_sent += len(header) + len(payload)
+                self.raw_bytes += raw_size
+
+    def take_counters(self):
+        # Returns (bytes sent, raw bytes) since the last call
+        with self.counter_lock:
+            counters = (self.bytes_sent, self.raw_bytes)
+            self.bytes_sent = 0
+            self.raw_bytes = 0
+        return counters
+
+    def stage_report(self):
+        return format_stage_report(self.stats, {"encode": self.capture_queue, "send": self.send_queue})
+
+    def metrics(self):
+        metrics = collect_metrics(self.stats, {"encode": self.capture_queue, "send": self.send_queue}, self.latency)
+        if self.layers:
+            metrics["layers"] = {"scales": list(self.layers), "subscribed": list(self.subscribed)}
+        metrics["copies"] = self.copies.metrics()
+        return metrics
+
+
+class ServerPipeline:
+    # Receive -> decode (worker threads) -> jitter buffer -> virtual camera,
+    # independent of Tk. The receiver thread only reads from the socket,
+    # decoders publish the newest decoded frame (for the preview and stats) and
+    # queue it in the jitter buffer, and the writer wakes when the next frame
+    # is due there (repeating the last frame after one source interval without
+    # one), so network jitter and bursts don't turn into stutter or piled-up
+    # latency, and a slow preview never stalls the camera.
+    # With reader=None there is no receiver thread and frames are pushed in
+    # through feed() instead, e.g. from the asyncio network engine. An optional
+    # recorder (recording.RecordingWriter) gets every received frame of the sink's
+    # layer, still encoded, and an optional relay (relay.FrameRelay) for the
+    # session's viewers gets every received frame.
+    # With simulcast layers (scales, see simulcast.py) the sink shows sink_layer
+    # and preview_frame() the preview layer; frames of other layers are ignored.
+    # Raw frames stay in the color format they were sent in; the writer converts
+    # (into a reused buffer) only for a sink that doesn't take it, and once per
+    # frame however often the sink repeats it.
+    def __init__(self, reader, codec, sink_factory, on_closed, delta=None, decoder_threads=DECODER_THREADS,
+                 loss_stats=None, recorder=None, layers=(), relay=None, request_keyframe=None):
+        self.reader = reader
+        self.loss_stats = loss_stats if loss_stats is not None else reader  # Anything with loss_report()
+        self.codec = codec
+        self.delta = delta  # Optional DeltaDecoder holding the persistent framebuffer
+        self.request_keyframe = request_keyframe  # Called (rate-limited) when the delta chain breaks
+        self.last_keyframe_request = 0.0
+        self.recorder = recorder
+        self.relay = relay
+        self.layers = layers
+        self.sink_layer = 0
+        self.next_sink_layer = 0  # Becomes sink_layer once its first frame is decoded, so the sink never stalls
+        self.preview_layer = None
+        self.preview = None  # Newest decoded frame of the preview layer
+        self.source_width = 0  # Full-size width, known from any layer once a frame arrived
+        self.decoder_threads = decoder_threads
+        self.sink_factory = sink_factory  # Called with (width, height) on the first frame
+        self.on_closed = on_closed  # Called with the error, or None if the client disconnected
+        self.running = False
+        self.received = 0  # Receive order, used to keep only the newest decoded frame
+
+        self.decode_queue = DropOldestQueue(DECODE_QUEUE_SIZE)
+        self.frame_lock = threading.Lock()
+        self.frame_ready = threading.Event()
+        self.latest_frame = None  # Newest decoded frame, in color_format, for the stats and the GUI preview
+        self.latest_index = -1
+        self.latest_timing = (None, None)  # (capture timestamp, local receive time) of latest_frame
+        self.color_format = COLOR_FORMAT_BGR  # Of the decoded frames; a session sends one format throughout
+        self.preview_source = None
+        self.preview_bgr = None  # preview_frame() converted to BGR, for raw frames in another format
+        self.stats = {name: StageStats(name) for name in ("receive", "decode", "write")}
+        # Received -> decoded and received -> first written to the sink, on this clock, and
+        # capture -> written, which mixes in the sender's clock and is only exact if they are in sync
+        self.latency = {"decoded": LatencySeries(), "written": LatencySeries(), "end_to_end": LatencySeries()}
+        self.jitter = JitterBuffer()
+        self.waiting_keyframe = 0  # Delta frames skipped because the chain was broken
+        self.copies = CopyCounter()  # Per received frame
+        self.converter = FrameConverter(self.copies)  # Used by the writer only
+
+        self.counter_lock = threading.Lock()
+        self.bytes_received = 0
+        self.raw_bytes = 0
+        self.threads = []
+
+    def start(self):
+        self.running = True
+        targets = [self.write_loop] + [self.decode_loop] * self.decoder_threads
+        if self.reader is not None:
+            targets.append(self.receive_loop)
+        for target in targets:
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        self.running = False
+        self.decode_queue.close()
+        self.frame_ready.set()
+        for thread in self.threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout=1)
+
+    def close(self, error):
+        if self.running:
+            self.running = False
+            self.on_closed(error)
+
+    def receive_loop(self):
+        while self.running:
+            start = time.perf_counter()
+            try:
+                message = self.reader.read_frame()
+            except Exception as e:
+                self.close(e)
+                break
+            if message is None:
+                self.close(None)
+                break
+            header, payload = message
+            self.feed(header, payload, self.reader.last_frame_size, time.perf_counter() - start)
+
+    def feed(self, header, payload, frame_size, elapsed):
+        # One received frame; called by the receiver thread or, in push mode, the network engine
+        self.stats["receive"].record(elapsed)
+        with self.counter_lock:
+            self.bytes_received += frame_size
+        # Readers reuse their buffer, so the payload is copied before decoding off-thread
+        payload = bytes(payload)
+        self.copies.frame()
+        self.copies.copy("receive", len(payload))
+        received_time = time.time()
+        self.decode_queue.put((self.received, header, payload, received_time))
+        self.received += 1
+        # With simulcast only the layer the sink switches to is recorded, so a replay is a single stream
+        if self.recorder is not None and (not self.layers or frame_layer(header.flags) == self.next_sink_layer):
+            self.recorder.add(header, payload, received_time)
+        if self.relay is not None:
+            self.relay.add(header, payload, received_time)
+
+    def decode_loop(self):
+        while self.running:
+            item = self.decode_queue.get(timeout=0.5)
+            if item is None:
+                continue
+            index, header, payload, received_time = item
+            start = time.perf_counter()
+            try:
+                if self.delta is not None:
+                    frame = self.delta.apply(self.codec, header, payload)
+                else:
+                    frame = decode_frame(self.codec, header, payload)
+            except Exception as e:
+                print(f"Server: Error decoding frame: {e}")
+                if self.delta is not None:
+                    self.keyframe_needed()
+                continue
+            if frame is None:
+                # Delta chain broken, waiting for the next keyframe
+                self.waiting_keyframe += 1
+                self.keyframe_needed()
+                continue
+            self.stats["decode"].record(time.perf_counter() - start)
+            self.latency["decoded"].add(time.time() - received_time)
+            if frame.flags.owndata:
+                self.copies.allocate("decode", frame.nbytes)  # Raw frames are views of the payload instead
+            self.color_format = frame_color(header.flags)
+            if self.layers:
+                layer = frame_layer(header.flags)
+                if layer >= len(self.layers):
+                    continue
+                self.source_width = round(header.width / self.layers[layer])
+                if layer == self.preview_layer:
+                    self.preview = frame
+                if layer == self.next_sink_layer:
+                    self.sink_layer = layer
+                if layer != self.sink_layer:
+                    continue
+            self.jitter.put(header.timestamp, index, frame, received_time, time.time())
+            with self.frame_lock:
+                # Decoders can finish out of order; never replace a newer frame with an older one
+                if index > self.latest_index:
+                    self.latest_index = index
+                    self.latest_frame = frame
+                    self.latest_timing = (header.timestamp, received_time)
+                    with self.counter_lock:
+                        self.raw_bytes += frame.nbytes
+            self.frame_ready.set()
+
+    def keyframe_needed(self):
+        # Decoding is single-threaded with delta, so no lock; at most one request per interval
+        now = time.monotonic()
+        if self.request_keyframe is None or now - self.last_keyframe_request < KEYFRAME_REQUEST_INTERVAL:
+            return
+        self.last_keyframe_request = now
+        self.request_keyframe()
+
+    def write_loop(self):
+        sink = None
+        frame = None
+        output = None  # frame as the sink takes it, sent again while no newer frame is due
+        try:
+            self.frame_ready.wait()
+            # The sink runs at the source's rate, so give the jitter buffer a few frames to measure it
+            first_frame_time = time.perf_counter()
+            while self.running and self.jitter.source_fps() is None and \
+                    time.perf_counter() - first_frame_time < SOURCE_FPS_WAIT:
+                time.sleep(0.01)
+            while self.running:
+                released = self.jitter.take(time.time())
+                if released is not None:
+                    # First time this frame reaches the sink
+                    timestamp, _, frame, received_time = released
+                    now = time.time()
+                    self.latency["written"].add(now - received_time)
+                    self.latency["end_to_end"].add(now - timestamp)
+                elif frame is None:
+                    time.sleep(0.005)
+                    continue
+                start = time.perf_counter()
+                if released is not None:
+                    color_format = self.color_format
+                    width, height = frame_size(frame, color_format)
+                    if sink is None:
+                        source_fps = self.jitter.source_fps()
+                        fps = min(max(round(source_fps), 1), 60) if source_fps else DEFAULT_SINK_FPS
+                        sink = self.sink_factory(width, height, fps, color_format)
+                        sink_size = (width, height)
+                    output = frame
+                    if (width, height) != sink_size:
+                        # The sender lowered its resolution; the sink keeps its original size
+                        if color_format == COLOR_FORMAT_I420:
+                            output, color_format = self.converter.convert(output, color_format, (COLOR_FORMAT_BGR,))
+                        output = self.converter.resize(output, sink_size)
+                    output, _ = self.converter.convert(output, color_format, sink.color_formats)
+                sink.send(output)
+                self.stats["write"].record(time.perf_counter() - start)
+                # Paced by the playout clock rather than the sink's own, so frames don't wait for its next tick;
+                # with nothing due for a whole frame interval the last frame is sent again
+                self.jitter.wait(1 / fps)
+        except Exception as e:
+            self.close(e)
+        finally:
+            if sink is not None:
+                sink.close()
+
+    def select_layers(self, sink_layer, preview_layer):
+        # The client sends the new layers from the next frame on; until then the old sink layer keeps the sink fed
+        self.next_sink_layer = sink_layer
+        self.preview_layer = preview_layer
+        if preview_layer is None:
+            self.preview = None
+
+    def frame_counts(self):
+        # (dropped or lost, received) frames so far, for the simulcast layer selector
+        dropped = self.decode_queue.dropped
+        if hasattr(self.loss_stats, "loss_totals"):
+            dropped += self.loss_stats.loss_totals()["udp_lost"]
+        return dropped, self.received
+
+    def preview_frame(self):
+        # The preview layer when there is one, otherwise what the sink shows; always BGR
+        preview = self.preview
+        frame = preview if preview is not None else self.latest_frame
+        if frame is None or self.color_format == COLOR_FORMAT_BGR:
+            return frame
+        if frame is not self.preview_source:
+            self.preview_source = frame
+            self.preview_bgr = convert_frame(frame, self.color_format, COLOR_FORMAT_BGR)
+        return self.preview_bgr
+
+    def take_counters(self):
+        # Returns (bytes received, raw bytes) since the last call
+        with self.counter_lock:
+            counters = (self.bytes_received, self.raw_bytes)
+            self.bytes_received = 0
+            self.raw_bytes = 0
+        return counters
+
+    def stage_report(self):
+        report = format_stage_report(self.stats, {"decode": self.decode_queue})
+        jitter = self.jitter.metrics()
+        report += (f" | buffer {jitter['frames']} @ {jitter['target_ms']:.0f} ms, "
+                   f"underruns {jitter['underruns']}, dropped {jitter['dropped'] + jitter['late']}")
+        if hasattr(self.loss_stats, "loss_report"):
+            report += " | " + self.loss_stats.loss_report()
+        return report
+
+    def metrics(self):
+        metrics = collect_metrics(self.stats, {"decode": self.decode_queue}, self.latency)
+        jitter = self.jitter.metrics()
+        metrics["jitter_buffer"] = jitter
+        # Decoded frames the sink never showed: skipped to hold the delay, or arrived after a newer one
+        metrics["dropped"] = {"superseded": jitter["dropped"] + jitter["late"], "waiting_keyframe": self.waiting_keyframe}
+        if self.layers:
+            metrics["layers"] = {"scales": list(self.layers), "sink": self.sink_layer, "preview": self.preview_layer}
+        metrics["copies"] = self.copies.metrics()
+        if hasattr(self.loss_stats, "loss_totals"):
+            metrics["dropped"].update(self.loss_stats.loss_totals())
+        return metrics
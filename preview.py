@@ -0,0 +1,76 @@
+import time
+import cv2
+from PIL import Image, ImageTk
+from pipeline import StageStats
+
+# GUI preview rendering, kept cheap: frames are downscaled to the preview size
+# before the color conversion, at most max_fps frames are drawn however fast
+# the stream runs, and one PhotoImage is reused through paste() instead of
+# Tk allocating and registering a new image per frame. Turned off, the
+# preview costs nothing and the label is cleared.
+PREVIEW_MAX_FPS = 10
+PREVIEW_MAX_WIDTH = 640
+PREVIEW_MAX_HEIGHT = 480
+
+
+def fit_size(width, height, max_width, max_height):
+    # Largest size within the bounds with the frame's aspect ratio; never upscales
+    scale = min(max_width / width, max_height / height, 1.0)
+    return max(int(width * scale), 1), max(int(height * scale), 1)
+
+
+def prepare_preview(frame, max_width=PREVIEW_MAX_WIDTH, max_height=PREVIEW_MAX_HEIGHT):
+    # BGR frame -> RGB PIL image at preview size; resizing first makes the conversion cheap too.
+    # Bilinear is about 4x cheaper than INTER_AREA at 1080p and looks the same at preview size.
+    height, width = frame.shape[:2]
+    size = fit_size(width, height, max_width, max_height)
+    if size != (width, height):
+        frame = cv2.resize(frame, size, interpolation=cv2.INTER_LINEAR)
+    return Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+
+
+class PreviewRenderer:
+    def __init__(self, label, max_width=PREVIEW_MAX_WIDTH, max_height=PREVIEW_MAX_HEIGHT, max_fps=PREVIEW_MAX_FPS):
+        self.label = label
+        self.max_width = max_width
+        self.max_height = max_height
+        self.interval = 1 / max_fps
+        self.enabled = True
+        self.photo = None
+        self.last_frame = None
+        self.last_time = 0.0
+        self.stats = StageStats("preview")  # Time spent drawing, for the stats line
+
+    def set_enabled(self, enabled):
+        self.enabled = enabled
+        if not enabled:
+            self.label.configure(image="")
+            self.photo = None
+            self.last_frame = None
+
+    def due(self):
+        # Check before fetching a frame, so callers can skip work (e.g. decoding) between draws
+        return self.enabled and time.perf_counter() - self.last_time >= self.interval
+
+    def show(self, frame):
+        # Draws frame if it is new and the rate cap allows; returns True if it was drawn
+        if frame is None or frame is self.last_frame or not self.due():
+            return False
+        start = time.perf_counter()
+        self.last_frame = frame
+        self.last_time = start
+        image = prepare_preview(frame, self.max_width, self.max_height)
+        if self.photo is None or (self.photo.width(), self.photo.height()) != image.size:
+            self.photo = ImageTk.PhotoImage(image=image)
+            self.label.configure(image=self.photo)
+        else:
+            self.photo.paste(image)
+        self.stats.record(time.perf_counter() - start)
+        return True
+
+    def report(self):
+        # Average draw time since the last call
+        _, average = self.stats.reset()
+        if not self.enabled:
+            return "preview off"
+        return f"preview {average * 1000:.1f} ms"
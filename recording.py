@@ -0,0 +1,202 @@
+import json
+import mmap
+import os
+import threading
+import time
+import numpy as np
+from pipeline import DropOldestQueue
+from stream_io import FRAME_HEADER, pack_frame_header, unpack_frame_header
+from delta_codec import FLAG_DELTA
+
+# Record and replay of received streams. A recording is a directory with
+# recording.json (codec, delta mode, source), segment files holding the frames
+# exactly as they arrived (wire header + still-encoded payload, no re-encode)
+# and one index file per segment with a fixed-size record per frame: offset
+# and length in the segment, flags, local receive time and capture timestamp.
+# Segments roll over at SEGMENT_SIZE so a long recording never becomes one huge
+# file. The index is written after the frame, so a recording cut off by a crash
+# is still readable up to its last complete frame.
+RECORDING_META = "recording.json"
+SEGMENT_NAME = "segment-{:05d}.frames"
+INDEX_NAME = "segment-{:05d}.index"
+SEGMENT_SIZE = 256 << 20  # 256 MB
+RECORD_QUEUE_SIZE = 256  # Frames buffered for the writer thread before the oldest is dropped
+DEFAULT_RECORD_PATH = "recordings/session-{session}-{time}"  # {session} id, {time} start time
+INDEX_RECORD = np.dtype([("offset", "<u8"), ("length", "<u4"), ("flags", "<u4"),
+                         ("received", "<f8"), ("timestamp", "<f8")])
+
+
+def recording_path(pattern, session):
+    return pattern.format(session=session, time=time.strftime("%Y%m%d-%H%M%S"))
+
+
+def read_index(path):
+    # A crash can leave a partly written record at the end (or no index file at all); only whole records count
+    try:
+        with open(path, "rb") as source:
+            data = source.read()
+    except FileNotFoundError:
+        return np.zeros(0, INDEX_RECORD)
+    return np.frombuffer(data, dtype=INDEX_RECORD, count=len(data) // INDEX_RECORD.itemsize)
+
+
+class RecordingWriter:
+    # Appends frames from the receive path without ever blocking it: add() only
+    # queues the (already copied) payload, a writer thread does the file I/O.
+    # If the disk can't keep up the oldest queued frames are dropped; in delta
+    # mode replay then skips ahead to the next keyframe.
+    def __init__(self, path, meta, segment_size=SEGMENT_SIZE):
+        self.path = path
+        self.segment_size = segment_size
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, RECORDING_META), "w") as output:
+            json.dump({"started": time.time(), **meta}, output, indent=2)
+        self.queue = DropOldestQueue(RECORD_QUEUE_SIZE)
+        self.segment = -1
+        self.segment_file = None
+        self.index_file = None
+        self.segment_bytes = 0
+        self.frames = 0
+        self.bytes_written = 0
+        self.thread = threading.Thread(target=self.write_loop, daemon=True)
+        self.thread.start()
+        print(f"Server: Recording stream to {path}")
+
+    def add(self, header, payload, received_time):
+        # payload must not be a view into a reused buffer
+        self.queue.put((header, payload, received_time))
+
+    def open_segment(self):
+        self.close_segment()
+        self.segment += 1
+        self.segment_file = open(os.path.join(self.path, SEGMENT_NAME.format(self.segment)), "wb")
+        self.index_file = open(os.path.join(self.path, INDEX_NAME.format(self.segment)), "wb")
+        self.segment_bytes = 0
+
+    def close_segment(self):
+        for output in (self.segment_file, self.index_file):
+            if output is not None:
+                output.close()
+        self.segment_file = None
+        self.index_file = None
+
+    def write_loop(self):
+        record = np.zeros(1, dtype=INDEX_RECORD)
+        try:
+            while True:
+                item = self.queue.get(timeout=0.5)
+                if item is None:
+                    if self.queue.closed:
+                        break
+                    continue
+                header, payload, received_time = item
+                length = FRAME_HEADER.size + len(payload)
+                if self.segment_file is None or (self.segment_bytes and self.segment_bytes + length > self.segment_size):
+                    self.open_segment()
+                self.segment_file.write(pack_frame_header(header))
+                self.segment_file.write(payload)
+                record[0] = (self.segment_bytes, length, header.flags, received_time, header.timestamp)
+                self.index_file.write(record.tobytes())
+                self.segment_bytes += length
+                self.frames += 1
+                self.bytes_written += length
+        except OSError as e:
+            print(f"Server: Recording to {self.path} failed: {e}")
+        finally:
+            self.close_segment()
+
+    def close(self):
+        # Writes out whatever is still queued, then closes the files
+        self.queue.close()
+        self.thread.join()
+
+    def stats(self):
+        return {"path": self.path, "frames": self.frames, "bytes": self.bytes_written,
+                "dropped": self.queue.dropped, "segments": self.segment + 1}
+
+
+class RecordingReader:
+    # Memory-maps every segment and loads the indexes into one array, so seeking
+    # is a binary search and reading a frame is a slice of the mapping (no copy).
+    # Payload views are only valid until close().
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, RECORDING_META)) as source:
+            self.meta = json.load(source)
+        self.maps = []
+        indexes = []
+        segment = 0
+        while os.path.exists(os.path.join(path, SEGMENT_NAME.format(segment))):
+            size = os.path.getsize(os.path.join(path, SEGMENT_NAME.format(segment)))
+            index = read_index(os.path.join(path, INDEX_NAME.format(segment)))
+            # Drop index records whose frame never made it to disk completely
+            index = index[index["offset"] + index["length"] <= size]
+            if size:
+                with open(os.path.join(path, SEGMENT_NAME.format(segment)), "rb") as source:
+                    self.maps.append(mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ))
+                indexes.append((len(self.maps) - 1, index))
+            segment += 1
+        self.index = np.concatenate([index for _, index in indexes]) if indexes else np.zeros(0, INDEX_RECORD)
+        self.segments = np.concatenate([np.full(len(index), number, dtype=np.uint32) for number, index in indexes]) \
+            if indexes else np.zeros(0, np.uint32)
+        self.views = [memoryview(segment_map) for segment_map in self.maps]
+
+    def __len__(self):
+        return len(self.index)
+
+    def duration(self):
+        if not len(self.index):
+            return 0.0
+        return float(self.index["received"][-1] - self.index["received"][0])
+
+    def frame(self, number):
+        # Returns (header, payload view) of frame `number`
+        record = self.index[number]
+        start = int(record["offset"])
+        view = self.views[self.segments[number]][start:start + int(record["length"])]
+        return unpack_frame_header(view[:FRAME_HEADER.size]), view[FRAME_HEADER.size:]
+
+    def seek(self, seconds):
+        # Index of the last independently decodable frame at or before `seconds` into the recording
+        if not len(self.index):
+            return 0
+        target = self.index["received"][0] + seconds
+        number = max(int(np.searchsorted(self.index["received"], target, side="right")) - 1, 0)
+        while number > 0 and self.index["flags"][number] & FLAG_DELTA:
+            number -= 1
+        return number
+
+    def close(self):
+        for view in self.views:
+            view.release()
+        for segment_map in self.maps:
+            segment_map.close()
+        self.views = []
+        self.maps = []
+
+
+def replay(reader, pipeline, speed=1.0, start=0.0, loop=False, stopping=None):
+    # Feeds a recording into a push-mode ServerPipeline with the original frame
+    # spacing divided by speed. Capture timestamps are shifted to now so the
+    # pipeline's latency metrics stay meaningful. Returns the frames fed.
+    fed = 0
+    first = reader.seek(start)
+    while stopping is None or not stopping.is_set():
+        base = reader.index["received"][first] if len(reader) else 0.0
+        started = time.perf_counter()
+        for number in range(first, len(reader)):
+            if stopping is not None and stopping.is_set():
+                break
+            record = reader.index[number]
+            delay = started + (record["received"] - base) / speed - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            header, payload = reader.frame(number)
+            shift = time.time() - record["received"]
+            pipeline.feed(header._replace(timestamp=header.timestamp + shift), payload, int(record["length"]), 0)
+            del payload
+            fed += 1
+        if not loop or not len(reader):
+            break
+        first = 0
+    return fed
@@ -0,0 +1,198 @@
+import asyncio
+import socket
+from collections import deque
+from delta_codec import FLAG_DELTA
+from simulcast import frame_layer
+from stream_io import pack_frame_header
+
+# Relay: the server fans one client's stream out to any number of viewers on
+# other machines without decoding or re-encoding it. While a session has
+# viewers, every frame it receives goes into the session's FrameRing once, as
+# its packed header and the payload the pipeline already copied, and every
+# viewer's connection is written from those same two objects, so the cost per
+# frame doesn't grow with the number of viewers beyond the socket writes.
+#
+# Each viewer reads the ring at its own pace through a cursor. One that falls
+# more than RELAY_MAX_LAG frames behind, or whose next frame was already
+# evicted, skips ahead to the newest keyframe: a slow viewer loses frames
+# instead of holding back the others or letting the ring grow. Delta frames
+# only decode on top of their keyframe, so a viewer that joins or skips past
+# the last keyframe waits for the next one. Simulcast sessions relay layer 0.
+#
+# A viewer asks for a session with WATCH on the control port, then opens a
+# connection to the stream port with a VIEW hello (SESSION_HELLO with
+# RELAY_MAGIC and the viewer token from the WATCH reply) and from then on only
+# reads frames, as a stream_io.FrameReader.
+RELAY_MAGIC = b"VIEW"
+WATCH_MESSAGE = b"WATCH"  # Viewer -> server: WATCH session=N (or none for the oldest); the reply repeats it with the stream parameters
+WATCH_FAILED_MESSAGE = b"WATCH_FAILED"
+RELAY_RING_FRAMES = 120
+RELAY_RING_BYTES = 64 << 20  # 64 MB of encoded frames per relayed session
+RELAY_MAX_LAG = 8  # Frames a viewer may trail the newest before it skips to a keyframe
+# Frames queued for a viewer beyond these buffers add to its delay instead of being skipped
+RELAY_WRITE_BUFFER = 64 * 1024  # Bytes a viewer's transport may buffer before its sender waits
+RELAY_SOCKET_BUFFER = 256 * 1024  # Kernel send buffer of a viewer's connection
+
+
+def is_keyframe(flags):
+    return not flags & FLAG_DELTA
+
+
+class FrameRing:
+    # Encoded frames by position, oldest evicted first; used on the loop only
+    def __init__(self, max_frames=RELAY_RING_FRAMES, max_bytes=RELAY_RING_BYTES):
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.frames = deque()  # (keyframe, header bytes, payload)
+        self.start = 0  # Position of frames[0]
+        self.end = 0  # Position the next frame gets
+        self.size = 0
+        self.last_keyframe = None  # Position of the newest keyframe still in the ring
+        self.arrived = asyncio.Event()
+
+    def add(self, header, payload):
+        keyframe = is_keyframe(header.flags)
+        self.frames.append((keyframe, pack_frame_header(header), payload))
+        if keyframe:
+            self.last_keyframe = self.end
+        self.end += 1
+        self.size += len(payload)
+        while len(self.frames) > self.max_frames or (self.size > self.max_bytes and len(self.frames) > 1):
+            _, _, evicted = self.frames.popleft()
+            self.size -= len(evicted)
+            self.start += 1
+        if self.last_keyframe is not None and self.last_keyframe < self.start:
+            self.last_keyframe = None
+        # Wake every waiting viewer; later waiters get a fresh event
+        self.arrived.set()
+        self.arrived = asyncio.Event()
+
+    def get(self, position):
+        return self.frames[position - self.start]
+
+    def clear(self):
+        self.frames.clear()
+        self.start = self.end
+        self.size = 0
+        self.last_keyframe = None
+
+
+class RelayViewer(asyncio.Protocol):
+    # The server end of one viewer's connection, taken over from the stream protocol after its hello
+    def __init__(self, relay, transport, label):
+        self.relay = relay
+        self.transport = transport
+        self.label = label
+        self.writable = asyncio.Event()
+        self.writable.set()
+        self.closed = False
+        self.task = None
+        self.sent = 0
+        self.bytes_sent = 0
+        self.skipped = 0  # Frames jumped over to catch up
+        self.skips = 0
+        transport.set_write_buffer_limits(high=RELAY_WRITE_BUFFER)
+        sock = transport.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, RELAY_SOCKET_BUFFER)
+
+    def pause_writing(self):
+        self.writable.clear()
+
+    def resume_writing(self):
+        self.writable.set()
+
+    def data_received(self, data):
+        pass  # Viewers don't send anything after the hello
+
+    def connection_lost(self, exc):
+        self.closed = True
+        self.writable.set()
+        if self.task is not None:
+            self.task.cancel()
+
+    def close(self):
+        self.transport.close()
+
+    async def run(self):
+        ring = self.relay.ring
+        # Start at the newest keyframe, or wait for the next one
+        cursor = ring.last_keyframe if ring.last_keyframe is not None else ring.end
+        need_keyframe = ring.last_keyframe is None
+        while not self.closed:
+            if cursor >= ring.end:
+                await ring.arrived.wait()
+                continue
+            if cursor < ring.start or ring.end - cursor > RELAY_MAX_LAG:
+                # Too far behind: skip to the newest keyframe, or past everything to the next one
+                target = ring.last_keyframe if ring.last_keyframe is not None and ring.last_keyframe > cursor \
+                    else ring.end
+                if target == ring.end and cursor >= ring.start:
+                    target = cursor  # Nothing to skip to yet; the frames are still here
+                if target != cursor:
+                    self.skipped += target - cursor
+                    self.skips += 1
+                    need_keyframe = target == ring.end
+                    cursor = target
+                    continue
+            keyframe, header, payload = ring.get(cursor)
+            cursor += 1
+            if need_keyframe and not keyframe:
+                self.skipped += 1
+                continue
+            need_keyframe = False
+            self.transport.write(header)
+            self.transport.write(payload)
+            self.sent += 1
+            self.bytes_sent += len(header) + len(payload)
+            await self.writable.wait()
+
+    def metrics(self):
+        return {"address": self.label, "sent": self.sent, "bytes_sent": self.bytes_sent, "skipped": self.skipped,
+                "skips": self.skips}
+
+
+class FrameRelay:
+    # One session's ring and viewers. add() is the pipeline's relay hook and
+    # runs where the pipeline is fed, which is the network engine's loop.
+    def __init__(self, session_label):
+        self.session_label = session_label
+        self.ring = FrameRing()
+        self.viewers = []
+        self.frames = 0  # Frames put in the ring
+
+    def add(self, header, payload, received_time):
+        # payload must not be a view into a reused buffer
+        if not self.viewers or frame_layer(header.flags) != 0:
+            return
+        self.ring.add(header, payload)
+        self.frames += 1
+
+    def attach(self, transport, address):
+        viewer = RelayViewer(self, transport, address)
+        transport.set_protocol(viewer)
+        self.viewers.append(viewer)
+        viewer.task = asyncio.get_running_loop().create_task(self.serve(viewer))
+        print(f"Server: Relaying session {self.session_label} to {address}, {len(self.viewers)} viewer(s)")
+        return viewer
+
+    async def serve(self, viewer):
+        try:
+            await viewer.run()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            viewer.close()
+            self.viewers.remove(viewer)
+            if not self.viewers:
+                self.ring.clear()  # Nobody to relay to; keep no frames around
+            print(f"Server: Viewer {viewer.label} of session {self.session_label} left, "
+                  f"{viewer.sent} frames sent, {viewer.skipped} skipped")
+
+    def close(self):
+        for viewer in list(self.viewers):
+            viewer.close()
+
+    def metrics(self):
+        return {"frames": self.frames, "ring_frames": len(self.ring.frames), "ring_bytes": self.ring.size,
+                "viewers": [viewer.metrics() for viewer in self.viewers]}
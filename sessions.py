@@ -0,0 +1,215 @@
+import secrets
+import struct
+import threading
+import time
+import cv2
+import numpy as np
+from frame_buffers import COLOR_FORMAT_BGR, convert_frame, frame_shape
+from pipeline import DECODER_THREADS, ServerPipeline
+from delta_codec import DeltaDecoder
+from relay import FrameRelay
+
+# A server handles many clients at once; everything that used to live on the
+# single WebcamStreamer instance (control connection, stream socket, decode
+# pipeline, virtual camera, counters) belongs to one ClientSession per client.
+# Over TCP every client connects to the shared stream port and first sends a
+# SESSION_HELLO naming the session and token it got in the START_STREAMING
+# reply; over UDP each session gets its own socket, announced as stream_port
+# in the reply, and the client sends the same hello there as a datagram. The
+# token also lets a client with the resume capability whose connection dropped
+# send RESUME with its session id and token, and get the session back (same
+# sink, same pipeline) instead of starting a new one.
+# Viewers on other machines can watch a session through its relay, see relay.py.
+SESSION_MAGIC = b"SESS"
+SESSION_HELLO = struct.Struct("<4sI16s")  # magic, session id, token
+TOKEN_BYTES = 8  # Random bytes of a token, sent as 16 hex digits
+SERVER_BACKLOG = 32
+
+
+def pack_session_hello(session_id, token, magic=SESSION_MAGIC):
+    return SESSION_HELLO.pack(magic, session_id, token.encode())
+
+
+def send_session_hello(sock, session_id, token, magic=SESSION_MAGIC):
+    sock.sendall(pack_session_hello(session_id, token, magic))
+
+
+class ClientSession:
+    def __init__(self, session_id, address, codec, transport, delta_enabled, control_conn):
+        self.id = session_id
+        self.address = address
+        self.codec = codec
+        self.transport = transport
+        self.delta_enabled = delta_enabled
+        self.layers = ()  # Simulcast layer scales the client offered, see simulcast.py
+        self.color_format = COLOR_FORMAT_BGR  # Of raw frames on the wire, see frame_buffers.py
+        self.layer_selector = None
+        self.subscription = None  # (sink layer, preview layer) last sent to the client
+        self.control_conn = control_conn  # control_protocol.ControlChannel in server mode
+        self.token = secrets.token_hex(TOKEN_BYTES)
+        self.view_token = secrets.token_hex(TOKEN_BYTES)  # Given to relay viewers, so they can't take over the stream
+        self.capabilities = set()  # Agreed in the handshake, see control_protocol.CAPABILITIES
+        self.resume_timer = None  # Closes the session unless the client resumes it, while detached
+        self.resumes = 0
+        self.stream_transport = None  # asyncio transport of the stream connection or UDP endpoint, see net_engine
+        self.mux = None  # channels.MuxProtocol when the stream connection is multiplexed
+        self.pipeline = None
+        self.recorder = None  # RecordingWriter when the server records sessions
+        self.relay = FrameRelay(self.label())  # Fans the received frames out to viewers, idle without any
+        self.layers_sent = None  # Simulcast layers last subscribed to, including the relay's
+        self.connected_time = time.time()
+
+    def start_pipeline(self, reader, sink_factory, on_closed, loss_stats=None, recorder=None, request_keyframe=None):
+        # Delta frames patch one framebuffer in order, so they are decoded on a single thread
+        delta = DeltaDecoder() if self.delta_enabled else None
+        self.recorder = recorder
+        self.pipeline = ServerPipeline(reader, self.codec, sink_factory, on_closed,
+                                       delta=delta, decoder_threads=1 if delta else DECODER_THREADS,
+                                       loss_stats=loss_stats, recorder=recorder, layers=self.layers,
+                                       relay=self.relay, request_keyframe=request_keyframe if delta else None)
+        self.pipeline.start()
+
+    def close(self):
+        # Wait for the pipeline (it closes the sink); the network engine has closed the connections
+        if self.pipeline is not None:
+            self.pipeline.stop()
+        if self.recorder is not None:
+            self.recorder.close()
+
+    def recording_meta(self):
+        # What a replay needs to decode the recorded frames, plus where they came from
+        return {"session": self.id, "address": self.address[0], "codec": self.codec.name,
+                "quality": self.codec.quality, "transport": self.transport, "delta": self.delta_enabled}
+
+    def label(self):
+        return f"#{self.id} {self.address[0]}"
+
+
+class SessionRegistry:
+    # Thread-safe map of session id -> ClientSession
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sessions = {}
+        self.next_id = 1
+
+    def create(self, *args):
+        with self.lock:
+            session = ClientSession(self.next_id, *args)
+            self.sessions[session.id] = session
+            self.next_id += 1
+        return session
+
+    def get(self, session_id):
+        with self.lock:
+            return self.sessions.get(session_id)
+
+    def remove(self, session_id):
+        with self.lock:
+            return self.sessions.pop(session_id, None)
+
+    def all(self):
+        with self.lock:
+            return list(self.sessions.values())
+
+    def __len__(self):
+        with self.lock:
+            return len(self.sessions)
+
+
+MOSAIC_COLUMNS = 4  # The mosaic is a MOSAIC_COLUMNS x MOSAIC_COLUMNS grid, one session per cell
+
+
+class MosaicOutput:
+    # Combines every session into one grid image pushed to a single sink, for
+    # virtual camera drivers that only expose one device. Each session writes
+    # into its own cell through a MosaicTile; a writer thread sends the grid.
+    def __init__(self, sink_factory, width=1920, height=1080, fps=20, columns=MOSAIC_COLUMNS):
+        self.sink_factory = sink_factory
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.columns = columns
+        self.cells = columns * columns
+        self.canvas = np.zeros((height, width, 3), dtype=np.uint8)  # BGR, as the sessions decode
+        self.lock = threading.Lock()
+        self.slots = {}  # session id -> cell index
+        self.running = False
+        self.thread = None
+
+    def cell_rect(self, index):
+        # Fixed columns x columns grid, so cells don't move when sessions come and go
+        cell_width = self.width // self.columns
+        cell_height = self.height // self.columns
+        row, column = divmod(index, self.columns)
+        return column * cell_width, row * cell_height, cell_width, cell_height
+
+    def tile_for(self, session_id):
+        with self.lock:
+            used = set(self.slots.values())
+            index = next((index for index in range(self.cells) if index not in used), None)
+            if index is None:
+                # The network refuses sessions beyond the cell count before they get here
+                raise RuntimeError(f"Mosaic is full ({self.cells} cells)")
+            self.slots[session_id] = index
+        if not self.running:
+            self.start()
+        return MosaicTile(self, session_id)
+
+    def release(self, session_id):
+        with self.lock:
+            index = self.slots.pop(session_id, None)
+            if index is not None:
+                x, y, width, height = self.cell_rect(index)
+                self.canvas[y:y + height, x:x + width] = 0
+
+    def paste(self, session_id, frame):
+        with self.lock:
+            index = self.slots.get(session_id)
+            if index is None:
+                return
+            x, y, width, height = self.cell_rect(index)
+            self.canvas[y:y + height, x:x + width] = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.write_loop, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(timeout=1)
+
+    def write_loop(self):
+        sink = self.sink_factory(self.width, self.height, self.fps, COLOR_FORMAT_BGR)
+        color_format = COLOR_FORMAT_BGR if COLOR_FORMAT_BGR in sink.color_formats else sink.color_formats[0]
+        # One buffer for every grid sent, filled by a copy of the canvas or, for another format, its conversion
+        output = np.empty(frame_shape(color_format, self.width, self.height), dtype=np.uint8)
+        try:
+            while self.running:
+                with self.lock:
+                    if color_format == COLOR_FORMAT_BGR:
+                        np.copyto(output, self.canvas)
+                    else:
+                        convert_frame(self.canvas, COLOR_FORMAT_BGR, color_format, dst=output)
+                sink.send(output)
+                sink.sleep_until_next_frame()
+        except Exception as e:
+            print(f"Server: Mosaic output error: {e}")
+        finally:
+            sink.close()
+
+
+class MosaicTile:
+    # Sink handed to a session's ServerPipeline when the mosaic output is used
+    color_formats = (COLOR_FORMAT_BGR,)
+
+    def __init__(self, mosaic, session_id):
+        self.mosaic = mosaic
+        self.session_id = session_id
+
+    def send(self, frame):
+        self.mosaic.paste(self.session_id, frame)
+
+    def close(self):
+        self.mosaic.release(self.session_id)
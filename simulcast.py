@@ -0,0 +1,88 @@
+# Simulcast: the client can encode every captured frame at several scales
+# ("layers", layer 0 is full size) and sends only the layers the server
+# subscribed to. The layer index travels in the frame header flags. The server
+# picks, per session, the smallest layer that still covers what each consumer
+# shows: the sink (virtual camera, or a mosaic cell) and the GUI preview. While
+# a session falls behind (decode drops, UDP loss) its sink moves to smaller
+# layers, and back up after a run of clean intervals. Like the adaptive bitrate
+# controller, LayerSelector has no clock or I/O of its own.
+LAYERS_MESSAGE = b"LAYERS"  # Server -> client: LAYERS 1,2 subscribes to layers 1 and 2
+DEFAULT_LAYERS = (1.0, 0.5, 0.25)
+MAX_LAYERS = 4
+LAYER_SHIFT = 4  # Flags bits 4-5; bits 0-1 are the delta codec's
+LAYER_MASK = 0x30
+CLEAN_INTERVALS_TO_RAISE = 5
+CONGESTION_DROP_RATIO = 0.1  # Share of an interval's frames dropped or lost that counts as falling behind
+
+
+def layer_flags(layer):
+    return layer << LAYER_SHIFT
+
+
+def frame_layer(flags):
+    return (flags & LAYER_MASK) >> LAYER_SHIFT
+
+
+def format_layers(scales):
+    return ",".join(f"{scale:g}" for scale in scales)
+
+
+def parse_layers(text):
+    # Scales offered in the handshake, e.g. "1,0.5,0.25"; anything malformed disables simulcast
+    try:
+        scales = tuple(float(value) for value in text.split(",") if value.strip())
+    except ValueError:
+        return ()
+    if not 1 < len(scales) <= MAX_LAYERS or scales[0] != 1.0:
+        return ()
+    if any(not 0 < smaller < larger for larger, smaller in zip(scales, scales[1:])):
+        return ()
+    return scales
+
+
+def format_layers_message(layers):
+    return LAYERS_MESSAGE + b" " + ",".join(str(layer) for layer in sorted(layers)).encode()
+
+
+def parse_layers_message(line):
+    layers = set()
+    for value in line[len(LAYERS_MESSAGE):].decode(errors="ignore").strip().split(","):
+        if value.strip().isdigit():
+            layers.add(int(value))
+    return layers
+
+
+def layer_for_width(scales, source_width, width):
+    # Smallest layer at least `width` pixels wide; layer 0 if even that is narrower
+    best = 0
+    for layer, scale in enumerate(scales):
+        if source_width * scale >= width:
+            best = layer
+    return best
+
+
+class LayerSelector:
+    def __init__(self, scales):
+        self.scales = scales
+        self.penalty = 0  # Layers below the wanted sink layer while congested
+        self.clean_intervals = 0
+        self.last_counts = (0, 0)
+
+    def update(self, source_width, sink_width, preview_width, dropped, received):
+        # Called once per interval with cumulative frame counts. Returns (sink layer,
+        # preview layer or None); widths of None mean full size / no preview.
+        last_dropped, last_received = self.last_counts
+        self.last_counts = (dropped, received)
+        congested = dropped - last_dropped > CONGESTION_DROP_RATIO * max(received - last_received, 1)
+        if congested:
+            self.penalty = min(self.penalty + 1, len(self.scales) - 1)
+            self.clean_intervals = 0
+        elif self.penalty:
+            self.clean_intervals += 1
+            if self.clean_intervals >= CLEAN_INTERVALS_TO_RAISE:
+                self.penalty -= 1
+                self.clean_intervals = 0
+        wanted = layer_for_width(self.scales, source_width, sink_width) if sink_width else 0
+        sink = min(wanted + self.penalty, len(self.scales) - 1)
+        preview = layer_for_width(self.scales, source_width, preview_width) if preview_width else None
+        return sink, preview
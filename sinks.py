@@ -0,0 +1,113 @@
+import time
+import cv2
+from frame_buffers import COLOR_FORMAT_BGR, COLOR_FORMAT_I420, COLOR_FORMAT_RGB, COLOR_FORMATS
+
+# Outputs for decoded frames. A sink takes frames in one of its color_formats
+# (see frame_buffers.py) with send(frame), and must be done with the frame when
+# send returns: callers reuse the buffer. It can pace a caller with
+# sleep_until_next_frame() (MosaicOutput; ServerPipeline paces itself by its
+# jitter buffer) and is released with close(). Sink factories are called with
+# (width, height, source fps, color format of the stream) on the first frame
+# and open the sink in that format when they can; a configured fps overrides
+# the source's. SINK_COLOR_FORMATS is what a server asks its clients to send
+# for each kind of sink, preferred first. Optional backends are imported only
+# when a sink of that kind is opened, so nodes without them can still run.
+SINK_VIRTUAL_CAM = "virtualcam"
+SINK_FILE = "file"
+SINK_NULL = "null"
+SINKS = (SINK_VIRTUAL_CAM, SINK_FILE, SINK_NULL)
+DEFAULT_SINK_FPS = 20
+DEFAULT_FILE_PATH = "session-{session}.mp4"  # {session} is the session id, or "mosaic"
+FILE_FOURCC = "mp4v"
+VIRTUAL_CAM_FORMATS = (COLOR_FORMAT_RGB, COLOR_FORMAT_BGR, COLOR_FORMAT_I420)  # RGB is pyvirtualcam's default
+SINK_COLOR_FORMATS = {
+    SINK_VIRTUAL_CAM: VIRTUAL_CAM_FORMATS,
+    SINK_FILE: (COLOR_FORMAT_BGR,),
+    SINK_NULL: COLOR_FORMATS,
+}
+
+
+class PacedSink:
+    color_formats = (COLOR_FORMAT_RGB,)
+
+    def __init__(self, width, height, fps):
+        self.width = width
+        self.height = height
+        self.interval = 1 / fps
+        self.next_frame = time.perf_counter()
+
+    def sleep_until_next_frame(self):
+        self.next_frame += self.interval
+        delay = self.next_frame - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            self.next_frame = time.perf_counter()
+
+    def close(self):
+        pass
+
+
+class NullSink(PacedSink):
+    # Discards frames at a fixed rate; used by the load test and headless runs
+    color_formats = COLOR_FORMATS
+
+    def __init__(self, width, height, fps=30, color_format=COLOR_FORMAT_BGR):
+        super().__init__(width, height, fps)
+        self.frames = 0
+
+    def send(self, frame):
+        self.frames += 1
+
+
+class FileSink(PacedSink):
+    # Records the output to a video file, at the sink rate like a virtual camera would show it
+    color_formats = (COLOR_FORMAT_BGR,)
+
+    def __init__(self, path, width, height, fps=DEFAULT_SINK_FPS):
+        super().__init__(width, height, fps)
+        self.writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*FILE_FOURCC), fps, (width, height))
+        if not self.writer.isOpened():
+            raise RuntimeError(f"Cannot open {path} for writing")
+        print(f"Server: Recording to {path}")
+
+    def send(self, frame):
+        self.writer.write(frame)
+
+    def close(self):
+        self.writer.release()
+
+
+class VirtualCamSink:
+    # pyvirtualcam camera, opened in the stream's color format when it takes that, RGB otherwise
+    def __init__(self, width, height, fps=DEFAULT_SINK_FPS, color_format=COLOR_FORMAT_RGB):
+        import pyvirtualcam
+        if color_format not in VIRTUAL_CAM_FORMATS:
+            color_format = COLOR_FORMAT_RGB
+        self.color_formats = (color_format,)
+        self.camera = pyvirtualcam.Camera(width=width, height=height, fps=fps,
+                                          fmt=getattr(pyvirtualcam.PixelFormat, color_format.upper()))
+        print(f"Server: Virtual camera initialized: {self.camera.device} ({color_format})")
+
+    def send(self, frame):
+        self.camera.send(frame)
+
+    def sleep_until_next_frame(self):
+        self.camera.sleep_until_next_frame()
+
+    def close(self):
+        self.camera.close()
+
+
+def make_sink_factory(kind, fps=None, path=DEFAULT_FILE_PATH, session="mosaic"):
+    # Returns the (width, height, source fps, color format) -> sink callable a pipeline opens on its first frame
+    if kind == SINK_VIRTUAL_CAM:
+        return lambda width, height, source_fps, color_format: VirtualCamSink(width, height, fps or source_fps,
+                                                                              color_format)
+    if kind == SINK_FILE:
+        return lambda width, height, source_fps, color_format: FileSink(path.format(session=session), width,
+                                                                        height, fps or source_fps)
+    if kind == SINK_NULL:
+        return lambda width, height, source_fps, color_format: NullSink(width, height, fps or source_fps,
+                                                                        color_format)
+    raise ValueError(f"Unknown sink: {kind}")
@@ -0,0 +1,79 @@
+import struct
+from collections import namedtuple
+
+# Every frame on the stream port starts with a fixed little-endian header:
+# magic, version, codec id, flags, channels, dtype code, width, height,
+# capture timestamp (time.time()), sequence number and payload length.
+# The header comes off the network unauthenticated, so a payload length above
+# MAX_PAYLOAD_SIZE is refused before anything is allocated for it.
+FRAME_MAGIC = b"UOIP"
+PROTOCOL_VERSION = 1
+FRAME_HEADER = struct.Struct("<4sBBBBBHHdII")
+MAX_PAYLOAD_SIZE = 64 << 20  # 64 MB, room for a raw 4K frame of 16-bit samples
+INITIAL_BUFFER_SIZE = 1 << 20  # 1 MB, grown on demand
+
+FrameHeader = namedtuple("FrameHeader", [
+    "codec_id", "flags", "channels", "dtype", "width", "height", "timestamp", "sequence", "payload_length",
+])
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def pack_frame_header(header):
+    return FRAME_HEADER.pack(FRAME_MAGIC, PROTOCOL_VERSION, *header)
+
+
+def unpack_frame_header(data):
+    if len(data) < FRAME_HEADER.size:
+        raise ProtocolError(f"Truncated frame header: {len(data)} of {FRAME_HEADER.size} bytes")
+    magic, version, *fields = FRAME_HEADER.unpack_from(data)
+    if magic != FRAME_MAGIC:
+        raise ProtocolError(f"Bad frame magic: {bytes(magic)!r}")
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError(f"Unsupported protocol version: {version}")
+    header = FrameHeader(*fields)
+    if header.payload_length > MAX_PAYLOAD_SIZE:
+        raise ProtocolError(f"Frame payload too large: {header.payload_length} bytes")
+    return header
+
+
+class FrameReader:
+    # Reads framed messages from a socket into one reusable buffer.
+    # read_frame returns (header, memoryview) where the view points into that
+    # buffer and is only valid until the next call, so callers must decode
+    # (or copy) it before reading again.
+    def __init__(self, sock, initial_size=INITIAL_BUFFER_SIZE):
+        self.sock = sock
+        self.header_buffer = bytearray(FRAME_HEADER.size)
+        self.header_view = memoryview(self.header_buffer)
+        self.buffer = bytearray(initial_size)
+        self.view = memoryview(self.buffer)
+        self.last_frame_size = 0  # Payload plus header, for bitrate calculation
+
+    def recv_exact(self, view):
+        # Fill the whole view; returns False if the peer closed the connection
+        while view:
+            received = self.sock.recv_into(view)
+            if not received:
+                return False
+            view = view[received:]
+        return True
+
+    def ensure_capacity(self, size):
+        if size > len(self.buffer):
+            # Grow geometrically so a slowly increasing frame size doesn't reallocate every frame
+            self.buffer = bytearray(min(max(size, len(self.buffer) * 2), MAX_PAYLOAD_SIZE))
+            self.view = memoryview(self.buffer)
+
+    def read_frame(self):
+        if not self.recv_exact(self.header_view):
+            return None
+        header = unpack_frame_header(self.header_buffer)
+        self.ensure_capacity(header.payload_length)
+        payload = self.view[:header.payload_length]
+        if not self.recv_exact(payload):
+            return None
+        self.last_frame_size = header.payload_length + FRAME_HEADER.size
+        return header, payload
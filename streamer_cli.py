@@ -0,0 +1,178 @@
+import argparse
+import signal
+import threading
+import time
+from frame_codecs import CODECS, DEFAULT_CODEC, DEFAULT_JPEG_QUALITY, DEFAULT_PNG_COMPRESSION, get_codec
+from adaptive_bitrate import DEFAULT_LATENCY_BUDGET
+from udp_transport import TRANSPORT_TCP, TRANSPORTS
+from metrics import DEFAULT_METRICS_INTERVAL
+from sinks import DEFAULT_FILE_PATH, SINK_VIRTUAL_CAM, SINKS, make_sink_factory
+from frame_buffers import COLOR_FORMATS
+from pipeline import DECODER_THREADS, ServerPipeline
+from delta_codec import DeltaDecoder
+from devices import DeviceInventory, format_device
+from simulcast import DEFAULT_LAYERS, format_layers, parse_layers
+from recording import DEFAULT_RECORD_PATH, RecordingReader, replay
+from discovery import format_server, get_local_ip
+from net_engine import ClientNetwork, NetworkEngine
+from streamer_core import DEFAULT_PORT, OUTPUT_MOSAIC, OUTPUT_PER_CLIENT, VIRTUAL_CAM_FPS, StreamClient, StreamServer, \
+    StreamViewer
+
+# Headless entry point: runs the streaming core without Tk, e.g. as a service
+# on an ingest node. Stops cleanly on Ctrl+C or SIGTERM.
+#   python streamer_cli.py server --sink null --stats
+#   python streamer_cli.py client --host 192.168.1.20 --codec jpeg --fps 15
+#   python streamer_cli.py replay --recording recordings/session-1-... --speed 2
+#   python streamer_cli.py servers
+#   python streamer_cli.py viewer --host 192.168.1.20 --session 3 --sink file
+EVENT_WAIT = 0.1  # Seconds to wait for network events between stats checks
+
+
+def print_notification(event, *args):
+    if event == "status":
+        print(f"Status: {args[0]}")
+    elif event == "error":
+        print(f"Error: {args[0]}")
+
+
+def parse_size(text):
+    try:
+        width, height = (int(value) for value in text.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected WIDTHxHEIGHT, got {text!r}")
+    return width, height
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="USB webcam streamer without a GUI")
+    parser.add_argument("mode", choices=("server", "client", "viewer", "replay", "cameras", "servers"))
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="stream port (server)")
+    parser.add_argument("--fps", type=int, default=None,
+                        help="output rate (server, viewer and replay, default: the source's, "
+                             f"{VIRTUAL_CAM_FPS} for the mosaic) or capture rate cap (client)")
+    parser.add_argument("--stats", action="store_true", help="print bitrate and stage timings every second")
+    parser.add_argument("--metrics-port", type=int, help="serve JSON metrics at http://127.0.0.1:PORT/metrics")
+    parser.add_argument("--metrics-log", help="append JSON metrics to this file")
+    parser.add_argument("--metrics-interval", type=float, default=DEFAULT_METRICS_INTERVAL, help="seconds between log lines")
+
+    server = parser.add_argument_group("server")
+    server.add_argument("--sink", choices=SINKS, default=SINK_VIRTUAL_CAM, help="also used by viewer and replay")
+    server.add_argument("--output", choices=("per-client", "mosaic"), default="per-client")
+    server.add_argument("--path", default=DEFAULT_FILE_PATH, help="file sink path, {session} is replaced")
+    server.add_argument("--color", choices=COLOR_FORMATS,
+                        help="color format to ask raw-codec clients for (default: what the sink takes best)")
+    server.add_argument("--record", nargs="?", const=DEFAULT_RECORD_PATH,
+                        help=f"record each session's encoded stream (default {DEFAULT_RECORD_PATH})")
+
+    replay_group = parser.add_argument_group("replay")
+    replay_group.add_argument("--recording", help="recording directory written by server --record")
+    replay_group.add_argument("--speed", type=float, default=1.0, help="playback speed multiplier")
+    replay_group.add_argument("--start", type=float, default=0.0, help="seconds into the recording")
+    replay_group.add_argument("--loop", action="store_true", help="start over at the end")
+
+    client = parser.add_argument_group("client")
+    client.add_argument("--host", help="server address; discovered by a broadcast query if omitted")
+    client.add_argument("--session", type=int, help="viewer mode: session to watch (default the server's oldest)")
+    client.add_argument("--camera", type=int, default=0, help="index, see the cameras mode")
+    client.add_argument("--probe", action="store_true", help="cameras mode: only list cameras that open")
+    client.add_argument("--size", type=parse_size, default=(0, 0), help="camera resolution to request, e.g. 1280x720")
+    client.add_argument("--camera-fps", type=int, default=0, help="camera frame rate to request")
+    client.add_argument("--format", dest="pixel_format", help="camera pixel format (FOURCC), e.g. MJPG or YUYV")
+    client.add_argument("--simulcast", nargs="?", const=format_layers(DEFAULT_LAYERS), default="",
+                        help="offer layers at these scales, the server picks per output "
+                             f"(default {format_layers(DEFAULT_LAYERS)})")
+    client.add_argument("--passthrough", action="store_true",
+                        help="send the camera's MJPEG frames without decoding (jpeg codec, no delta)")
+    client.add_argument("--codec", choices=list(CODECS), default=DEFAULT_CODEC)
+    client.add_argument("--quality", type=int, help="JPEG quality 1-100 or PNG compression level 0-9 "
+                                                    f"(default {DEFAULT_JPEG_QUALITY} and {DEFAULT_PNG_COMPRESSION})")
+    client.add_argument("--transport", choices=TRANSPORTS, default=TRANSPORT_TCP)
+    client.add_argument("--delta", action="store_true", help="send only changed tiles plus keyframes")
+    client.add_argument("--no-adaptive", action="store_true", help="keep quality, resolution and fps fixed")
+    client.add_argument("--latency-ms", type=int, default=int(DEFAULT_LATENCY_BUDGET * 1000))
+    return parser.parse_args()
+
+
+def run_replay(args, stopping):
+    # Plays a recording through the server's decode pipeline into a sink, without any network
+    reader = RecordingReader(args.recording)
+    meta = reader.meta
+    print(f"Replay: {len(reader)} frames, {reader.duration():.1f} s of {meta['codec']} from {meta.get('address')}")
+    delta = DeltaDecoder() if meta.get("delta") else None
+    pipeline = ServerPipeline(None, get_codec(meta["codec"], meta.get("quality")),
+                              make_sink_factory(args.sink, args.fps, args.path, session="replay"),
+                              lambda error: stopping.set(), delta=delta,
+                              decoder_threads=1 if delta else DECODER_THREADS)
+    pipeline.start()
+    try:
+        fed = replay(reader, pipeline, speed=args.speed, start=args.start, loop=args.loop, stopping=stopping)
+        # Let the last frame reach the sink
+        time.sleep(EVENT_WAIT)
+        print(f"Replay: Fed {fed} frames | {pipeline.stage_report()}")
+    finally:
+        pipeline.stop()
+        reader.close()
+
+
+def list_servers():
+    # Every server on the subnet that answers a discovery query, least loaded first
+    engine = NetworkEngine()
+    try:
+        servers = engine.submit(ClientNetwork(engine, get_local_ip()).find_servers()).result()
+    finally:
+        engine.stop()
+    for server in servers:
+        print(format_server(server))
+    if not servers:
+        print("No servers answered")
+
+
+def main():
+    args = parse_args()
+    stopping = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *args: stopping.set())
+
+    if args.mode == "cameras":
+        for device in DeviceInventory(probe=args.probe).devices():
+            print(f"{format_device(device)}  {device.id}")
+        return
+    if args.mode == "servers":
+        list_servers()
+        return
+    if args.mode == "replay":
+        if not args.recording:
+            raise SystemExit("replay needs --recording")
+        run_replay(args, stopping)
+        return
+    if args.mode == "server":
+        core = StreamServer(print_notification, port=args.port,
+                            output_mode=OUTPUT_MOSAIC if args.output == "mosaic" else OUTPUT_PER_CLIENT,
+                            sink=args.sink, fps=args.fps, path=args.path,
+                            record_path=args.record, color_format=args.color)
+    elif args.mode == "viewer":
+        core = StreamViewer(print_notification, host=args.host, session_id=args.session, sink=args.sink, fps=args.fps,
+                            path=args.path)
+    else:
+        core = StreamClient(print_notification, camera_index=args.camera, host=args.host, port=args.port,
+                            codec_name=args.codec, quality=args.quality, transport=args.transport,
+                            delta=args.delta, adaptive=not args.no_adaptive,
+                            latency_budget=args.latency_ms / 1000, fps=args.fps or 0, capture_size=args.size,
+                            capture_fps=args.camera_fps, pixel_format=args.pixel_format,
+                            passthrough=args.passthrough, layers=parse_layers(args.simulcast))
+
+    if args.metrics_port is not None or args.metrics_log:
+        core.start_metrics(args.metrics_port, args.metrics_log, args.metrics_interval)
+    core.start()
+    try:
+        while not stopping.is_set():
+            core.handle_events(timeout=EVENT_WAIT)
+            stats = core.collect_stats(time.time())
+            if args.stats and stats is not None:
+                print(" | ".join(stats))
+    finally:
+        core.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,678 @@
+import socket
+import threading
+import time
+import cv2
+from frame_buffers import COLOR_FORMAT_BGR, COLOR_FORMATS, format_color_formats
+from frame_codecs import CODEC_JPEG, CODEC_RAW, DEFAULT_CODEC, get_codec, parse_codec_params, parse_params
+from pipeline import DECODER_THREADS, ClientPipeline, ServerPipeline
+from sessions import MOSAIC_COLUMNS, MosaicOutput, SessionRegistry, send_session_hello
+from delta_codec import KEYFRAME_MESSAGE, DeltaDecoder, DeltaEncoder
+from adaptive_bitrate import DEFAULT_LATENCY_BUDGET, STATS_MESSAGE, AdaptiveBitrateController, format_stats_report, parse_stats_report
+from udp_transport import TRANSPORT_TCP
+from net_engine import CONNECT_TIMEOUT, STOP_MESSAGE, ClientNetwork, NetworkEngine, ServerNetwork, format_stream_params, \
+    parse_color_format, parse_transport
+from discovery import get_local_ip
+from control_protocol import CAP_HEARTBEAT, CAP_MUX, CAP_RESUME, CAP_STATS, format_capabilities, parse_capabilities
+from sinks import DEFAULT_FILE_PATH, SINK_COLOR_FORMATS, SINK_VIRTUAL_CAM, make_sink_factory
+from metrics import DEFAULT_METRICS_INTERVAL, MetricsExporter
+from recording import RecordingWriter, recording_path
+from simulcast import DEFAULT_LAYERS, LAYERS_MESSAGE, LayerSelector, format_layers_message, parse_layers, parse_layers_message
+from capture import confirm_passthrough, format_capture_mode, negotiate_capture, wait_for_first_frame
+from relay import RELAY_MAGIC
+from stream_io import FrameReader
+
+# GUI-free streaming core shared by the Tk front end (webcam_streamer.py) and
+# the command line (streamer_cli.py). The front end passes engine events to
+# handle_events() on its own thread, and the core reports back through
+# notify(event, *args):
+#   "status" (text, color), "error" (text), "server_ip" (ip), "started" (), "stopped" ()
+# StreamServer and StreamClient are the two ends of a stream; StreamViewer
+# watches a session a server relays.
+DEFAULT_PORT = 9999
+VIRTUAL_CAM_FPS = 20  # Mosaic output rate; per-client sinks run at their source's rate unless fps is set
+RECONNECT_DELAY = 1  # Seconds between attempts when the client has a fixed server host
+STATS_INTERVAL = 1  # Seconds between bitrate/stage reports
+
+# Server output: a sink per client, or every client tiled into one
+OUTPUT_PER_CLIENT = "Per client"
+OUTPUT_MOSAIC = "Mosaic"
+OUTPUT_MODES = (OUTPUT_PER_CLIENT, OUTPUT_MOSAIC)
+
+
+def format_bitrate(wire_bytes, raw_bytes, elapsed, codec_name, delta=None):
+    # Wire bitrate and how much the codec (and delta mode) saved compared to raw frames
+    bitrate = (wire_bytes * 8) / elapsed / 1_000_000  # Mbps
+    ratio = raw_bytes / wire_bytes if wire_bytes else 0
+    text = f"Bitrate: {bitrate:.2f} Mbps ({codec_name} {ratio:.1f}:1)"
+    if delta is not None:
+        text += f", {delta.stats.report()}"
+    return text
+
+
+class StreamerCore:
+    def __init__(self, notify):
+        self.notify = notify
+        self.local_ip = get_local_ip()
+        self.engine = NetworkEngine()
+        self.streaming = False
+        self.last_update_time = time.time()
+        self.exporter = None
+
+    def handle_events(self, timeout=None):
+        # Events posted by the network engine, dispatched to the on_<event> handlers
+        for name, args in self.engine.take_events(timeout):
+            getattr(self, "on_" + name)(*args)
+
+    def on_status(self, text, color):
+        self.notify("status", text, color)
+
+    def start_metrics(self, port=None, log_path=None, interval=DEFAULT_METRICS_INTERVAL):
+        # Serve metrics() on a local HTTP port and/or append it to a JSON-lines log
+        self.exporter = MetricsExporter(self.engine, self.metrics, port, log_path, interval)
+        self.exporter.start()
+
+    def shutdown(self):
+        if self.streaming:
+            self.stop()
+        if self.exporter is not None:
+            self.exporter.stop()
+        self.engine.stop()
+
+
+class StreamServer(StreamerCore):
+    def __init__(self, notify, port=DEFAULT_PORT, output_mode=OUTPUT_PER_CLIENT, sink=SINK_VIRTUAL_CAM,
+                 fps=None, path=DEFAULT_FILE_PATH, record_path=None, color_format=None):
+        super().__init__(notify)
+        self.port = port
+        self.output_mode = output_mode
+        self.sink = sink
+        self.fps = fps
+        self.path = path
+        self.record_path = record_path  # Directory pattern to record each session's stream to, or None
+        self.color_format = color_format  # Of raw streams, None for whatever the sink takes best
+        self.preview_width = None  # Width the front end previews the oldest session at, None without a preview
+        # One session per connected client, each with its own sink or a cell in a shared mosaic
+        self.sessions = SessionRegistry()
+        self.network = ServerNetwork(self.engine, self.sessions, self.local_ip, self.session_sink_factory,
+                                     self.session_recorder, self.session_refusal)
+        self.mosaic = None
+
+    def start(self):
+        # Presence broadcasts, the control listener and the stream listener all run on the engine's loop
+        if self.color_format is not None:
+            self.network.color_formats = (self.color_format,)
+        else:
+            # The mosaic grid is BGR
+            self.network.color_formats = SINK_COLOR_FORMATS[self.sink] if self.output_mode != OUTPUT_MOSAIC \
+                else (COLOR_FORMAT_BGR,)
+        self.engine.submit(self.network.start(self.port))
+        self.streaming = True
+        self.last_update_time = time.time()
+        self.notify("started")
+        self.notify("status", "Waiting for client...", "orange")
+
+    def stop(self):
+        # Stop broadcasting and listening, send the stop command to every client and end their sessions
+        stopped = self.engine.submit(self.network.stop())
+        self.streaming = False
+        if self.mosaic is not None:
+            self.mosaic.stop()
+            self.mosaic = None
+        self.notify("stopped")
+        self.notify("status", "Stopped. Waiting to start...", "orange")
+        return stopped
+
+    def shutdown(self):
+        if self.streaming:
+            self.stop().result(timeout=5)
+        super().shutdown()
+
+    def session_sink_factory(self, session):
+        # Called by the network engine when a session's stream starts
+        if self.output_mode == OUTPUT_MOSAIC:
+            if self.mosaic is None:
+                self.mosaic = MosaicOutput(make_sink_factory(self.sink, self.fps, self.path),
+                                           fps=self.fps or VIRTUAL_CAM_FPS)
+            tile = self.mosaic.tile_for(session.id)
+            return lambda width, height, source_fps, color_format: tile
+        return make_sink_factory(self.sink, self.fps, self.path, session=session.id)
+
+    def session_refusal(self, addr):
+        # Called by the network engine before a new session starts: the mosaic has a fixed number of cells
+        if self.output_mode == OUTPUT_MOSAIC:
+            cells = self.mosaic.cells if self.mosaic is not None else MOSAIC_COLUMNS * MOSAIC_COLUMNS
+            if len(self.sessions) >= cells:
+                return f"the mosaic is full ({cells} cells)"
+        return None
+
+    def session_recorder(self, session):
+        # Called by the network engine next to session_sink_factory; a failed recording doesn't stop the stream
+        if self.record_path is None:
+            return None
+        try:
+            return RecordingWriter(recording_path(self.record_path, session.id), session.recording_meta())
+        except OSError as e:
+            print(f"Server: Cannot record session {session.label()}: {e}")
+            return None
+
+    def on_session_started(self, session):
+        self.update_session_status()
+
+    def on_session_resumed(self, session):
+        self.update_session_status()
+
+    def on_session_closed(self, session, error):
+        # Only this client's session ends; the server keeps serving the others
+        if error is not None:
+            print(f"Server: Session {session.label()} failed: {error}")
+        else:
+            print(f"Server: Client {session.label()} disconnected")
+        self.update_session_status()
+
+    def update_session_status(self):
+        if not self.streaming:
+            return
+        if len(self.sessions):
+            self.notify("status", f"Connected: {len(self.sessions)} client(s)", "green")
+        else:
+            self.notify("status", "Waiting for client...", "orange")
+
+    def on_stop_requested(self):
+        self.notify("status", "Stopping streaming...", "orange")
+        if self.streaming:
+            self.stop()
+
+    def on_server_error(self, error):
+        print(f"Server: Error starting listeners: {error}")
+        self.notify("error", str(error))
+        if self.streaming:
+            self.stop()
+
+    def active_sessions(self):
+        # Sessions whose stream has started, oldest first
+        return [session for session in self.sessions.all() if session.pipeline is not None]
+
+    def collect_stats(self, now):
+        # Every STATS_INTERVAL: sends each client its stats report and returns
+        # (bitrate text, stage text) for the oldest session, otherwise None
+        if now - self.last_update_time < STATS_INTERVAL:
+            return None
+        elapsed = now - self.last_update_time
+        self.last_update_time = now
+        sessions = self.active_sessions()
+        wire_bytes = 0
+        raw_bytes = 0
+        for session in sessions:
+            session_bytes, session_raw_bytes = session.pipeline.take_counters()
+            wire_bytes += session_bytes
+            raw_bytes += session_raw_bytes
+            self.send_stats_report(session, session_bytes / elapsed)
+            self.update_layers(session, preview=session is sessions[0])
+        if not sessions:
+            return None
+        first = sessions[0]
+        codec_name = first.codec.name if len(sessions) == 1 else f"{len(sessions)} clients"
+        control = first.control_conn
+        return (format_bitrate(wire_bytes, raw_bytes, elapsed, codec_name, first.pipeline.delta),
+                f"{first.label()}: {first.pipeline.stage_report()}{control.rtt_report() if control else ''}")
+
+    def metrics(self):
+        sessions = {}
+        for session in self.active_sessions():
+            control = session.control_conn
+            sessions[session.id] = {"address": session.address[0], "codec": session.codec.name,
+                                    "transport": session.transport, **session.pipeline.metrics(),
+                                    "control": control.metrics() if control is not None else None,
+                                    "resumes": session.resumes}
+            if session.mux is not None:
+                sessions[session.id]["channels"] = session.mux.metrics()
+            if session.recorder is not None:
+                sessions[session.id]["recording"] = session.recorder.stats()
+            if session.relay.frames:
+                sessions[session.id]["relay"] = session.relay.metrics()
+        return {"role": "server", "streaming": self.streaming, "discovery": self.network.discovery_metrics(),
+                "sessions": sessions}
+
+    def update_layers(self, session, preview):
+        # Subscribe a simulcast client to the layers its consumers need: the sink at
+        # its size (a mosaic cell is small), the preview at preview_width, and the
+        # full-size layer while the session has relay viewers
+        pipeline = session.pipeline
+        if not session.layers or not pipeline.source_width:
+            return
+        if session.layer_selector is None:
+            session.layer_selector = LayerSelector(session.layers)
+        sink_width = None
+        if self.output_mode == OUTPUT_MOSAIC and self.mosaic is not None:
+            sink_width = self.mosaic.cell_rect(0)[2]
+        subscription = session.layer_selector.update(pipeline.source_width, sink_width,
+                                                     self.preview_width if preview else None, *pipeline.frame_counts())
+        if subscription != session.subscription:
+            session.subscription = subscription
+            pipeline.select_layers(*subscription)
+            print(f"Server: Session {session.label()} sink layer {subscription[0]}, preview layer {subscription[1]}")
+        layers = {layer for layer in subscription if layer is not None} | ({0} if session.relay.viewers else set())
+        if layers != session.layers_sent:
+            session.layers_sent = layers
+            self.network.send_control(session, format_layers_message(layers))
+
+    def send_stats_report(self, session, receive_rate):
+        # Tell the client how fast frames arrive and how long the newest one has been waiting here
+        timestamp, received_time = session.pipeline.latest_timing
+        if timestamp is None or CAP_STATS not in session.capabilities:
+            return
+        self.network.send_control(session, format_stats_report(receive_rate, timestamp, time.time() - received_time))
+
+
+class StreamClient(StreamerCore):
+    # Settings are plain attributes so a front end can change them between streams;
+    # call update_request() after changing the codec, quality, transport or delta mode
+    def __init__(self, notify, camera_index=0, host=None, port=DEFAULT_PORT, codec_name=DEFAULT_CODEC,
+                 quality=None, transport=TRANSPORT_TCP, delta=False, adaptive=True,
+                 latency_budget=DEFAULT_LATENCY_BUDGET, fps=0, open_capture=cv2.VideoCapture,
+                 capture_size=(0, 0), capture_fps=0, pixel_format=None, passthrough=False, layers=()):
+        super().__init__(notify)
+        self.camera_index = camera_index
+        self.host = host  # Fixed server address, or None to discover one
+        self.port = port
+        self.codec_name = codec_name
+        self.quality = quality  # On the codec's own scale, None for its default
+        self.transport = transport
+        self.delta = delta  # Send only changed tiles plus periodic keyframes
+        self.adaptive = adaptive  # Lower quality, resolution and fps to stay under the latency budget
+        self.latency_budget = latency_budget  # Seconds
+        self.fps = fps  # Capture rate cap, 0 for the camera rate
+        self.open_capture = open_capture  # Camera index -> cv2.VideoCapture-like object
+        # Camera mode to request: (width, height) and fps, 0 for the driver default, and a FOURCC like "MJPG"
+        self.capture_size = capture_size
+        self.capture_fps = capture_fps
+        self.pixel_format = pixel_format
+        self.passthrough = passthrough  # Send the camera's MJPEG frames as they are, if the stream allows it
+        self.capture_mode = None  # What the camera agreed to, see capture.negotiate_capture
+        self.layers = layers  # Simulcast scales to offer, e.g. DEFAULT_LAYERS; empty for a single stream
+        self.network = ClientNetwork(self.engine, self.local_ip)
+
+        # Agreed on in the control handshake
+        self.codec = get_codec(codec_name, quality)
+        self.server_ip = None
+        self.session_id = None
+        self.session_token = None  # Lets the session be resumed after a dropped connection
+        self.capabilities = set()
+        self.stream_port = None
+        self.stream_layers = ()
+        self.color_format = COLOR_FORMAT_BGR  # Of raw frames on the wire
+
+        self.capture = None
+        self.stream_socket = None
+        self.pipeline = None
+        self.bitrate_controller = None
+        self.send_rate = None  # Bytes/s, measured every STATS_INTERVAL
+
+    def start(self):
+        self.update_request()
+        if self.host:
+            self.network.connect_to(self.host)
+            self.notify("status", f"Connecting to {self.host}...", "orange")
+        else:
+            self.engine.submit(self.network.start_discovery())
+            self.notify("status", "Searching for server...", "orange")
+
+    def update_request(self):
+        # The codec and transport proposed in the start command
+        requested_codec = get_codec(self.codec_name, self.quality)
+        # Layers are encoded from decoded frames, one by one, so not with delta mode or passthrough
+        layers = self.layers if not self.delta and not self.passthrough else ()
+        # Raw frames can be sent in any color format; the server picks the one its sinks take
+        colors = COLOR_FORMATS if requested_codec.name == CODEC_RAW and not self.delta else ()
+        # Stats reports are only useful with the adaptive bitrate controller
+        capabilities = {CAP_HEARTBEAT, CAP_RESUME} | ({CAP_STATS} if self.adaptive else set())
+        if self.transport == TRANSPORT_TCP:
+            capabilities.add(CAP_MUX)
+        self.network.request = format_stream_params(requested_codec, self.transport, self.delta, layers) + \
+            f";caps={format_capabilities(capabilities)}".encode()
+        if colors:
+            self.network.request += f";colors={format_color_formats(colors)}".encode()
+
+    def on_server_discovered(self, server_ip):
+        self.notify("server_ip", server_ip)
+
+    def on_connect_failed(self, server_ip, error):
+        self.notify("status", f"Error: {error}", "red")
+        self.cleanup_resources()
+        self.schedule_reconnect()
+
+    def on_stream_accepted(self, server_ip, params):
+        self.accept_stream(server_ip, params)
+        print(f"Client: Received start confirmation from server for session {self.session_id}, "
+              f"{format_stream_params(self.codec, self.transport, self.delta, self.stream_layers, self.color_format).decode()}")
+        self.notify("status", "Starting streaming...", "orange")
+        self.streaming = True
+        threading.Thread(target=self.start_streaming, daemon=True).start()
+
+    def on_stream_resumed(self, server_ip, params):
+        # Same session, same parameters; the camera is still open, only the stream is set up again
+        self.accept_stream(server_ip, params)
+        print(f"Client: Resumed session {self.session_id}")
+        self.notify("status", "Resuming streaming...", "orange")
+        self.streaming = True
+        threading.Thread(target=self.start_streaming, daemon=True).start()
+
+    def accept_stream(self, server_ip, params):
+        # The server answers with the parameters it accepted
+        self.server_ip = server_ip
+        self.codec = parse_codec_params(params)
+        self.transport = parse_transport(params)
+        self.delta = parse_params(params).get("delta") == "1"
+        # The server names our session and the port to stream to
+        self.session_id = int(parse_params(params).get("session", 0))
+        self.session_token = parse_params(params).get("token")
+        self.capabilities = parse_capabilities(params)
+        self.stream_port = int(parse_params(params).get("stream_port", self.network.stream_port(server_ip, self.port)))
+        self.stream_layers = parse_layers(parse_params(params).get("layers", ""))
+        self.color_format = parse_color_format(params)
+
+    def on_resume_failed(self, server_ip, error):
+        # The server is reachable but forgot the session (e.g. it restarted), or unreachable: try a new session
+        # on the same server right away instead of waiting for its next broadcast
+        self.notify("status", f"Reconnecting to {server_ip}...", "orange")
+        self.network.connect_to(server_ip)
+
+    def start_streaming(self):
+        # Runs on its own thread: opening the camera and connecting both block
+        try:
+            self.notify("status", "Connecting to server...", "orange")
+            # Passthrough sends JPEG as the camera made it, so there is nothing to patch for delta mode
+            passthrough = self.passthrough and self.codec.name == CODEC_JPEG and not self.delta
+            if self.passthrough and not passthrough:
+                print("Client: MJPEG passthrough needs the jpeg codec without delta mode, encoding instead")
+            if self.capture is not None and self.capture_mode is not None and \
+                    self.capture_mode["passthrough"] == passthrough:
+                # Kept open across a resume: reopening a camera takes far longer than the reconnect
+                self.open_stream()
+                return
+            if self.capture is None:
+                # Open the webcam using the selected index
+                self.capture = self.open_capture(self.camera_index)
+                if not self.capture.isOpened():
+                    raise RuntimeError("Cannot open webcam")
+            self.capture_mode = negotiate_capture(self.capture, *self.capture_size, self.capture_fps,
+                                                  self.pixel_format, passthrough)
+            confirm_passthrough(self.capture, self.capture_mode, wait_for_first_frame(self.capture))
+            print(f"Client: Camera mode {format_capture_mode(self.capture_mode)}")
+            self.open_stream()
+        except Exception as e:
+            self.engine.post("stream_error", e)
+
+    def open_stream(self):
+        self.last_update_time = time.time()
+        # The stream connection lives on the network engine; the pipeline sends through a blocking adapter
+        self.stream_socket = self.network.open_stream(self.transport, (self.server_ip, self.stream_port),
+                                                      self.session_id, self.session_token,
+                                                      CAP_MUX in self.capabilities)
+        print(f"Client: Connected to server at {self.server_ip}:{self.stream_port} over {self.transport}")
+        self.notify("status", "Connected", "green")
+
+        # Capture, encode and send run on their own threads
+        self.bitrate_controller = None
+        if self.adaptive:
+            self.bitrate_controller = AdaptiveBitrateController(self.codec.quality or 100, self.latency_budget)
+        pipeline = ClientPipeline(self.capture, self.stream_socket, self.codec,
+                                  on_error=lambda e: self.engine.post("stream_error", e),
+                                  delta=DeltaEncoder() if self.delta else None, max_fps=self.fps,
+                                  passthrough=(self.capture_mode["width"], self.capture_mode["height"])
+                                  if self.capture_mode["passthrough"] else None,
+                                  layers=() if self.capture_mode["passthrough"] else self.stream_layers,
+                                  color_format=self.color_format)
+        pipeline.start()
+        self.pipeline = pipeline
+        self.notify("started")
+
+    def on_stream_error(self, error):
+        if not self.streaming:
+            return
+        print(f"Client: Streaming stopped: {error}")
+        if self.pipeline is None:
+            self.notify("error", str(error))
+        elif self.can_resume():
+            self.recover()
+            return
+        self.notify("status", "Disconnected", "red")
+        self.stop()
+
+    def can_resume(self):
+        return CAP_RESUME in self.capabilities and self.session_token is not None and self.server_ip is not None
+
+    def recover(self):
+        # Connection trouble while streaming: keep the camera, drop the stream and get the session back
+        # from the same server directly, without going through discovery
+        print(f"Client: Connection to {self.server_ip} lost, resuming session {self.session_id}")
+        self.notify("status", "Reconnecting...", "orange")
+        self.streaming = False
+        self.cleanup_resources(release_capture=False)
+        self.network.resume(self.server_ip, self.session_id, self.session_token)
+
+    def on_control_message(self, line):
+        if not self.streaming:
+            return
+        if line == STOP_MESSAGE:
+            print("Client: Received stop command from server")
+            self.notify("status", "Server requested to stop", "orange")
+            self.stop()
+        elif line.startswith(STATS_MESSAGE):
+            self.handle_stats_report(line)
+        elif line.startswith(KEYFRAME_MESSAGE):
+            # The server lost part of the delta chain; the next frame it gets should be whole
+            if self.pipeline is not None and self.pipeline.delta is not None:
+                self.pipeline.delta.force_keyframe()
+        elif line.startswith(LAYERS_MESSAGE):
+            if self.pipeline is not None:
+                layers = parse_layers_message(line)
+                print(f"Client: Server subscribed to layers {sorted(layers)}")
+                self.pipeline.subscribe(layers)
+        else:
+            print("Client: Received unknown control message:", line)
+
+    def on_server_disconnected(self):
+        if not self.streaming:
+            return
+        if self.pipeline is not None and self.can_resume():
+            self.recover()
+            return
+        self.notify("status", "Server disconnected", "red")
+        self.stop()
+
+    def handle_stats_report(self, line):
+        # Feed the server's receive rate and the measured latency to the bitrate controller
+        if self.bitrate_controller is None or self.pipeline is None:
+            return
+        report = parse_stats_report(line, time.time())
+        if report is None:
+            print(f"Client: Ignoring malformed stats report: {line[:80]}")
+            return
+        receive_rate, latency = report
+        settings = self.bitrate_controller.update(latency, receive_rate, self.send_rate)
+        if settings != self.pipeline.settings:
+            print(f"Client: Latency {latency * 1000:.0f} ms, switching to quality {settings.quality}, "
+                  f"scale {settings.scale}, {settings.fps} fps")
+            self.pipeline.apply_settings(settings)
+
+    def stop(self):
+        self.streaming = False
+        self.cleanup_resources()
+        # Drop the server connection and go back to searching
+        self.network.reset()
+        self.schedule_reconnect()
+        self.notify("stopped")
+        self.notify("status", "Stopped. Searching for server...", "orange")
+
+    def schedule_reconnect(self):
+        # Discovery resumes by itself; a fixed host is retried after a short delay
+        if self.host:
+            self.engine.call(self.engine.loop.call_later, RECONNECT_DELAY, self.network.start_connect, self.host)
+
+    def shutdown(self):
+        # The camera stays open while a session is being resumed, when streaming is already False
+        super().shutdown()
+        self.cleanup_resources()
+
+    def cleanup_resources(self, release_capture=True):
+        # Stop the pipeline first, unblocking a sender stuck in sendall
+        if self.pipeline is not None:
+            if self.stream_socket is not None:
+                self.stream_socket.shutdown(socket.SHUT_RDWR)
+            self.pipeline.stop()
+            self.pipeline = None
+        if self.stream_socket is not None:
+            self.stream_socket.close()
+            self.stream_socket = None
+        if self.capture is not None and release_capture:
+            self.capture.release()
+            self.capture = None
+
+    def collect_stats(self, now):
+        # Every STATS_INTERVAL: returns (bitrate text, stage text), otherwise None
+        if self.pipeline is None or now - self.last_update_time < STATS_INTERVAL:
+            return None
+        elapsed = now - self.last_update_time
+        self.last_update_time = now
+        wire_bytes, raw_bytes = self.pipeline.take_counters()
+        self.send_rate = wire_bytes / elapsed
+        report = self.pipeline.stage_report()
+        settings = self.pipeline.settings
+        if settings is not None:
+            fps = min(settings.fps, self.fps) if self.fps else settings.fps
+            report += f" | q{settings.quality} x{settings.scale} {fps} fps"
+        report += self.network.rtt_report()
+        return format_bitrate(wire_bytes, raw_bytes, elapsed, self.codec.name, self.pipeline.delta), report
+
+    def metrics(self):
+        metrics = {"role": "client", "streaming": self.streaming, "codec": self.codec.name, "transport": self.transport}
+        pipeline = self.pipeline
+        if self.capture_mode is not None:
+            metrics["camera"] = self.capture_mode
+        metrics["control"] = self.network.control_metrics()
+        metrics["channels"] = self.network.channel_metrics()
+        metrics["servers"] = [server.describe() for server in self.network.directory.available()]
+        if pipeline is not None:
+            metrics.update(pipeline.metrics())
+            if pipeline.settings is not None:
+                metrics["settings"] = pipeline.settings._asdict()
+        return metrics
+
+
+class StreamViewer(StreamerCore):
+    # Plays a session another client streams to a server, relayed by that server
+    # without re-encoding (see relay.py), into a local sink. The frames are
+    # decoded by the same pipeline the server uses, reading the stream connection
+    # on its own thread. A lost relay is asked for again after RECONNECT_DELAY.
+    def __init__(self, notify, host=None, session_id=None, sink=SINK_VIRTUAL_CAM, fps=None, path=DEFAULT_FILE_PATH):
+        super().__init__(notify)
+        self.host = host  # Server address, or None for the first discovered server with a session
+        self.session_id = session_id  # Session to watch, or None for the server's oldest
+        self.sink = sink
+        self.fps = fps
+        self.path = path
+        self.network = ClientNetwork(self.engine, self.local_ip)
+        self.server_ip = None
+        self.codec = None
+        self.stream_socket = None
+        self.pipeline = None
+
+    def start(self):
+        self.streaming = True
+        self.engine.submit(self.network.watch(self.host, self.session_id))
+        self.notify("status", "Looking for a stream to watch...", "orange")
+
+    def on_watch_accepted(self, server_ip, params):
+        if not self.streaming:
+            return
+        stream_port = parse_params(params).get("stream_port", self.network.stream_port(server_ip, DEFAULT_PORT))
+        # Connecting can take up to CONNECT_TIMEOUT, so it runs on its own thread and reports back with an event
+        threading.Thread(target=self.connect_relay, args=(server_ip, int(stream_port), params), daemon=True).start()
+
+    def connect_relay(self, server_ip, stream_port, params):
+        sock = None
+        try:
+            sock = socket.create_connection((server_ip, stream_port), timeout=CONNECT_TIMEOUT)
+            sock.settimeout(None)
+            send_session_hello(sock, int(parse_params(params).get("session", 0)), parse_params(params).get("token", ""),
+                               RELAY_MAGIC)
+        except OSError as e:
+            if sock is not None:
+                sock.close()
+            self.engine.post("watch_failed", server_ip, e)
+            return
+        self.engine.post("relay_connected", server_ip, params, sock)
+
+    def on_relay_connected(self, server_ip, params, sock):
+        if not self.streaming or self.pipeline is not None:
+            sock.close()
+            return
+        self.server_ip = server_ip
+        self.codec = parse_codec_params(params)
+        self.stream_socket = sock
+        session_id = int(parse_params(params).get("session", 0))
+        delta = DeltaDecoder() if parse_params(params).get("delta") == "1" else None
+        print(f"Client: Watching session {session_id} on {server_ip}, {self.codec.name}")
+        self.pipeline = ServerPipeline(FrameReader(self.stream_socket), self.codec,
+                                       make_sink_factory(self.sink, self.fps, self.path, session=f"view-{session_id}"),
+                                       lambda error: self.engine.post("relay_closed", error), delta=delta,
+                                       decoder_threads=1 if delta else DECODER_THREADS)
+        self.pipeline.start()
+        self.last_update_time = time.time()
+        self.notify("started")
+        self.notify("status", f"Watching session {session_id}", "green")
+
+    def on_watch_failed(self, server_ip, error):
+        self.notify("status", f"Cannot watch: {error}", "red")
+        self.retry()
+
+    def on_relay_closed(self, error):
+        if not self.streaming:
+            return
+        print(f"Client: Relay ended: {error or 'closed by the server'}")
+        self.cleanup_resources()
+        self.notify("status", "Relay ended, retrying...", "orange")
+        self.retry()
+
+    def retry(self):
+        if self.streaming:
+            self.engine.call(self.engine.loop.call_later, RECONNECT_DELAY,
+                             lambda: self.engine.loop.create_task(self.network.watch(self.host, self.session_id)))
+
+    def stop(self):
+        self.streaming = False
+        self.cleanup_resources()
+        self.notify("stopped")
+
+    def cleanup_resources(self):
+        # Unblock the receiver thread, then wait for the pipeline (it closes the sink)
+        if self.stream_socket is not None:
+            try:
+                self.stream_socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if self.pipeline is not None:
+            self.pipeline.stop()
+            self.pipeline = None
+        if self.stream_socket is not None:
+            self.stream_socket.close()
+            self.stream_socket = None
+
+    def collect_stats(self, now):
+        # Every STATS_INTERVAL: (bitrate text, stage text), otherwise None
+        pipeline = self.pipeline
+        if pipeline is None or now - self.last_update_time < STATS_INTERVAL:
+            return None
+        elapsed = now - self.last_update_time
+        self.last_update_time = now
+        wire_bytes, raw_bytes = pipeline.take_counters()
+        return (format_bitrate(wire_bytes, raw_bytes, elapsed, self.codec.name, pipeline.delta),
+                f"{self.server_ip}: {pipeline.stage_report()}")
+
+    def metrics(self):
+        metrics = {"role": "viewer", "streaming": self.streaming, "server": self.server_ip}
+        pipeline = self.pipeline
+        if pipeline is not None:
+            metrics.update(pipeline.metrics())
+        return metrics
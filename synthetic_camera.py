@@ -0,0 +1,72 @@
+import time
+import cv2
+import numpy as np
+
+# Camera stand-in for benchmarks and load tests: cycles through precomputed
+# frames at a fixed rate behind the cv2.VideoCapture interface the client uses.
+# Like a USB camera it switches to MJPEG output (JPEG bytes per read) when the
+# MJPG format is requested and CAP_PROP_CONVERT_RGB is turned off.
+DEFAULT_MOTION = 16  # Pixels the gradient moves per frame
+DEFAULT_NOISE = 8  # Amplitude of per-pixel noise (0-255)
+
+
+def make_frames(width, height, count=8, motion=DEFAULT_MOTION, noise=DEFAULT_NOISE, seed=0):
+    # Moving gradients with noise; motion=0 gives a static scene (only the noise changes)
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    frames = []
+    for shift in range(count):
+        frame = np.dstack([(x + shift * motion) % 256, (y + shift * motion // 2) % 256, (x + y) % 256]).astype(np.uint8)
+        if noise:
+            frame += rng.integers(0, noise, frame.shape, dtype=np.uint8)
+        frames.append(frame)
+    return frames
+
+
+class SyntheticCamera:
+    def __init__(self, frames, fps, offset=0, jpeg_quality=80):
+        self.frames = frames
+        self.fps = fps
+        self.jpeg_quality = jpeg_quality
+        self.fourcc = cv2.VideoWriter_fourcc(*"YUYV")
+        self.encoded = None  # JPEG versions of frames once MJPEG output is on
+        self.interval = 1 / fps
+        self.next_frame = None  # The clock starts at the first read, not while the caller warms up
+        self.index = offset
+
+    def isOpened(self):
+        return True
+
+    def get(self, prop):
+        height, width = self.frames[0].shape[:2]
+        values = {cv2.CAP_PROP_FRAME_WIDTH: width, cv2.CAP_PROP_FRAME_HEIGHT: height,
+                  cv2.CAP_PROP_FPS: self.fps, cv2.CAP_PROP_FOURCC: self.fourcc}
+        return float(values.get(prop, 0))
+
+    def set(self, prop, value):
+        # Only the pixel format can change; size and rate are fixed by the frames
+        if prop == cv2.CAP_PROP_FOURCC:
+            self.fourcc = int(value)
+            return True
+        if prop == cv2.CAP_PROP_CONVERT_RGB and self.fourcc == cv2.VideoWriter_fourcc(*"MJPG"):
+            if value:
+                self.encoded = None
+            elif self.encoded is None:
+                self.encoded = [cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])[1].reshape(1, -1)
+                                for frame in self.frames]
+            return True
+        return False
+
+    def read(self):
+        if self.next_frame is None:
+            self.next_frame = time.perf_counter()
+        self.next_frame += self.interval
+        delay = self.next_frame - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        self.index += 1
+        frames = self.encoded if self.encoded is not None else self.frames
+        return True, frames[self.index % len(frames)]
+
+    def release(self):
+        pass
@@ -0,0 +1,87 @@
+from adaptive_bitrate import DEFAULT_LATENCY_BUDGET, LADDER, AdaptiveBitrateController, ThrottledSocket, \
+    format_stats_report, parse_stats_report
+
+FULL_FRAME_BYTES = 200_000  # At quality 100 and full scale
+REPORT_INTERVAL = 0.5
+
+
+class SimulatedLink:
+    # The far end of a ThrottledSocket on a simulated clock. Sleeps don't advance
+    # the clock, so each one is how long the bytes sent so far queue on the link:
+    # the latency a frame sees.
+    def __init__(self):
+        self.now = 0.0
+        self.delays = []
+        self.sent = []
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, delay):
+        self.delays.append(delay)
+
+    def sendall(self, data):
+        self.sent.append(len(data))
+
+
+class PartsSink(SimulatedLink):
+    def send_parts(self, parts):
+        self.sent.append([len(part) for part in parts])
+
+
+def frame_bytes(settings):
+    return int(FULL_FRAME_BYTES * settings.quality / 100 * settings.scale ** 2)
+
+
+def run(controller, link, throttled, seconds):
+    # Sends frames as the controller's settings allow and reports the latency of the
+    # latest one every REPORT_INTERVAL; returns the ladder level after each report
+    levels = []
+    end = link.now + seconds
+    next_report = link.now + REPORT_INTERVAL
+    settings = controller.settings()
+    while link.now < end:
+        throttled.send_parts((bytes(32), bytes(frame_bytes(settings))))
+        if link.now >= next_report:
+            settings = controller.update(link.delays[-1])
+            levels.append(controller.level)
+            next_report += REPORT_INTERVAL
+        link.now += 1 / settings.fps
+    return levels
+
+
+def test_send_parts_is_throttled():
+    for link in (SimulatedLink(), PartsSink()):
+        throttled = ThrottledSocket(link, 1000, clock=link.clock, sleep=link.sleep)
+        throttled.send_parts((bytes(100), bytes(400)))
+        throttled.send_parts((bytes(500),))
+        assert link.delays == [0.5, 1.0]
+    assert link.sent == [[100, 400], [500]]
+
+
+def test_ladder_steps_down_on_a_limited_link_and_recovers():
+    link = SimulatedLink()
+    throttled = ThrottledSocket(link, 2_000_000, clock=link.clock, sleep=link.sleep)
+    controller = AdaptiveBitrateController(100)
+
+    # Full quality needs 6 MB/s: step down to a level the link can carry and stay around it
+    levels = run(controller, link, throttled, 30)
+    settled = levels[len(levels) // 2:]
+    assert min(settled) >= 2
+    fitting = min(level for level, settings in enumerate(LADDER) if frame_bytes(settings) * settings.fps < 2_000_000)
+    assert max(settled) <= fitting + 1
+    assert max(link.delays[len(link.delays) // 2:]) < 4 * DEFAULT_LATENCY_BUDGET
+
+    # Once the link is fast enough again the ladder climbs back to the top
+    throttled.bytes_per_second = 20_000_000
+    levels = run(controller, link, throttled, 15)
+    assert levels[-1] == 0
+    assert link.delays[-1] < DEFAULT_LATENCY_BUDGET
+
+
+def test_stats_report_round_trip_and_malformed_reports():
+    rate, latency = parse_stats_report(format_stats_report(1_000_000, 10.0, 0.05), 10.2)
+    assert rate == 1_000_000 and abs(latency - 0.15) < 1e-6
+    for line in (b"STATS", b"STATS rate=1;ts=2", b"STATS rate=x;ts=1;age=0", b"STATS rate=1;ts=nan;age=0",
+                 b"STATS rate=inf;ts=1;age=0", b"STATS \xff\xfe"):
+        assert parse_stats_report(line, 10.0) is None
@@ -0,0 +1,104 @@
+import cv2
+import numpy as np
+import pytest
+from capture import FOURCC_MJPEG, confirm_passthrough, format_capture_mode, fourcc_name, is_jpeg, negotiate_capture, wait_for_first_frame
+from synthetic_camera import SyntheticCamera, make_frames
+
+
+class StubCapture:
+    # A driver that settles on its own mode: sizes and rates are clamped to what it has, formats
+    # outside `formats` are ignored, and CONVERT_RGB can only be turned off if `raw_output`
+    def __init__(self, formats=("YUYV",), raw_output=False, max_size=(1280, 720), max_fps=30, frames=()):
+        self.formats = formats
+        self.raw_output = raw_output
+        self.max_size = max_size
+        self.max_fps = max_fps
+        self.frames = list(frames)
+        self.calls = []
+        self.values = {cv2.CAP_PROP_FRAME_WIDTH: 640, cv2.CAP_PROP_FRAME_HEIGHT: 480, cv2.CAP_PROP_FPS: 30,
+                       cv2.CAP_PROP_FOURCC: cv2.VideoWriter_fourcc(*formats[0])}
+
+    def set(self, prop, value):
+        self.calls.append(prop)
+        if prop == cv2.CAP_PROP_FOURCC:
+            if fourcc_name(value) not in self.formats:
+                return False
+        elif prop == cv2.CAP_PROP_FRAME_WIDTH:
+            value = min(value, self.max_size[0])
+        elif prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            value = min(value, self.max_size[1])
+        elif prop == cv2.CAP_PROP_FPS:
+            value = min(value, self.max_fps)
+        elif prop == cv2.CAP_PROP_CONVERT_RGB:
+            return self.raw_output
+        self.values[prop] = value
+        return True
+
+    def get(self, prop):
+        return float(self.values.get(prop, 0))
+
+    def read(self):
+        # A None in frames, or no frames left, is a failed read, as while a camera warms up
+        frame = self.frames.pop(0) if self.frames else None
+        return frame is not None, frame
+
+
+def test_passthrough_with_synthetic_camera():
+    frames = make_frames(160, 120, count=2)
+    camera = SyntheticCamera(frames, fps=100)
+    mode = negotiate_capture(camera, 160, 120, 30, passthrough=True)
+    assert mode == {"width": 160, "height": 120, "fps": 100, "format": FOURCC_MJPEG, "passthrough": True}
+    assert format_capture_mode(mode) == "160x120 @ 100 fps MJPG (passthrough)"
+    frame = wait_for_first_frame(camera)
+    assert is_jpeg(frame)
+    # The size comes from the first frame, whatever the driver reported
+    mode.update(width=0, height=0)
+    confirm_passthrough(camera, mode, frame)
+    assert (mode["width"], mode["height"], mode["passthrough"]) == (160, 120, True)
+    assert camera.encoded is not None
+
+
+def test_driver_mode_wins():
+    capture = StubCapture(formats=("YUYV", "MJPG"))
+    mode = negotiate_capture(capture, 1920, 1080, 60, pixel_format="MJPG")
+    # The format goes first, since many cameras only offer their larger modes in MJPEG
+    assert capture.calls[0] == cv2.CAP_PROP_FOURCC
+    assert mode == {"width": 1280, "height": 720, "fps": 30, "format": "MJPG", "passthrough": False}
+    # Nothing requested: nothing set, the driver's defaults are read back
+    capture = StubCapture()
+    assert negotiate_capture(capture)["width"] == 640 and capture.calls == []
+
+
+def test_passthrough_fallbacks():
+    # No MJPEG at all
+    mode = negotiate_capture(StubCapture(formats=("YUYV",)), passthrough=True)
+    assert (mode["format"], mode["passthrough"]) == ("YUYV", False)
+    # MJPEG, but the backend always decodes
+    mode = negotiate_capture(StubCapture(formats=("YUYV", "MJPG"), raw_output=False), passthrough=True)
+    assert (mode["format"], mode["passthrough"]) == ("MJPG", False)
+    # The backend accepts CONVERT_RGB off but still decodes: caught on the first frame, and decoding is back on
+    capture = StubCapture(formats=("YUYV", "MJPG"), raw_output=True)
+    mode = negotiate_capture(capture, passthrough=True)
+    assert mode["passthrough"]
+    decoded = np.zeros((120, 160, 3), dtype=np.uint8)
+    decoded.flat[:2] = (0xFF, 0xD8)
+    assert not is_jpeg(decoded)
+    confirm_passthrough(capture, mode, decoded)
+    assert not mode["passthrough"] and capture.calls[-1] == cv2.CAP_PROP_CONVERT_RGB
+    # A camera that takes the MJPG request but keeps running in YUYV
+    camera = SyntheticCamera(make_frames(64, 48, count=1), fps=100)
+    camera.set = lambda prop, value: prop == cv2.CAP_PROP_FOURCC or prop == cv2.CAP_PROP_CONVERT_RGB
+    mode = negotiate_capture(camera, passthrough=True)
+    confirm_passthrough(camera, mode, wait_for_first_frame(camera))
+    assert not mode["passthrough"] and mode["format"] == "YUYV"
+    assert not is_jpeg(None) and not is_jpeg(np.array([0xFF, 0xD8], dtype=np.uint8))
+    assert not is_jpeg(np.zeros((1, 100), dtype=np.uint8))
+    assert is_jpeg(np.array([[0xFF, 0xD8, 0xFF, 0xE0]], dtype=np.uint8))
+
+
+def test_wait_for_first_frame():
+    frame = np.zeros((4, 4, 3), dtype=np.uint8)
+    capture = StubCapture(frames=[None, None, frame])
+    assert wait_for_first_frame(capture, timeout=1) is frame
+    with pytest.raises(RuntimeError):
+        wait_for_first_frame(StubCapture(), timeout=0.05)
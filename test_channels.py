@@ -0,0 +1,31 @@
+import asyncio
+import socket
+from channels import DEFAULT_WINDOW, MuxProtocol
+
+
+async def connected_pair():
+    loop = asyncio.get_running_loop()
+    left, right = socket.socketpair()
+    _, sender = await loop.create_connection(lambda: MuxProtocol("Client"), sock=left)
+    _, receiver = await loop.create_connection(lambda: MuxProtocol("Server"), sock=right)
+    return sender, receiver
+
+
+def test_messages_on_unhandled_channels_are_dropped():
+    async def run():
+        sender, receiver = await connected_pair()
+        received = asyncio.Queue()
+        receiver.on_message(1, lambda message, elapsed: received.put_nowait(bytes(message)))
+        receiver.channel(2)  # Used to send, no handler
+        # More than a window on the unknown channel: dropped chunks are credited, so the sender doesn't stall
+        await asyncio.wait_for(sender.send(7, bytes(2 * DEFAULT_WINDOW)), 5)
+        await sender.send(2, b"unhandled")
+        await sender.send(1, b"report")
+        assert await asyncio.wait_for(received.get(), 5) == b"report"
+        assert 7 not in receiver.channels
+        assert receiver.unknown_messages == 1
+        assert receiver.channels[2].unhandled == 1 and len(receiver.channels[2].buffer) == 0
+        sender.close()
+        receiver.close()
+
+    asyncio.run(run())
@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+from delta_codec import DELTA_HEADER, FLAG_DELTA, FLAG_KEYFRAME, DeltaDecoder, DeltaEncoder, encode_prepared
+from frame_codecs import CODEC_RAW, get_codec
+from stream_io import ProtocolError, unpack_frame_header
+
+
+def send(encoder, decoder, codec, frame, sequence):
+    prepared = encoder.prepare(frame, sequence)
+    header, payload = encode_prepared(codec, frame, prepared, 0.0, sequence)
+    return prepared.flags, decoder.apply(codec, unpack_frame_header(header), payload)
+
+
+def make_frame(width, height, seed):
+    return np.random.default_rng(seed).integers(0, 256, (height, width, 3), dtype=np.uint8)
+
+
+def test_resize_between_keyframes():
+    codec = get_codec(CODEC_RAW)
+    encoder, decoder = DeltaEncoder(), DeltaDecoder()
+    sequence = 0
+    # Taller but narrower, then wider but shorter, then smaller in both dimensions: each
+    # keyframe must replace or reuse the framebuffer, and the deltas after it patch the right size
+    for width, height in ((640, 480), (320, 600), (800, 240), (160, 120)):
+        frame = make_frame(width, height, sequence)
+        flags, decoded = send(encoder, decoder, codec, frame, sequence)
+        assert flags & FLAG_KEYFRAME
+        assert np.array_equal(decoded, frame)
+        sequence += 1
+
+        frame = frame.copy()
+        frame[:40, :40] = 255 - frame[:40, :40]
+        flags, decoded = send(encoder, decoder, codec, frame, sequence)
+        assert flags & FLAG_DELTA
+        assert np.array_equal(decoded, frame)
+        sequence += 1
+
+
+def corrupt(payload, base=None, tile_size=None, columns=None, count=None, indices=None):
+    # The payload with some DELTA_HEADER fields or the tile indices replaced
+    fields = list(DELTA_HEADER.unpack_from(payload))
+    for position, value in enumerate((base, tile_size, columns, count)):
+        if value is not None:
+            fields[position] = value
+    rest = payload[DELTA_HEADER.size:]
+    if indices is not None:
+        rest = np.array(indices, dtype="<u4").tobytes() + rest[4 * len(indices):]
+    return DELTA_HEADER.pack(*fields) + rest
+
+
+def test_corrupt_delta_headers_are_rejected():
+    codec = get_codec(CODEC_RAW)
+    encoder = DeltaEncoder()
+    frame = make_frame(320, 240, 0)
+    keyframe = encode_prepared(codec, frame, encoder.prepare(frame, 0), 0.0, 0)
+    changed = frame.copy()
+    changed[:40, :40] = 255 - changed[:40, :40]
+    header, payload = encode_prepared(codec, changed, encoder.prepare(changed, 1), 0.0, 1)
+    header = unpack_frame_header(header)
+    tiles = 10 * 8  # 320x240 in 32-pixel tiles
+    for bad in (payload[:DELTA_HEADER.size - 1], corrupt(payload, tile_size=0), corrupt(payload, columns=0),
+                corrupt(payload, count=tiles + 1), corrupt(payload, indices=[tiles]),
+                payload[:DELTA_HEADER.size + 4 * 4], payload[:-100]):
+        decoder = DeltaDecoder()
+        decoder.apply(codec, unpack_frame_header(keyframe[0]), keyframe[1])
+        with pytest.raises(ProtocolError):
+            decoder.apply(codec, header._replace(payload_length=len(bad)), bad)
+        # Nothing was patched, and the chain counts as broken until the next keyframe
+        assert np.array_equal(decoder.framebuffer[:240, :320], frame)
+        assert decoder.apply(codec, header, payload) is None
+
+
+def test_lost_delta_waits_for_keyframe():
+    codec = get_codec(CODEC_RAW)
+    encoder, decoder = DeltaEncoder(), DeltaDecoder()
+    frame = make_frame(160, 120, 0)
+    assert send(encoder, decoder, codec, frame, 0)[0] & FLAG_KEYFRAME
+    # Frame 1 never reaches the decoder, so frames 2 and 3 patch a base it doesn't have
+    for sequence in (1, 2, 3):
+        frame = frame.copy()
+        frame[:32, :32] = sequence
+        prepared = encoder.prepare(frame, sequence)
+        assert prepared.flags & FLAG_DELTA
+        if sequence > 1:
+            header, payload = encode_prepared(codec, frame, prepared, 0.0, sequence)
+            assert decoder.apply(codec, unpack_frame_header(header), payload) is None
+    # What the client does on the server's KEYFRAME request
+    encoder.force_keyframe()
+    flags, decoded = send(encoder, decoder, codec, frame, 4)
+    assert flags & FLAG_KEYFRAME and np.array_equal(decoded, frame)
+    frame = frame.copy()
+    frame[-32:, -32:] = 7
+    flags, decoded = send(encoder, decoder, codec, frame, 5)
+    assert flags & FLAG_DELTA and np.array_equal(decoded, frame)
@@ -0,0 +1,119 @@
+import fcntl
+import os
+import threading
+import time
+from devices import V4L2_CAP_DEVICE_CAPS, V4L2_CAP_VIDEO_CAPTURE, V4L2_CAPABILITY, VIDIOC_QUERYCAP, CameraDevice, \
+    DeviceInventory, V4l2Backend
+
+
+def make_sysfs(root):
+    # /sys/class/video4linux with a camera (capture node video0, metadata node video1), a second
+    # camera on another port (video2) and a node that isn't a video device; /dev has the nodes
+    sysfs, dev = root / "sys", root / "dev"
+    dev.mkdir()
+    for node, name, index, port in (("video0", "Integrated", 0, "1-5"), ("video1", "Integrated", 1, "1-5"),
+                                    ("video2", "USB Cam", 0, "3-2"), ("v4l-subdev0", "sensor", 0, "1-5")):
+        (sysfs / node).mkdir(parents=True)
+        (sysfs / node / "name").write_text(name + "\n")
+        (sysfs / node / "index").write_text(f"{index}\n")
+        (root / port).mkdir(exist_ok=True)
+        os.symlink(root / port, sysfs / node / "device")
+        (dev / node).write_bytes(b"")
+    return str(sysfs), str(dev)
+
+
+def stub_ioctl(monkeypatch, capabilities):
+    # capabilities: node file name -> (card, bus info, device caps) the driver reports
+    def ioctl(fd, request, buffer):
+        assert request == VIDIOC_QUERYCAP
+        card, bus_info, caps = capabilities[os.path.basename(os.readlink(f"/proc/self/fd/{fd}"))]
+        buffer[:] = V4L2_CAPABILITY.pack(b"uvcvideo", card.encode(), bus_info.encode(), 0,
+                                         V4L2_CAP_DEVICE_CAPS | V4L2_CAP_VIDEO_CAPTURE, caps)
+
+    monkeypatch.setattr(fcntl, "ioctl", ioctl)
+
+
+def test_v4l2_listing_from_sysfs(tmp_path, monkeypatch):
+    backend = V4l2Backend(*make_sysfs(tmp_path))
+    assert backend.available()
+    assert backend.signature() == ("v4l-subdev0", "video0", "video1", "video2")
+    # The driver says which nodes capture, and its card name wins over sysfs
+    stub_ioctl(monkeypatch, {"video0": ("Integrated Camera", "usb-1-5", V4L2_CAP_VIDEO_CAPTURE),
+                             "video1": ("Integrated Camera", "usb-1-5", 0),
+                             "video2": ("USB Cam: HD", "usb-3-2", V4L2_CAP_VIDEO_CAPTURE)})
+    assert backend.list_devices() == [CameraDevice("v4l2:usb-1-5:0", 0, "Integrated Camera", "v4l2"),
+                                      CameraDevice("v4l2:usb-3-2:0", 2, "USB Cam: HD", "v4l2")]
+
+    # Without ioctl access, metadata nodes are told apart by their sysfs index
+    def no_access(fd, request, buffer):
+        raise PermissionError
+
+    monkeypatch.setattr(fcntl, "ioctl", no_access)
+    assert backend.list_devices() == [CameraDevice("v4l2:1-5:0", 0, "Integrated", "v4l2"),
+                                      CameraDevice("v4l2:3-2:0", 2, "USB Cam", "v4l2")]
+    assert not V4l2Backend(str(tmp_path / "missing")).available()
+
+
+class FakeBackend:
+    name = "fake"
+
+    def __init__(self, devices):
+        self.devices = devices
+        self.listed = 0
+
+    def list_devices(self):
+        self.listed += 1
+        return list(self.devices)
+
+    def signature(self):
+        return tuple(device.id for device in self.devices)
+
+
+def test_inventory_cache_ttl():
+    backend = FakeBackend([CameraDevice("fake:a", 0, "A", "fake")])
+    inventory = DeviceInventory([backend], ttl=0.2)
+    assert inventory.devices() == inventory.devices() == backend.devices
+    assert backend.listed == 1
+    time.sleep(0.25)
+    inventory.devices()
+    assert backend.listed == 2
+    inventory.refresh()
+    assert backend.listed == 3
+
+
+class FakeCapture:
+    def __init__(self, opened):
+        self.opened = opened
+
+    def isOpened(self):
+        return self.opened
+
+    def release(self):
+        pass
+
+
+def test_probe_timeout_and_cache():
+    devices = [CameraDevice(f"fake:{index}", index, str(index), "fake") for index in range(3)]
+    stuck = threading.Event()
+    opened = []
+
+    def open_capture(index):
+        # Camera 0 opens, camera 1 fails, camera 2 hangs in the driver
+        opened.append(index)
+        if index == 2:
+            stuck.wait(5)
+        return FakeCapture(index == 0)
+
+    inventory = DeviceInventory([FakeBackend(devices)], ttl=60, probe=True, probe_timeout=0.2,
+                                open_capture=open_capture)
+    try:
+        start = time.monotonic()
+        assert inventory.devices() == devices[:1]
+        assert time.monotonic() - start < 1
+        # Probe results are cached too: a refresh within the ttl opens nothing
+        assert inventory.refresh() == devices[:1]
+        assert sorted(opened) == [0, 1, 2]
+        assert {device_id: result for device_id, (_, result) in inventory.probed.items()} == \
+            {"fake:0": True, "fake:1": False, "fake:2": False}
+    finally:
+        stuck.set()
@@ -0,0 +1,27 @@
+from discovery import format_server_reply, parse_server_reply
+from net_engine import CONTROL_PORT, ClientNetwork, NetworkEngine
+
+
+def reply_params(ip="10.9.9.9", control_port=7000, stream_port=7001):
+    return format_server_reply(5, ip, control_port, stream_port, 2, {"resume"}).partition(b" ")[2]
+
+
+def test_reply_uses_sender_address_and_advertised_ports():
+    server = parse_server_reply(reply_params(), ("192.168.1.20", 9998), {5: 1.0}, 1.5)
+    assert server.ip == "192.168.1.20"
+    assert (server.control_port, server.stream_port, server.sessions) == (7000, 7001, 2)
+    assert server.rtt == 0.5
+    assert parse_server_reply(reply_params(control_port=70000), ("192.168.1.20", 9998), {}, 0) is None
+
+
+def test_client_connects_to_advertised_ports():
+    engine = NetworkEngine()
+    try:
+        network = ClientNetwork(engine, "192.168.1.10")
+        assert network.control_port("192.168.1.20") == CONTROL_PORT
+        network.server_seen(reply_params(), ("192.168.1.20", 9998))
+        assert network.control_port("192.168.1.20") == 7000
+        assert network.stream_port("192.168.1.20", 9999) == 7001
+        assert network.stream_port("192.168.1.30", 9999) == 9999
+    finally:
+        engine.stop()
@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+from delta_codec import FLAG_DELTA, FLAG_KEYFRAME
+from frame_buffers import COLOR_FORMAT_BGR, COLOR_FORMAT_I420, COLOR_FORMAT_RGB, COLOR_FORMATS, CopyCounter, \
+    FrameConverter, color_flags, convert_frame, frame_color, frame_shape, frame_size, parse_color_formats
+from simulcast import frame_layer, layer_flags
+
+
+def make_frame(width=64, height=48):
+    # Smooth, so the chroma subsampling of I420 loses little
+    x = np.linspace(0, 255, width)
+    y = np.linspace(0, 255, height)[:, None]
+    frame = np.empty((height, width, 3), dtype=np.uint8)
+    frame[..., 0] = x
+    frame[..., 1] = y
+    frame[..., 2] = (x + y) / 2
+    return frame
+
+
+def test_color_round_trips():
+    bgr = make_frame()
+    rgb = convert_frame(bgr, COLOR_FORMAT_BGR, COLOR_FORMAT_RGB)
+    assert np.array_equal(rgb, bgr[..., ::-1])
+    assert np.array_equal(convert_frame(rgb, COLOR_FORMAT_RGB, COLOR_FORMAT_BGR), bgr)
+    assert convert_frame(bgr, COLOR_FORMAT_BGR, COLOR_FORMAT_BGR) is bgr
+    for source, frame in ((COLOR_FORMAT_BGR, bgr), (COLOR_FORMAT_RGB, rgb)):
+        i420 = convert_frame(frame, source, COLOR_FORMAT_I420)
+        assert i420.shape == frame_shape(COLOR_FORMAT_I420, 64, 48) == (72, 64)
+        assert frame_size(i420, COLOR_FORMAT_I420) == (64, 48)
+        back = convert_frame(i420, COLOR_FORMAT_I420, source)
+        assert np.abs(back.astype(int) - frame).mean() < 3
+    # I420 needs an even size: the odd last row and column are dropped
+    odd = convert_frame(make_frame(65, 49), COLOR_FORMAT_BGR, COLOR_FORMAT_I420)
+    assert frame_size(odd, COLOR_FORMAT_I420) == (64, 48)
+
+
+def test_color_flags_share_the_header_flags():
+    assert [color_flags(color_format) for color_format in COLOR_FORMATS] == [0x00, 0x40, 0x80]
+    for color_format in COLOR_FORMATS:
+        for layer in range(4):
+            flags = color_flags(color_format) | layer_flags(layer) | FLAG_DELTA
+            assert frame_color(flags) == color_format
+            assert frame_layer(flags) == layer
+            assert flags & (FLAG_KEYFRAME | FLAG_DELTA) == FLAG_DELTA
+    # Streams from before color formats have bits 6-7 clear and read as BGR
+    assert frame_color(FLAG_KEYFRAME | layer_flags(3)) == COLOR_FORMAT_BGR
+    with pytest.raises(ValueError):
+        frame_color(0xC0)
+    assert parse_color_formats("i420, yuy2,bgr") == (COLOR_FORMAT_I420, COLOR_FORMAT_BGR)
+
+
+def test_converter_reuses_its_buffers():
+    copies = CopyCounter()
+    converter = FrameConverter(copies)
+    frame = make_frame()
+    # A format the consumer takes passes through untouched
+    assert converter.convert(frame, COLOR_FORMAT_RGB, (COLOR_FORMAT_BGR, COLOR_FORMAT_RGB))[0] is frame
+    assert copies.snapshot() == (0, {})
+    results = []
+    for _ in range(3):
+        copies.frame()
+        converted, color_format = converter.convert(frame, COLOR_FORMAT_BGR, (COLOR_FORMAT_RGB,))
+        assert color_format == COLOR_FORMAT_RGB and np.array_equal(converted, frame[..., ::-1])
+        results.append(converted)
+    assert results[0] is results[1] is results[2]
+    # Three copies into one buffer, allocated once
+    assert copies.snapshot()[1] == {"convert": [3, 1, 3 * frame.nbytes, frame.nbytes]}
+    converter.convert(make_frame(32, 24), COLOR_FORMAT_BGR, (COLOR_FORMAT_RGB,))
+    assert copies.snapshot()[1]["convert"][:2] == [4, 2]
+    # Resizing has its own buffer
+    small = converter.resize(frame, (32, 24))
+    assert small.shape == (24, 32, 3) and converter.resize(frame, (32, 24)) is small
+    assert copies.snapshot()[1]["resize"][:2] == [2, 1]
+    metrics = copies.metrics()
+    assert metrics["frames"] == 3 and metrics["stages"]["convert"]["copies"] == round(4 / 3, 2)
+    assert copies.report().startswith("copies 2.0 ")
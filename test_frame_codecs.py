@@ -0,0 +1,40 @@
+import numpy as np
+from frame_codecs import CODEC_JPEG, CODEC_PNG, CODEC_RAW, DEFAULT_JPEG_QUALITY, DEFAULT_PNG_COMPRESSION, \
+    decode_frame, encode_frame, format_codec_params, get_codec, parse_codec_params
+from stream_io import unpack_frame_header
+
+
+def make_frame(width=64, height=48):
+    # Smooth gradients, so JPEG stays close to the original
+    x = np.linspace(0, 255, width, dtype=np.uint8)
+    y = np.linspace(0, 255, height, dtype=np.uint8)
+    frame = np.empty((height, width, 3), dtype=np.uint8)
+    frame[..., 0] = x
+    frame[..., 1] = y[:, None]
+    frame[..., 2] = 128
+    return frame
+
+
+def round_trip(codec, frame):
+    header, payload = encode_frame(codec, frame, 1.5, 7)
+    header = unpack_frame_header(header)
+    assert (header.width, header.height, header.sequence, header.payload_length) == (64, 48, 7, len(payload))
+    return decode_frame(get_codec(codec.name), header, payload)
+
+
+def test_round_trips():
+    frame = make_frame()
+    assert np.array_equal(round_trip(get_codec(CODEC_RAW), frame), frame)
+    assert np.array_equal(round_trip(get_codec(CODEC_PNG), frame), frame)
+    decoded = round_trip(get_codec(CODEC_JPEG), frame)
+    assert decoded.shape == frame.shape
+    assert np.abs(decoded.astype(int) - frame).mean() < 3
+
+
+def test_quality_defaults_per_codec():
+    # None means the codec's own default: PNG's is a compression level, not JPEG's quality
+    assert get_codec(CODEC_JPEG).quality == DEFAULT_JPEG_QUALITY
+    assert get_codec(CODEC_PNG).quality == DEFAULT_PNG_COMPRESSION
+    assert get_codec(CODEC_PNG, 12).quality == 9 and get_codec(CODEC_JPEG, 0).quality == 1
+    codec = parse_codec_params(format_codec_params(get_codec(CODEC_PNG)))
+    assert (codec.name, codec.quality) == (CODEC_PNG, DEFAULT_PNG_COMPRESSION)
@@ -0,0 +1,75 @@
+import socket
+import time
+from frame_codecs import CODEC_JPEG, get_codec
+from net_engine import NetworkEngine, ServerNetwork
+from relay import RELAY_MAGIC
+from sessions import SessionRegistry, pack_session_hello, send_session_hello
+from sinks import NullSink
+from stream_io import FRAME_HEADER, FrameHeader, pack_frame_header
+from udp_transport import UdpFrameSender
+
+STREAM_PORT = 19998
+
+
+def start_server():
+    registry = SessionRegistry()
+    engine = NetworkEngine()
+    server = ServerNetwork(engine, registry, "127.0.0.1", lambda session: NullSink)
+    engine.submit(server.start(STREAM_PORT)).result()
+    return engine, server, registry
+
+
+def closed_by_server(sock):
+    sock.settimeout(2)
+    try:
+        return sock.recv(FRAME_HEADER.size) == b""
+    except ConnectionResetError:
+        return True
+
+
+def test_stream_hello_needs_the_session_token():
+    engine, server, registry = start_server()
+    try:
+        session = registry.create(("127.0.0.1", 0), None, "tcp", False, None)
+        # Right session id, wrong token; a viewer can't use the publisher's token or the other way round
+        for token, magic in (("0" * 16, b"SESS"), (session.view_token, b"SESS"), (session.token, RELAY_MAGIC)):
+            with socket.create_connection(("127.0.0.1", STREAM_PORT)) as sock:
+                send_session_hello(sock, session.id, token, magic)
+                assert closed_by_server(sock)
+        assert session.stream_transport is None and not session.relay.viewers
+
+        with socket.create_connection(("127.0.0.1", STREAM_PORT)) as sock:
+            send_session_hello(sock, session.id, session.view_token, RELAY_MAGIC)
+            deadline = time.time() + 2
+            while not session.relay.viewers and time.time() < deadline:
+                time.sleep(0.01)
+            assert session.relay.viewers
+    finally:
+        engine.submit(server.stop()).result(timeout=5)
+        engine.stop()
+
+
+def test_udp_stream_needs_the_session_hello():
+    engine, server, registry = start_server()
+    try:
+        session = registry.create(("127.0.0.1", 0), get_codec(CODEC_JPEG), "udp", False, None)
+        port = engine.submit(server.open_session_stream(session)).result(timeout=5)
+        address = ("127.0.0.1", port)
+        header = pack_frame_header(FrameHeader(1, 0, 3, 0, 64, 48, 0.0, 0, 4))
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as intruder, \
+                socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as client:
+            # No hello, then a hello with the wrong token: nothing reaches the pipeline
+            UdpFrameSender(intruder, address).send_parts((header, b"abcd"))
+            UdpFrameSender(intruder, address, pack_session_hello(session.id, "0" * 16)).send_parts((header, b"abcd"))
+            # The client's hello pins the session to its address; the intruder's frames still don't count
+            UdpFrameSender(client, address, pack_session_hello(session.id, session.token)).send_parts((header, b"abcd"))
+            UdpFrameSender(intruder, address).send_parts((header, b"abcd"))
+            deadline = time.time() + 2
+            while session.pipeline.received < 1 and time.time() < deadline:
+                time.sleep(0.01)
+            time.sleep(0.1)
+        assert session.pipeline.received == 1
+        assert session.pipeline.loss_stats.loss_totals()["udp_bad_datagrams"] == 4
+    finally:
+        engine.submit(server.stop()).result(timeout=5)
+        engine.stop()
@@ -0,0 +1,96 @@
+import time
+from delta_codec import DELTA_HEADER, FLAG_DELTA, DeltaDecoder
+from frame_codecs import CODEC_JPEG, CODEC_RAW, get_codec
+from pipeline import JitterBuffer, ServerPipeline
+from simulcast import layer_flags
+from sinks import NullSink
+from stream_io import FrameHeader
+
+
+class ListRecorder:
+    def __init__(self):
+        self.frames = []
+
+    def add(self, header, payload, received_time):
+        self.frames.append(header.sequence)
+
+
+def test_simulcast_records_only_the_sink_layer():
+    recorder = ListRecorder()
+    pipeline = ServerPipeline(None, get_codec(CODEC_JPEG), NullSink, lambda error: None, recorder=recorder,
+                              layers=(1.0, 0.5))
+    sequence = 0
+    for sink_layer in (0, 1):
+        pipeline.select_layers(sink_layer, None)
+        for layer in (0, 1):
+            header = FrameHeader(1, layer_flags(layer), 3, 0, 640 >> layer, 480 >> layer, 0.0, sequence, 4)
+            pipeline.feed(header, b"\xff\xd8\xff\xd9", 40, 0.0)
+            sequence += 1
+    assert recorder.frames == [0, 3]
+    pipeline.stop()
+
+
+def test_broken_delta_chain_requests_a_keyframe():
+    requests = []
+    pipeline = ServerPipeline(None, get_codec(CODEC_RAW), NullSink, lambda error: None, delta=DeltaDecoder(),
+                              decoder_threads=1, request_keyframe=lambda: requests.append(time.monotonic()))
+    pipeline.start()
+    # Deltas without the keyframe they build on: one request per interval, however many arrive
+    prefix = DELTA_HEADER.pack(0, 32, 1, 0)
+    deadline = time.monotonic() + 2
+    for sequence in range(1, 6):
+        header = FrameHeader(0, FLAG_DELTA, 3, 0, 64, 64, 0.0, sequence, len(prefix))
+        pipeline.feed(header, prefix, 40, 0.0)
+        # The decode queue drops the oldest frame when full, so let each one through
+        while pipeline.waiting_keyframe < sequence and time.monotonic() < deadline:
+            time.sleep(0.01)
+    pipeline.stop()
+    assert pipeline.waiting_keyframe == 5
+    assert len(requests) == 1
+
+
+def test_jitter_buffer_reorders_and_delays():
+    # The clock is whatever `now` the caller passes, so the schedule below is exact
+    jitter = JitterBuffer(min_delay=0.05, max_delay=0.5)
+    jitter.put(0.0, 0, "a", 0.01, 0.01)
+    jitter.put(0.066, 2, "c", 0.076, 0.076)
+    jitter.put(0.033, 1, "b", 0.076, 0.076)  # Overtaken by frame 2 on the way
+    # Base transit 10 ms, target delay the 50 ms minimum: frame 0 is due at 60 ms
+    assert jitter.take(0.055) is None
+    assert jitter.take(0.061)[2] == "a"
+    assert jitter.take(0.095)[2] == "b"
+    assert jitter.take(0.094) is None
+    assert jitter.take(0.127)[2] == "c"
+    assert jitter.take(0.2) is None
+    metrics = jitter.metrics()
+    assert (metrics["repeated"], metrics["underruns"], metrics["dropped"]) == (2, 1, 0)
+
+
+def test_jitter_buffer_follows_transit_jitter():
+    jitter = JitterBuffer(min_delay=0.01, max_delay=0.1)
+    for index in range(20):
+        transit = 0.02 if index % 2 else 0.05
+        jitter.put(index * 0.033, index, index, 0.0, index * 0.033 + transit)
+    assert abs(jitter.delay - 0.03) < 1e-9  # p95 transit minus the base transit
+    for index in range(20, 40):
+        transit = 0.02 if index % 2 else 0.5
+        jitter.put(index * 0.033, index, index, 0.0, index * 0.033 + transit)
+    assert jitter.delay == 0.1
+    assert abs(jitter.source_fps() - 1 / 0.033) < 1e-6
+
+
+def test_jitter_buffer_drops_late_duplicate_and_stale_frames():
+    jitter = JitterBuffer(min_delay=0.01, max_delay=0.5, max_frames=4)
+    jitter.put(1.0, 0, "a", 1.0, 1.0)
+    jitter.put(1.0, 0, "a", 1.0, 1.001)  # Duplicate of a buffered frame
+    assert jitter.metrics()["dropped"] == 1 and jitter.metrics()["frames"] == 1
+    assert jitter.take(1.02)[2] == "a"
+    jitter.put(1.0, 0, "a", 1.0, 1.03)  # Duplicate of the shown frame
+    jitter.put(0.9, 1, "old", 1.0, 1.03)  # Older than the shown frame
+    assert jitter.metrics()["late"] == 2
+    # A burst after a stall: only the newest due frame is shown, and max_frames caps what is held
+    for index in range(6):
+        jitter.put(1.1 + index * 0.01, index + 2, index, 1.2, 1.2)
+    assert jitter.metrics()["frames"] == 4
+    assert jitter.take(2.0)[2] == 5
+    assert jitter.metrics()["dropped"] == 1 + 2 + 3
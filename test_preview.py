@@ -0,0 +1,81 @@
+import types
+import numpy as np
+import preview
+from preview import PreviewRenderer, fit_size, prepare_preview
+
+
+class FakeLabel:
+    def __init__(self):
+        self.image = None
+
+    def configure(self, image):
+        self.image = image
+
+
+class FakePhoto:
+    # Stands in for ImageTk.PhotoImage, which needs a Tk root
+    created = 0
+
+    def __init__(self, image):
+        FakePhoto.created += 1
+        self.size = image.size
+        self.pasted = [image]
+
+    def width(self):
+        return self.size[0]
+
+    def height(self):
+        return self.size[1]
+
+    def paste(self, image):
+        assert image.size == self.size
+        self.pasted.append(image)
+
+
+def test_fit_size():
+    assert fit_size(1920, 1080, 640, 480) == (640, 360)
+    assert fit_size(480, 640, 640, 480) == (360, 480)
+    assert fit_size(320, 240, 640, 480) == (320, 240)  # Never upscaled
+    assert fit_size(10000, 1, 640, 480) == (640, 1)
+
+
+def test_prepare_preview_scales_and_converts():
+    frame = np.zeros((1080, 1920, 3), dtype=np.uint8)
+    frame[..., 0] = 255  # Blue in BGR
+    image = prepare_preview(frame)
+    assert image.size == (640, 360) and image.mode == "RGB"
+    assert image.getpixel((10, 10)) == (0, 0, 255)
+
+
+def test_renderer_throttles_and_reuses_the_photo(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(preview, "time", types.SimpleNamespace(perf_counter=lambda: clock[0]))
+    monkeypatch.setattr(preview.ImageTk, "PhotoImage", FakePhoto)
+    FakePhoto.created = 0
+    label = FakeLabel()
+    renderer = PreviewRenderer(label, max_fps=10)
+    frames = [np.full((720, 1280, 3), value, dtype=np.uint8) for value in range(4)]
+
+    assert renderer.due() and renderer.show(frames[0])
+    photo = label.image
+    assert (photo.width(), photo.height()) == (640, 360)
+    # Within the 100 ms interval nothing is drawn, and callers can tell before fetching a frame
+    clock[0] += 0.05
+    assert not renderer.due() and not renderer.show(frames[1])
+    clock[0] += 0.06
+    assert renderer.due()
+    assert not renderer.show(frames[0])  # The same frame again isn't redrawn
+    assert renderer.show(frames[1])
+    assert label.image is photo and len(photo.pasted) == 2 and FakePhoto.created == 1
+    # A new size needs a new photo
+    clock[0] += 0.125
+    assert renderer.show(np.zeros((100, 200, 3), dtype=np.uint8))
+    assert FakePhoto.created == 2 and (label.image.width(), label.image.height()) == (200, 100)
+
+    renderer.set_enabled(False)
+    assert label.image == "" and not renderer.due()
+    clock[0] += 1
+    assert not renderer.show(frames[2])
+    assert renderer.report() == "preview off"
+    renderer.set_enabled(True)
+    assert renderer.show(frames[3]) and FakePhoto.created == 3
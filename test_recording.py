@@ -0,0 +1,77 @@
+import os
+from delta_codec import FLAG_DELTA, FLAG_KEYFRAME
+from recording import INDEX_NAME, INDEX_RECORD, SEGMENT_NAME, RecordingReader, RecordingWriter, replay
+from stream_io import FRAME_HEADER, FrameHeader
+
+FRAME_COUNT = 20
+PAYLOAD_SIZE = 1000
+
+
+def make_frame(sequence):
+    payload = bytes((sequence + i) & 0xFF for i in range(PAYLOAD_SIZE))
+    flags = FLAG_KEYFRAME if sequence % 5 == 0 else FLAG_DELTA
+    return FrameHeader(1, flags, 3, 0, 64, 48, 100.0 + sequence, sequence, len(payload)), payload
+
+
+def record(path, segment_size):
+    writer = RecordingWriter(str(path), {"codec": "jpeg", "delta": True}, segment_size=segment_size)
+    for sequence in range(FRAME_COUNT):
+        writer.add(*make_frame(sequence), 1000.0 + sequence * 0.1)
+    writer.close()
+    return writer
+
+
+class ListPipeline:
+    def __init__(self):
+        self.sequences = []
+
+    def feed(self, header, payload, frame_size, elapsed):
+        self.sequences.append(header.sequence)
+
+
+def test_round_trip_across_segments(tmp_path):
+    frame_size = FRAME_HEADER.size + PAYLOAD_SIZE
+    writer = record(tmp_path, segment_size=3 * frame_size)
+    assert writer.stats()["frames"] == FRAME_COUNT and writer.stats()["segments"] == 7
+    reader = RecordingReader(str(tmp_path))
+    try:
+        assert reader.meta["codec"] == "jpeg" and len(reader) == FRAME_COUNT
+        assert list(reader.segments) == [number // 3 for number in range(FRAME_COUNT)]
+        for number in range(FRAME_COUNT):
+            header, payload = reader.frame(number)
+            expected_header, expected_payload = make_frame(number)
+            assert header == expected_header and bytes(payload) == expected_payload
+            del payload
+        assert abs(reader.duration() - (FRAME_COUNT - 1) * 0.1) < 1e-9
+        # Seeking lands on the keyframe a delta frame needs
+        assert reader.seek(0.0) == 0 and reader.seek(0.75) == 5 and reader.seek(99) == 15
+        pipeline = ListPipeline()
+        assert replay(reader, pipeline, speed=100, start=1.2) == FRAME_COUNT - 10
+        assert pipeline.sequences == list(range(10, FRAME_COUNT))
+    finally:
+        reader.close()
+
+
+def test_truncated_tail_is_ignored(tmp_path):
+    frame_size = FRAME_HEADER.size + PAYLOAD_SIZE
+    record(tmp_path, segment_size=8 * frame_size)
+    # As if the server died mid-write: the last segment (frames 16-19) ends inside frame 19, and
+    # its index has frame 19's record followed by half of another one
+    last = 2
+    with open(tmp_path / SEGMENT_NAME.format(last), "r+b") as segment:
+        segment.truncate(3 * frame_size + 10)
+    with open(tmp_path / INDEX_NAME.format(last), "ab") as index:
+        index.write(bytes(INDEX_RECORD.itemsize // 2))
+    reader = RecordingReader(str(tmp_path))
+    try:
+        assert len(reader) == 19
+        header, payload = reader.frame(len(reader) - 1)
+        assert header.sequence == 18 and bytes(payload) == make_frame(18)[1]
+        del payload
+    finally:
+        reader.close()
+    # A segment whose index file was never created holds no readable frames
+    os.remove(tmp_path / INDEX_NAME.format(last))
+    reader = RecordingReader(str(tmp_path))
+    assert len(reader) == 16
+    reader.close()
@@ -0,0 +1,146 @@
+import asyncio
+import relay
+from delta_codec import FLAG_DELTA, FLAG_KEYFRAME
+from relay import RELAY_MAX_LAG, FrameRelay, FrameRing
+from stream_io import FrameHeader, unpack_frame_header
+
+
+class FakeTransport:
+    # Records writes; while `blocked`, every write pauses the protocol as a full buffer would
+    def __init__(self):
+        self.protocol = None
+        self.writes = []
+        self.blocked = False
+        self.closed = False
+
+    def set_write_buffer_limits(self, high):
+        pass
+
+    def get_extra_info(self, name):
+        return None
+
+    def set_protocol(self, protocol):
+        self.protocol = protocol
+
+    def write(self, data):
+        self.writes.append(data)
+        if self.blocked:
+            self.protocol.pause_writing()
+
+    def unblock(self):
+        self.blocked = False
+        self.protocol.resume_writing()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.protocol.connection_lost(None)
+
+    def sequences(self):
+        # Headers and payloads are written separately
+        return [unpack_frame_header(header).sequence for header in self.writes[::2]]
+
+
+def make_frame(sequence, keyframe, size=100):
+    payload = bytes([sequence & 0xFF]) * size
+    return FrameHeader(0, FLAG_KEYFRAME if keyframe else FLAG_DELTA, 3, 0, 8, 8, 0.0, sequence, size), payload
+
+
+async def settle():
+    for _ in range(20):
+        await asyncio.sleep(0)
+
+
+def test_ring_wraparound():
+    ring = FrameRing(max_frames=4, max_bytes=1000)
+    for sequence in range(10):
+        ring.add(*make_frame(sequence, keyframe=sequence in (0, 5)))
+    assert (ring.start, ring.end, ring.size) == (6, 10, 400)
+    assert [unpack_frame_header(ring.get(position)[1]).sequence for position in range(6, 10)] == [6, 7, 8, 9]
+    assert ring.last_keyframe is None  # Frame 5 was evicted with the others
+    ring.add(*make_frame(10, keyframe=True))
+    assert ring.last_keyframe == 10 and ring.start == 7
+    # The byte limit evicts as well, but always keeps the newest frame
+    ring.add(*make_frame(11, keyframe=False, size=5000))
+    assert (ring.start, ring.end, len(ring.frames)) == (11, 12, 1)
+    ring.clear()
+    assert (ring.start, ring.end, ring.size, ring.last_keyframe) == (12, 12, 0, None)
+
+
+def test_slow_viewer_skips_to_keyframe():
+    async def run():
+        frames = FrameRelay("#1")
+        fast, slow = FakeTransport(), FakeTransport()
+        viewers = [frames.attach(fast, "fast"), frames.attach(slow, "slow")]
+        slow.blocked = True
+        sequence = 0
+        for keyframe in [True] + [False] * (RELAY_MAX_LAG + 1) + [True, False, False]:
+            frames.add(*make_frame(sequence, keyframe), 0.0)
+            sequence += 1
+            await settle()
+        # The slow viewer got frame 0 and then stalled; once it drains it jumps to the newest keyframe
+        assert slow.sequences() == [0]
+        slow.unblock()
+        await settle()
+        assert fast.sequences() == list(range(sequence))
+        keyframe = RELAY_MAX_LAG + 2
+        assert slow.sequences() == [0] + list(range(keyframe, sequence))
+        assert (viewers[1].skips, viewers[1].skipped) == (1, keyframe - 1)
+        assert viewers[0].skipped == 0
+        frames.close()
+        await settle()
+        assert not frames.viewers and not frames.ring.frames
+
+    asyncio.run(run())
+
+
+def test_viewer_joins_at_a_keyframe():
+    async def run():
+        frames = FrameRelay("#1")
+        first = FakeTransport()
+        frames.attach(first, "first")
+        for sequence in range(3):
+            frames.add(*make_frame(sequence, keyframe=sequence == 0), 0.0)
+        await settle()
+        late = FakeTransport()
+        frames.attach(late, "late")
+        frames.add(*make_frame(3, keyframe=False), 0.0)
+        await settle()
+        # Delta frames need their keyframe, so the late viewer starts from frame 0 too
+        assert late.sequences() == first.sequences() == [0, 1, 2, 3]
+        frames.close()
+        await settle()
+
+    asyncio.run(run())
+
+
+def test_one_header_per_frame_for_all_viewers(monkeypatch):
+    packed = []
+
+    def pack_frame_header(header):
+        packed.append(header.sequence)
+        return original(header)
+
+    original = relay.pack_frame_header
+    monkeypatch.setattr(relay, "pack_frame_header", pack_frame_header)
+
+    async def run():
+        frames = FrameRelay("#1")
+        transports = [FakeTransport() for _ in range(3)]
+        for index, transport in enumerate(transports):
+            frames.attach(transport, f"viewer {index}")
+        payloads = []
+        for sequence in range(5):
+            header, payload = make_frame(sequence, keyframe=sequence == 0)
+            payloads.append(payload)
+            frames.add(header, payload, 0.0)
+            await settle()
+        assert packed == list(range(5))
+        # Every viewer is written the ring's own header and payload objects, not copies
+        for transport in transports:
+            assert all(write is payload for write, payload in zip(transport.writes[1::2], payloads))
+            assert all(write is first for write, first in zip(transport.writes[::2], transports[0].writes[::2]))
+        frames.close()
+        await settle()
+
+    asyncio.run(run())
@@ -0,0 +1,20 @@
+import pytest
+from sessions import MosaicOutput
+from sinks import NullSink
+
+
+def test_mosaic_refuses_more_sessions_than_cells():
+    mosaic = MosaicOutput(NullSink, width=400, height=200, columns=4)
+    try:
+        tiles = [mosaic.tile_for(session_id) for session_id in range(mosaic.cells)]
+        rects = {mosaic.cell_rect(mosaic.slots[tile.session_id]) for tile in tiles}
+        assert len(rects) == 16
+        assert all(x + width <= 400 and y + height <= 200 for x, y, width, height in rects)
+        with pytest.raises(RuntimeError):
+            mosaic.tile_for(16)
+        # A session that leaves frees its cell for the next one
+        tiles[5].close()
+        mosaic.tile_for(16)
+        assert mosaic.slots[16] == 5
+    finally:
+        mosaic.stop()
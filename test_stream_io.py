@@ -0,0 +1,56 @@
+import socket
+import pytest
+from stream_io import FRAME_HEADER, FRAME_MAGIC, MAX_PAYLOAD_SIZE, PROTOCOL_VERSION, FrameHeader, FrameReader, \
+    ProtocolError, pack_frame_header, unpack_frame_header
+
+
+def make_header(payload_length=4):
+    return FrameHeader(1, 0, 3, 0, 640, 480, 1.5, 7, payload_length)
+
+
+def test_header_round_trip():
+    header = make_header()
+    assert unpack_frame_header(pack_frame_header(header)) == header
+
+
+def test_truncated_header():
+    with pytest.raises(ProtocolError):
+        unpack_frame_header(pack_frame_header(make_header())[:FRAME_HEADER.size - 1])
+
+
+def test_oversize_payload():
+    assert unpack_frame_header(pack_frame_header(make_header(MAX_PAYLOAD_SIZE))).payload_length == MAX_PAYLOAD_SIZE
+    with pytest.raises(ProtocolError):
+        unpack_frame_header(pack_frame_header(make_header(MAX_PAYLOAD_SIZE + 1)))
+    with pytest.raises(ProtocolError):
+        unpack_frame_header(pack_frame_header(make_header(0xFFFFFFFF)))
+
+
+def test_bad_magic_and_version():
+    fields = tuple(make_header())
+    with pytest.raises(ProtocolError):
+        unpack_frame_header(FRAME_HEADER.pack(b"NOPE", PROTOCOL_VERSION, *fields))
+    with pytest.raises(ProtocolError):
+        unpack_frame_header(FRAME_HEADER.pack(FRAME_MAGIC, PROTOCOL_VERSION + 1, *fields))
+
+
+def test_reader_refuses_oversize_before_allocating():
+    sender, receiver = socket.socketpair()
+    with sender, receiver:
+        sender.sendall(pack_frame_header(make_header(0xFFFFFFFF)))
+        reader = FrameReader(receiver, initial_size=16)
+        with pytest.raises(ProtocolError):
+            reader.read_frame()
+        assert len(reader.buffer) == 16
+
+
+def test_reader_frames_and_truncated_stream():
+    sender, receiver = socket.socketpair()
+    with receiver:
+        with sender:
+            sender.sendall(pack_frame_header(make_header(4)) + b"abcd")
+            sender.sendall(pack_frame_header(make_header(8)) + b"abc")  # Peer closes mid-payload
+        reader = FrameReader(receiver, initial_size=2)
+        header, payload = reader.read_frame()
+        assert header.payload_length == 4 and bytes(payload) == b"abcd"
+        assert reader.read_frame() is None
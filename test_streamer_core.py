@@ -0,0 +1,46 @@
+import socket
+import threading
+import time
+from relay import RELAY_MAGIC
+from sessions import SESSION_HELLO, pack_session_hello
+from streamer_core import StreamViewer
+
+
+def test_viewer_connects_off_the_event_thread(monkeypatch):
+    listener = socket.create_server(("127.0.0.1", 0))
+    port = listener.getsockname()[1]
+    release = threading.Event()
+    create_connection = socket.create_connection
+
+    def slow_connection(*args, **kwargs):
+        release.wait(5)
+        return create_connection(*args, **kwargs)
+
+    monkeypatch.setattr(socket, "create_connection", slow_connection)
+    viewer = StreamViewer(lambda *args: None)
+    viewer.streaming = True
+    try:
+        start = time.monotonic()
+        viewer.on_watch_accepted("127.0.0.1", f"codec=raw;session=3;token=abc;stream_port={port}".encode())
+        assert time.monotonic() - start < 0.5
+        assert viewer.engine.take_events(0.1) == []
+        release.set()
+        [(name, (server_ip, params, sock))] = viewer.engine.take_events(5)
+        assert name == "relay_connected"
+        connection, _ = listener.accept()
+        with connection:
+            assert connection.recv(SESSION_HELLO.size) == pack_session_hello(3, "abc", RELAY_MAGIC)
+        # Stopped while connecting: the connection is dropped instead of starting a pipeline
+        viewer.streaming = False
+        viewer.on_relay_connected(server_ip, params, sock)
+        assert sock.fileno() == -1 and viewer.pipeline is None
+
+        listener.close()
+        viewer.streaming = True
+        viewer.on_watch_accepted("127.0.0.1", f"codec=raw;session=3;token=abc;stream_port={port}".encode())
+        [(name, (server_ip, error))] = viewer.engine.take_events(5)
+        assert name == "watch_failed" and isinstance(error, OSError)
+    finally:
+        viewer.streaming = False
+        viewer.shutdown()
+        listener.close()
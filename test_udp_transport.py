@@ -0,0 +1,122 @@
+import socket
+import pytest
+from stream_io import FrameHeader, pack_frame_header
+from udp_transport import FRAGMENT_HEADER, MAX_FRAGMENT_PAYLOAD, MAX_FRAGMENTS, MAX_PARTIAL_BYTES, LossySocket, \
+    UdpFrameSender, UdpReassembler
+
+FRAME_COUNT = 40
+
+
+def make_frame(sequence, size=5000):
+    payload = bytes((sequence + i) & 0xFF for i in range(size))
+    return pack_frame_header(FrameHeader(1, 0, 3, 0, 64, 48, 0.0, sequence, len(payload))), payload
+
+
+@pytest.fixture
+def loopback():
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(("127.0.0.1", 0))
+    receiver.settimeout(0.05)
+    with receiver, sender:
+        yield sender, receiver
+
+
+def send_frames(lossy, receiver, reassembler):
+    # Sends FRAME_COUNT frames through the shim, draining the receiver after each one so loopback
+    # never drops on its own; returns {sequence: payload} for the frames that came out whole
+    sender = UdpFrameSender(lossy, receiver.getsockname())
+    received = {}
+    datagram = bytearray(65536)
+    for sequence in range(FRAME_COUNT):
+        sender.send_parts(make_frame(sequence))
+        if sequence == FRAME_COUNT - 1:
+            lossy.flush()
+        while True:
+            try:
+                size = receiver.recv_into(datagram)
+            except socket.timeout:
+                break
+            frame = reassembler.add(memoryview(datagram)[:size], 0.0)
+            if frame is not None:
+                header, payload, _ = frame
+                received[header.sequence] = bytes(payload)
+    return received
+
+
+def test_loopback_reordering_and_duplicates(loopback):
+    sender, receiver = loopback
+    lossy = LossySocket(sender, 0.0, seed=1, duplicate_rate=0.2, reorder_rate=0.2)
+    reassembler = UdpReassembler()
+    received = send_frames(lossy, receiver, reassembler)
+    assert lossy.duplicated > 0 and lossy.reordered > 0
+    assert received == {sequence: make_frame(sequence)[1] for sequence in range(FRAME_COUNT)}
+    # A duplicate of a frame's last fragment arrives after the frame is done and counts as late
+    totals = reassembler.loss_totals()
+    assert totals["udp_lost"] == 0 and totals["udp_bad_datagrams"] == 0
+    assert totals["udp_late_fragments"] <= lossy.duplicated
+
+
+def test_loopback_loss(loopback):
+    sender, receiver = loopback
+    lossy = LossySocket(sender, 0.05, seed=2, duplicate_rate=0.1, reorder_rate=0.1)
+    reassembler = UdpReassembler()
+    received = send_frames(lossy, receiver, reassembler)
+    assert lossy.dropped > 0
+    assert 0 < len(received) < FRAME_COUNT
+    for sequence, payload in received.items():
+        assert payload == make_frame(sequence)[1]
+    # Every frame is either delivered whole or counted lost, except ones still waiting for fragments
+    totals = reassembler.loss_totals()
+    assert len(received) + totals["udp_lost"] + len(reassembler.partials) == FRAME_COUNT
+    assert totals["udp_bad_datagrams"] == 0
+
+
+def test_oversize_fragment_is_dropped():
+    reassembler = UdpReassembler()
+    datagram = FRAGMENT_HEADER.pack(0, 1, 2) + bytes(MAX_FRAGMENT_PAYLOAD + 100)
+    assert reassembler.add(memoryview(datagram), 0.0) is None
+    assert reassembler.loss_totals()["udp_bad_datagrams"] == 1
+    assert not reassembler.partials
+
+
+def test_inconsistent_fragments_are_dropped():
+    reassembler = UdpReassembler()
+    header, payload = make_frame(0, 2000)
+    message = header + payload
+    first = FRAGMENT_HEADER.pack(0, 0, 2) + message[:MAX_FRAGMENT_PAYLOAD]
+    assert reassembler.add(memoryview(first), 0.0) is None
+    # A count that disagrees with the frame's first fragment, a short middle fragment, a short datagram
+    for datagram in (FRAGMENT_HEADER.pack(0, 1, 3) + message[MAX_FRAGMENT_PAYLOAD:],
+                     FRAGMENT_HEADER.pack(1, 0, 2) + bytes(10), b"\x00" * 4):
+        assert reassembler.add(memoryview(datagram), 0.0) is None
+    assert reassembler.loss_totals()["udp_bad_datagrams"] == 3
+    assert len(reassembler.partials[0].buffer) == 2 * MAX_FRAGMENT_PAYLOAD
+    last = FRAGMENT_HEADER.pack(0, 1, 2) + message[MAX_FRAGMENT_PAYLOAD:]
+    header, received, _ = reassembler.add(memoryview(last), 0.0)
+    assert bytes(received) == payload
+
+
+def test_malformed_frame_header_is_dropped():
+    reassembler = UdpReassembler()
+    header, payload = make_frame(0, 100)
+    for message in (b"NOPE" + header[4:] + payload, header + payload[:50]):
+        datagram = FRAGMENT_HEADER.pack(reassembler.last_completed + 1, 0, 1) + message
+        assert reassembler.add(memoryview(datagram), 0.0) is None
+    assert reassembler.loss_totals()["udp_bad_datagrams"] == 2
+
+
+def test_forged_fragment_counts_stay_bounded():
+    reassembler = UdpReassembler()
+    # More fragments than any frame may have: refused before anything is allocated
+    datagram = FRAGMENT_HEADER.pack(0, 0, MAX_FRAGMENTS + 1) + bytes(MAX_FRAGMENT_PAYLOAD)
+    assert reassembler.add(memoryview(datagram), 0.0) is None
+    assert not reassembler.partials and reassembler.partial_bytes == 0
+    # One tiny datagram per frame id, each claiming the largest frame: older partials make room
+    for frame_id in range(20):
+        datagram = FRAGMENT_HEADER.pack(frame_id, 0, MAX_FRAGMENTS) + bytes(MAX_FRAGMENT_PAYLOAD)
+        assert reassembler.add(memoryview(datagram), 0.0) is None
+        held = sum(len(partial.buffer) for partial in reassembler.partials.values())
+        assert held == reassembler.partial_bytes <= MAX_PARTIAL_BYTES
+    assert list(reassembler.partials) == [19]
+    assert reassembler.loss_totals()["udp_lost"] == 19
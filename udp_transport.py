@@ -0,0 +1,246 @@
+import random
+import socket
+import struct
+import time
+from stream_io import FRAME_HEADER, ProtocolError, unpack_frame_header
+
+# Optional UDP stream transport. Each framed message (frame header + payload,
+# exactly what goes over TCP) is split into datagrams that carry a fragment
+# header of frame id, fragment index and fragment count. The receiver
+# reassembles frames and drops any that are still incomplete after a deadline
+# or once a newer frame has been completed, so one lost datagram costs one
+# frame instead of stalling the stream like a TCP retransmit does. Malformed
+# datagrams (oversize fragments, inconsistent counts, a bad frame header once
+# reassembled) are counted and dropped. A sender also sends its session hello
+# (sessions.SESSION_HELLO, with the session's token) as a datagram of its own
+# before the first frame and every HELLO_INTERVAL after; the server takes
+# fragments only from the address of the last valid hello, see net_engine.
+TRANSPORT_TCP = "tcp"
+TRANSPORT_UDP = "udp"
+TRANSPORTS = (TRANSPORT_TCP, TRANSPORT_UDP)
+FRAGMENT_HEADER = struct.Struct("<IHH")
+MAX_DATAGRAM_SIZE = 1200  # Stays under a typical 1500 byte MTU with IP/UDP headers
+MAX_FRAGMENT_PAYLOAD = MAX_DATAGRAM_SIZE - FRAGMENT_HEADER.size
+REASSEMBLY_DEADLINE = 0.2  # Seconds an incomplete frame may wait for missing fragments
+SOCKET_BUFFER_SIZE = 4 << 20
+# A partial frame's buffer is sized by the fragment count of its first datagram, so the
+# incomplete frames together may hold at most MAX_PARTIAL_BYTES: room for a few raw 1080p
+# frames (6 MB each), while a burst of forged counts pins no more than that
+MAX_PARTIAL_BYTES = 32 << 20
+MAX_FRAGMENTS = MAX_PARTIAL_BYTES // MAX_FRAGMENT_PAYLOAD  # Largest frame, in fragments
+MAX_PARTIAL_FRAMES = 16  # Incomplete frames kept at once; the oldest is dropped beyond that
+HELLO_INTERVAL = 1.0  # Seconds between repeats of the session hello, in case one is lost
+
+
+class UdpFrameSender:
+    # Socket-like wrapper so ClientPipeline can call sendall() with a whole message, or send_parts().
+    # hello is the packed session hello to send ahead of the frames, or None.
+    def __init__(self, sock, address, hello=None):
+        self.sock = sock
+        self.address = address
+        self.hello = hello
+        self.last_hello = None
+        self.frame_id = 0
+        try:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
+        except OSError:
+            pass
+
+    def sendall(self, message):
+        self.send_parts((message,))
+
+    def send_parts(self, parts):
+        # One message made of parts, e.g. a frame header and its payload; fragments fill the datagram
+        # buffer straight from the parts, so they are never joined into one copy first
+        views = [memoryview(part).cast("B") for part in parts]
+        total = sum(len(view) for view in views)
+        count = (total + MAX_FRAGMENT_PAYLOAD - 1) // MAX_FRAGMENT_PAYLOAD
+        if count > MAX_FRAGMENTS:
+            raise ValueError(f"Frame too large for UDP transport: {total} bytes")
+        now = time.monotonic()
+        if self.hello is not None and (self.last_hello is None or now - self.last_hello >= HELLO_INTERVAL):
+            self.sock.sendto(self.hello, self.address)
+            self.last_hello = now
+        datagram = bytearray(MAX_DATAGRAM_SIZE)
+        index = 0
+        filled = FRAGMENT_HEADER.size
+        for view in views:
+            while view:
+                size = min(len(view), MAX_DATAGRAM_SIZE - filled)
+                datagram[filled:filled + size] = view[:size]
+                filled += size
+                view = view[size:]
+                if filled == MAX_DATAGRAM_SIZE:
+                    self.send_fragment(datagram, filled, index, count)
+                    index += 1
+                    filled = FRAGMENT_HEADER.size
+        if filled > FRAGMENT_HEADER.size:
+            self.send_fragment(datagram, filled, index, count)
+        self.frame_id = (self.frame_id + 1) & 0xFFFFFFFF
+
+    def send_fragment(self, datagram, filled, index, count):
+        FRAGMENT_HEADER.pack_into(datagram, 0, self.frame_id, index, count)
+        self.sock.sendto(memoryview(datagram)[:filled], self.address)
+
+    def shutdown(self, how):
+        self.sock.shutdown(how)
+
+    def close(self):
+        self.sock.close()
+
+
+class PartialFrame:
+    def __init__(self, count, now):
+        self.buffer = bytearray(count * MAX_FRAGMENT_PAYLOAD)
+        self.received = bytearray(count)  # One flag per fragment, to ignore duplicates
+        self.remaining = count
+        self.length = None  # Known once the last fragment arrives
+        self.started = now
+
+
+class UdpReassembler:
+    # Socket-free reassembly: add() takes one datagram and returns
+    # (header, payload, message size) once a frame is complete, else None
+    def __init__(self, deadline=REASSEMBLY_DEADLINE):
+        self.deadline = deadline
+        self.partials = {}
+        self.partial_bytes = 0  # Buffer bytes held by partials, at most MAX_PARTIAL_BYTES
+        self.last_completed = -1
+
+        # Loss statistics, reset by loss_report; the totals are never reset
+        self.frames_completed = 0
+        self.frames_lost = 0
+        self.fragments_late = 0
+        self.bad_datagrams = 0
+        self.frames_lost_total = 0
+        self.fragments_late_total = 0
+        self.bad_datagrams_total = 0
+
+    def expire(self, now, newer_than=None):
+        # Drop frames that missed the deadline, or that are older than a completed frame
+        for frame_id in list(self.partials):
+            partial = self.partials[frame_id]
+            if now - partial.started > self.deadline or (newer_than is not None and frame_id < newer_than):
+                self.drop(frame_id)
+
+    def drop(self, frame_id):
+        partial = self.partials.pop(frame_id)
+        self.partial_bytes -= len(partial.buffer)
+        self.frames_lost += 1
+        self.frames_lost_total += 1
+
+    def reject(self):
+        # A datagram dropped before reassembly, e.g. from an address that isn't the session's
+        self.bad_datagrams += 1
+        self.bad_datagrams_total += 1
+
+    def add(self, datagram, now):
+        try:
+            return self.add_fragment(datagram, now)
+        except ProtocolError:
+            self.reject()
+            return None
+
+    def add_fragment(self, datagram, now):
+        # Raises ProtocolError for a datagram that can't be part of a valid frame
+        if len(datagram) < FRAGMENT_HEADER.size:
+            raise ProtocolError(f"Short datagram: {len(datagram)} bytes")
+        frame_id, index, count = FRAGMENT_HEADER.unpack_from(datagram)
+        chunk_size = len(datagram) - FRAGMENT_HEADER.size
+        if index >= count or count > MAX_FRAGMENTS or chunk_size > MAX_FRAGMENT_PAYLOAD or \
+                (index < count - 1 and chunk_size != MAX_FRAGMENT_PAYLOAD):
+            raise ProtocolError(f"Bad fragment {index}/{count} of {chunk_size} bytes")
+        if frame_id <= self.last_completed:
+            self.fragments_late += 1
+            self.fragments_late_total += 1
+            return None
+
+        partial = self.partials.get(frame_id)
+        if partial is None:
+            # Make room by dropping the oldest incomplete frames; count is capped, so this one always fits
+            size = count * MAX_FRAGMENT_PAYLOAD
+            while self.partials and (len(self.partials) >= MAX_PARTIAL_FRAMES or
+                                     self.partial_bytes + size > MAX_PARTIAL_BYTES):
+                self.drop(min(self.partials))
+            partial = self.partials[frame_id] = PartialFrame(count, now)
+            self.partial_bytes += size
+        elif len(partial.received) != count:
+            raise ProtocolError(f"Fragment count {count} changed for frame {frame_id}")
+        if partial.received[index]:
+            return None
+        offset = index * MAX_FRAGMENT_PAYLOAD
+        partial.buffer[offset:offset + chunk_size] = datagram[FRAGMENT_HEADER.size:]
+        partial.received[index] = 1
+        partial.remaining -= 1
+        if index == count - 1:
+            partial.length = offset + chunk_size
+
+        if partial.remaining == 0:
+            del self.partials[frame_id]
+            self.partial_bytes -= len(partial.buffer)
+            self.last_completed = frame_id
+            self.frames_completed += 1
+            self.expire(now, newer_than=frame_id)
+            message = memoryview(partial.buffer)[:partial.length]
+            header = unpack_frame_header(message[:FRAME_HEADER.size])
+            if FRAME_HEADER.size + header.payload_length > partial.length:
+                raise ProtocolError(f"Frame payload of {header.payload_length} bytes exceeds the datagrams")
+            return header, message[FRAME_HEADER.size:FRAME_HEADER.size + header.payload_length], partial.length
+        self.expire(now)
+        return None
+
+    def loss_report(self):
+        total = self.frames_completed + self.frames_lost
+        loss = self.frames_lost / total * 100 if total else 0
+        report = f"udp lost {self.frames_lost} ({loss:.1f}%) late {self.fragments_late}"
+        if self.bad_datagrams:
+            report += f" bad {self.bad_datagrams}"
+        self.frames_completed = 0
+        self.frames_lost = 0
+        self.fragments_late = 0
+        self.bad_datagrams = 0
+        return report
+
+    def loss_totals(self):
+        return {"udp_lost": self.frames_lost_total, "udp_late_fragments": self.fragments_late_total,
+                "udp_bad_datagrams": self.bad_datagrams_total}
+
+
+class LossySocket:
+    # Test shim around a UDP socket that drops, duplicates and reorders outgoing
+    # datagrams at given rates, e.g. UdpFrameSender(LossySocket(sock, 0.05), address)
+    # on loopback. A reordered datagram is held back and sent after the next one.
+    def __init__(self, sock, loss_rate, seed=None, duplicate_rate=0.0, reorder_rate=0.0):
+        self.sock = sock
+        self.loss_rate = loss_rate
+        self.duplicate_rate = duplicate_rate
+        self.reorder_rate = reorder_rate
+        self.random = random.Random(seed)
+        self.held = None  # (datagram, address) waiting for the next one
+        self.dropped = 0
+        self.duplicated = 0
+        self.reordered = 0
+
+    def sendto(self, data, address):
+        if self.random.random() < self.loss_rate:
+            self.dropped += 1
+            return len(data)
+        if self.held is None and self.random.random() < self.reorder_rate:
+            # The sender reuses its datagram buffer, so keep a copy
+            self.held = (bytes(data), address)
+            self.reordered += 1
+            return len(data)
+        sent = self.sock.sendto(data, address)
+        if self.random.random() < self.duplicate_rate:
+            self.sock.sendto(data, address)
+            self.duplicated += 1
+        self.flush()
+        return sent
+
+    def flush(self):
+        if self.held is not None:
+            self.sock.sendto(*self.held)
+            self.held = None
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
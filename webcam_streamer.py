@@ -1,20 +1,19 @@
-import cv2
 import tkinter as tk
 from tkinter import ttk, messagebox
-import threading
-import socket
-import pickle
-import struct
 import time
-from PIL import Image, ImageTk
-import pyvirtualcam
-import win32com.client
+from frame_codecs import CODECS, DEFAULT_CODEC
+from adaptive_bitrate import DEFAULT_LATENCY_BUDGET
+from udp_transport import TRANSPORT_TCP, TRANSPORTS
+from simulcast import DEFAULT_LAYERS
+from preview import PREVIEW_MAX_WIDTH, PreviewRenderer
+from devices import DeviceInventory, format_device
+from streamer_core import DEFAULT_PORT, OUTPUT_MODES, OUTPUT_PER_CLIENT, StreamClient, StreamServer
 
-# Constants for network discovery and control messages
-DISCOVERY_PORT = 9998
-CONTROL_PORT = 9997
-START_MESSAGE = b"START_STREAMING"
-STOP_MESSAGE = b"STOP_STREAMING"
+# Tk front end over streamer_core; streamer_cli.py runs the same core without a GUI.
+# The preview (see preview.py) is downscaled and rate-limited on both sides.
+
+# How often the Tk thread handles events from the network engine
+NETWORK_POLL_MS = 20
 
 class WebcamStreamer:
     def __init__(self, root, mode):
@@ -23,25 +22,50 @@ class WebcamStreamer:
         self.mode = mode  # Mode is now set during initialization
         self.webcam_index = tk.IntVar(value=0)
         self.ip_address = tk.StringVar(value="127.0.0.1")
-        self.port = tk.IntVar(value=9999)
-        self.capture = None
-        self.streaming = False
-        self.broadcasting_enabled = False  # Start with broadcasting disabled
-        self.control_listener_thread = None  # Keep track of control listener thread
+        self.port = tk.IntVar(value=DEFAULT_PORT)
 
-        # Variables for bitrate calculation
-        self.bytes_sent = 0
-        self.bytes_received = 0
-        self.last_update_time = time.time()
+        # Codec requested by the client and agreed on during the control handshake
+        self.codec_name = tk.StringVar(value=DEFAULT_CODEC)
+        self.codec_quality = tk.IntVar(value=CODECS[DEFAULT_CODEC].default_quality)  # On the codec's own scale
+        self.transport = tk.StringVar(value=TRANSPORT_TCP)  # Stream transport, also agreed on in the handshake
+        self.delta_enabled = tk.BooleanVar(value=False)  # Send only changed tiles plus periodic keyframes
+        self.simulcast_enabled = tk.BooleanVar(value=False)  # Offer downscaled layers; the server picks what it needs
 
-        self.setup_gui()
+        # Adaptive bitrate: the client lowers quality, resolution and fps to stay under the latency budget
+        self.adaptive_enabled = tk.BooleanVar(value=True)
+        self.latency_budget = tk.IntVar(value=int(DEFAULT_LATENCY_BUDGET * 1000))  # Milliseconds
 
-        # Start discovery listener on the client
+        # Server: a virtual camera per client, or every client tiled into one
+        self.output_mode = tk.StringVar(value=OUTPUT_PER_CLIENT)
+        self.preview_enabled = tk.BooleanVar(value=True)
+
+        # Networking, sessions and pipelines live in the GUI-free core; it reports back through handle_core_event
         if self.mode == "Client":
-            threading.Thread(target=self.start_discovery_listener, daemon=True).start()
-            self.status_label.config(text="Searching for server...", foreground="orange")
+            self.core = StreamClient(self.handle_core_event)
+            self.inventory = DeviceInventory()  # Lists cameras without opening them, refreshed on hotplug
+            variables = (self.webcam_index, self.codec_name, self.codec_quality, self.transport, self.delta_enabled,
+                         self.simulcast_enabled, self.adaptive_enabled, self.latency_budget)
+        else:
+            self.core = StreamServer(self.handle_core_event, port=self.port.get())
+            variables = (self.output_mode, self.preview_enabled)
+        for variable in variables:
+            variable.trace_add("write", lambda *args: self.sync_settings())
+        if self.mode == "Client":
+            self.codec_name.trace_add("write", lambda *args: self.update_quality_range())
+
+        self.setup_gui()
+        self.sync_settings()
+        if self.mode == "Client":
+            self.inventory.watch(lambda devices: self.root.after(0, self.update_cam_list, devices))
+            # Start searching for a server on the client
+            self.core.start()
         else:
             self.status_label.config(text="Waiting to start...", foreground="orange")
+        self.process_network_events()
+
+    @property
+    def streaming(self):
+        return self.core.streaming
 
     def setup_gui(self):
         # Webcam selection
@@ -55,8 +79,26 @@ class WebcamStreamer:
             self.cam_dropdown.current(0)
             self.cam_dropdown.bind("<<ComboboxSelected>>", self.update_webcam_index)
             self.cam_dropdown.pack(side="left", padx=5, pady=5)
+
+            # Codec and transport selection
+            codec_frame = ttk.LabelFrame(self.root, text="Stream Settings")
+            codec_frame.pack(padx=10, pady=5, fill="x")
+            ttk.Label(codec_frame, text="Codec:").pack(side="left", padx=5, pady=5)
+            ttk.Combobox(codec_frame, textvariable=self.codec_name, values=list(CODECS), state="readonly", width=8).pack(side="left", padx=5, pady=5)
+            ttk.Label(codec_frame, text="Quality:").pack(side="left", padx=5, pady=5)
+            self.quality_spinbox = ttk.Spinbox(codec_frame, textvariable=self.codec_quality, from_=1, to=100, width=5)
+            self.quality_spinbox.pack(side="left", padx=5, pady=5)
+            ttk.Label(codec_frame, text="Transport:").pack(side="left", padx=5, pady=5)
+            ttk.Combobox(codec_frame, textvariable=self.transport, values=TRANSPORTS, state="readonly", width=5).pack(side="left", padx=5, pady=5)
+            ttk.Checkbutton(codec_frame, text="Delta", variable=self.delta_enabled).pack(side="left", padx=5, pady=5)
+            ttk.Checkbutton(codec_frame, text="Simulcast", variable=self.simulcast_enabled).pack(side="left", padx=5, pady=5)
+            ttk.Checkbutton(codec_frame, text="Adaptive", variable=self.adaptive_enabled).pack(side="left", padx=5, pady=5)
+            ttk.Label(codec_frame, text="Latency (ms):").pack(side="left", padx=5, pady=5)
+            ttk.Spinbox(codec_frame, textvariable=self.latency_budget, from_=30, to=2000, increment=10, width=5).pack(side="left", padx=5, pady=5)
         else:
-            ttk.Label(cam_frame, text="Server Mode - No Webcam Selection Required").pack(padx=5, pady=5)
+            ttk.Label(cam_frame, text="Server Mode - No Webcam Selection Required").pack(side="left", padx=5, pady=5)
+            ttk.Label(cam_frame, text="Output:").pack(side="left", padx=5, pady=5)
+            ttk.Combobox(cam_frame, textvariable=self.output_mode, values=OUTPUT_MODES, state="readonly", width=12).pack(side="left", padx=5, pady=5)
 
         # IP and Port
         network_frame = ttk.LabelFrame(self.root, text="Network Settings")
@@ -77,176 +119,112 @@ class WebcamStreamer:
             self.start_button = None
 
         # Video display label
+        ttk.Checkbutton(self.root, text="Preview", variable=self.preview_enabled,
+                        command=lambda: self.preview.set_enabled(self.preview_enabled.get())).pack()
         self.video_label = ttk.Label(self.root)
         self.video_label.pack(padx=10, pady=10)
+        self.preview = PreviewRenderer(self.video_label)
 
         # Bitrate label
         self.bitrate_label = ttk.Label(self.root, text="Bitrate: 0 Mbps")
         self.bitrate_label.pack()
 
+        # Per-stage queue depth and timing
+        self.stage_label = ttk.Label(self.root, text="")
+        self.stage_label.pack()
+
         # Set initial IP address
         if self.mode == "Server":
-            self.ip_address.set(self.get_local_ip())
+            self.ip_address.set(self.core.local_ip)
         else:
             self.ip_address.set("127.0.0.1")
 
-    def broadcast_server_presence(self):
-        # Server periodically broadcasts its presence
-        self.broadcasting_enabled = True
-        broadcast_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        broadcast_socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-        server_ip = self.get_local_ip().encode()
-        while self.broadcasting_enabled:
-            try:
-                broadcast_socket.sendto(server_ip, ('<broadcast>', DISCOVERY_PORT))
-                print("Server: Broadcasting presence")
-                time.sleep(1)  # Broadcast every second
-            except Exception as e:
-                print(f"Server: Error broadcasting presence: {e}")
-                break
-        broadcast_socket.close()
-        print("Server: Stopped broadcasting presence")
-
-    def start_discovery_listener(self):
-        # Client listens for server broadcasts
-        while True:
-            if self.streaming:
-                time.sleep(1)  # Pause discovery when streaming
-                continue
-            discovery_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            discovery_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            discovery_socket.bind(('', DISCOVERY_PORT))
-            discovery_socket.settimeout(5)
-            print("Client: Listening for server broadcasts")
-            self.status_label.config(text="Searching for server...", foreground="orange")
-            while self.ip_address.get() == "127.0.0.1" and not self.streaming:
-                try:
-                    data, addr = discovery_socket.recvfrom(1024)
-                    server_ip = data.decode()
-                    if server_ip != self.get_local_ip():
-                        # Update IP address field
-                        self.ip_address.set(server_ip)
-                        print(f"Client: Discovered server IP: {server_ip}")
-                        # Send start command to server
-                        threading.Thread(target=self.send_start_command, daemon=True).start()
-                        break
-                except socket.timeout:
-                    print("Client: No broadcast received. Retrying...")
-                except Exception as e:
-                    print(f"Client: Discovery listener error: {e}")
-                    break
-            discovery_socket.close()
-            time.sleep(1)  # Wait before restarting the discovery listener
-
-    def send_start_command(self):
+    def update_quality_range(self):
+        # JPEG quality and PNG compression level don't share a scale: each codec starts at its own default
+        codec = CODECS[self.codec_name.get()]
+        if codec.quality_range is None:
+            self.quality_spinbox.configure(state="disabled")
+            return
+        lowest, highest = codec.quality_range
+        self.quality_spinbox.configure(state="normal", from_=lowest, to=highest)
+        self.codec_quality.set(codec.default_quality)
+
+    def sync_settings(self):
+        # Copy the settings widgets into the core; they apply to the next stream
         try:
-            self.control_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.control_socket.connect((self.ip_address.get(), CONTROL_PORT))
-            self.control_socket.sendall(START_MESSAGE)
-            self.status_label.config(text="Sent start command to server", foreground="orange")
-            print("Client: Sent start command to server")
-            # Wait for server's confirmation to start streaming
-            response = self.control_socket.recv(1024)
-            if response == START_MESSAGE:
-                print("Client: Received start confirmation from server")
-                self.status_label.config(text="Starting streaming...", foreground="orange")
-                # Start a thread to listen for control messages from the server
-                threading.Thread(target=self.listen_for_server_messages, daemon=True).start()
-                self.toggle_streaming()
+            if self.mode == "Client":
+                self.core.camera_index = self.webcam_index.get()
+                self.core.codec_name = self.codec_name.get()
+                self.core.quality = self.codec_quality.get() if CODECS[self.codec_name.get()].quality_range else None
+                self.core.transport = self.transport.get()
+                self.core.delta = self.delta_enabled.get()
+                self.core.layers = DEFAULT_LAYERS if self.simulcast_enabled.get() else ()
+                self.core.adaptive = self.adaptive_enabled.get()
+                self.core.latency_budget = self.latency_budget.get() / 1000
+                self.core.update_request()
             else:
-                print("Client: Unexpected response from server:", response)
-        except Exception as e:
-            print(f"Client: Error sending start command: {e}")
-            self.status_label.config(text=f"Error: {e}", foreground="red")
-
-    def listen_for_server_messages(self):
+                self.core.output_mode = self.output_mode.get()
+                # Simulcast clients send the preview a small layer, and none while it is off
+                self.core.preview_width = PREVIEW_MAX_WIDTH if self.preview_enabled.get() else None
+        except tk.TclError:
+            pass  # A spinbox is mid-edit
+
+    def process_network_events(self):
+        # Network engine events are handled by the core on the Tk thread; a failing handler must not end the polling
         try:
-            while self.streaming:
-                data = self.control_socket.recv(1024)
-                if not data:
-                    # Server closed the connection
-                    print("Client: Control connection closed by server")
-                    self.status_label.config(text="Server disconnected", foreground="red")
-                    self.streaming = False
-                    self.cleanup_resources()
-                    # Reset IP address and restart discovery
-                    self.ip_address.set("127.0.0.1")
-                    threading.Thread(target=self.start_discovery_listener, daemon=True).start()
-                    self.status_label.config(text="Stopped. Searching for server...", foreground="orange")
-                    break
-                elif data == STOP_MESSAGE:
-                    print("Client: Received stop command from server")
-                    self.status_label.config(text="Server requested to stop", foreground="orange")
-                    self.toggle_streaming()
-                    break
-                else:
-                    print("Client: Received unknown control message:", data)
-        except Exception as e:
-            print(f"Client: Error receiving control message: {e}")
-
-    def start_control_listener(self):
-        # Server listens for start/stop commands from the client
-        self.control_listener_enabled = True
-        control_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        control_socket.bind(('', CONTROL_PORT))
-        control_socket.listen(1)
-        print("Server: Control listener started")
-        while self.control_listener_enabled:
-            try:
-                conn, addr = control_socket.accept()
-                print(f"Server: Received control connection from {addr}")
-                data = conn.recv(1024)
-                if data == START_MESSAGE:
-                    print("Server: Received start command from client")
-                    self.status_label.config(text="Starting streaming...", foreground="orange")
-                    if not self.streaming:
-                        # Send confirmation back to client
-                        conn.sendall(START_MESSAGE)
-                        # Store the control connection
-                        self.control_conn = conn
-                        self.toggle_streaming()
-                    else:
-                        print("Server: Already streaming")
-                        conn.sendall(b"ALREADY_STREAMING")
-                elif data == STOP_MESSAGE:
-                    print("Server: Received stop command from client")
-                    self.status_label.config(text="Stopping streaming...", foreground="orange")
-                    if self.streaming:
-                        self.toggle_streaming()
-                    conn.sendall(STOP_MESSAGE)
-                    conn.close()
-                else:
-                    print("Server: Unknown control message:", data)
-                    conn.close()
-            except Exception as e:
-                if self.control_listener_enabled:
-                    print(f"Server: Control listener error: {e}")
-                break
-        control_socket.close()
-        print("Server: Control listener stopped")
-
-    def get_available_cams(self):
-        # Get device names using WMI
-        dev_enum = win32com.client.Dispatch("WbemScripting.SWbemLocator")
-        wbem_services = dev_enum.ConnectServer(".", "root\\cimv2")
-        wbem_devices = wbem_services.ExecQuery("SELECT * FROM Win32_PnPEntity WHERE ConfigManagerErrorCode = 0")
-
-        device_names = []
-        index = 0
-        for device in wbem_devices:
-            if "USB" in device.PNPDeviceID and "vid" in device.PNPDeviceID.lower():
-                name = device.Name
-                # Check if the device can be opened by OpenCV
-                cap = cv2.VideoCapture(index)
-                if cap.isOpened():
-                    device_names.append(f"{name} ({index})")
-                    cap.release()
-                index += 1
+            self.core.handle_events()
+        finally:
+            self.root.after(NETWORK_POLL_MS, self.process_network_events)
+
+    def handle_core_event(self, event, *args):
+        # Some events come from the core's worker threads, so widgets are only touched via after()
+        self.root.after(0, self.apply_core_event, event, args)
+
+    def apply_core_event(self, event, args):
+        if event == "status":
+            text, color = args
+            self.status_label.config(text=text, foreground=color)
+        elif event == "error":
+            messagebox.showerror("Error", args[0])
+        elif event == "server_ip":
+            # Update IP address field
+            self.ip_address.set(args[0])
+        elif event == "started":
+            if self.mode == "Server":
+                self.start_button.config(text="Stop")
+                self.update_server_preview()
+            else:
+                # Show the agreed parameters and preview the captured frames
+                self.transport.set(self.core.transport)
+                self.delta_enabled.set(self.core.delta)
+                self.update_video_frame()
+        elif event == "stopped":
+            if self.mode == "Server":
+                self.start_button.config(text="Start")
+            else:
+                # Reset IP address while searching again
+                self.ip_address.set("127.0.0.1")
 
+    def get_available_cams(self, devices=None):
+        # Camera names from the inventory (WMI on Windows, V4L2 on Linux); without any, offer the default camera
+        if devices is None:
+            devices = self.inventory.devices()
+        device_names = [format_device(device) for device in devices]
         if not device_names:
             device_names = ["Default Camera (0)"]
         return device_names
 
+    def update_cam_list(self, devices):
+        # A camera was plugged in or removed; keep the selection if it is still there
+        names = self.get_available_cams(devices)
+        selected = self.cam_dropdown.get()
+        self.cam_dropdown['values'] = names
+        if selected in names:
+            self.cam_dropdown.current(names.index(selected))
+        elif not self.streaming:
+            self.cam_dropdown.current(0)
+            self.webcam_index.set(int(names[0].split('(')[-1].strip(')')))
+
     def update_webcam_index(self, event):
         selected = event.widget.get()
         # Extract index from the device name
@@ -254,302 +232,46 @@ class WebcamStreamer:
         self.webcam_index.set(index)
 
     def toggle_streaming(self):
+        # Server Start/Stop button; the client starts when a server accepts it
         if not self.streaming:
-            if self.mode == "Server":
-                self.start_button.config(text="Stop")
-                # Start broadcasting presence
-                threading.Thread(target=self.broadcast_server_presence, daemon=True).start()
-                # Start control listener
-                self.control_listener_thread = threading.Thread(target=self.start_control_listener, daemon=True)
-                self.control_listener_thread.start()
-                self.status_label.config(text="Waiting for client...", foreground="orange")
-            self.streaming = True
-            if self.mode == "Client":
-                threading.Thread(target=self.start_client_streaming, daemon=True).start()
-            else:
-                # The server streaming will start after receiving the start command from the client
-                pass
+            self.core.port = self.port.get()
+            self.core.start()
         else:
-            if self.mode == "Server":
-                self.start_button.config(text="Start")
-                # Stop broadcasting
-                self.broadcasting_enabled = False
-                # Stop control listener
-                self.control_listener_enabled = False
-                # Send stop command to client
-                if hasattr(self, 'control_conn'):
-                    try:
-                        self.control_conn.sendall(STOP_MESSAGE)
-                        print("Server: Sent stop command to client")
-                        self.control_conn.close()
-                        del self.control_conn
-                    except Exception as e:
-                        print(f"Server: Error sending stop command to client: {e}")
-                else:
-                    print("Server: No control connection to client")
-                self.status_label.config(text="Stopped. Waiting to start...", foreground="orange")
-            self.streaming = False
-            self.status_label.config(text="Disconnected", foreground="red")
-            # Clean up resources
-            self.cleanup_resources()
-            if self.mode == "Client":
-                # Reset IP address and restart discovery
-                self.ip_address.set("127.0.0.1")
-                threading.Thread(target=self.start_discovery_listener, daemon=True).start()
-                self.status_label.config(text="Stopped. Searching for server...", foreground="orange")
-
-    def cleanup_resources(self):
-        # Close sockets and resources if they exist
-        if hasattr(self, 'conn'):
-            try:
-                self.conn.close()
-            except:
-                pass
-            del self.conn
-        if hasattr(self, 'server_socket'):
-            try:
-                self.server_socket.close()
-            except:
-                pass
-            del self.server_socket
-        if hasattr(self, 'virtual_cam'):
-            try:
-                self.virtual_cam.close()
-            except:
-                pass
-            del self.virtual_cam
-        if hasattr(self, 'client_socket'):
-            try:
-                self.client_socket.close()
-            except:
-                pass
-            del self.client_socket
-        if hasattr(self, 'capture') and self.capture is not None:
-            try:
-                self.capture.release()
-            except:
-                pass
-            del self.capture
-        if hasattr(self, 'control_socket'):
-            try:
-                self.control_socket.close()
-            except:
-                pass
-            del self.control_socket
-        if hasattr(self, 'control_conn'):
-            try:
-                self.control_conn.close()
-            except:
-                pass
-            del self.control_conn
-
-    def start_client_streaming(self):
-        try:
-            self.status_label.config(text="Connecting to server...", foreground="orange")
-            # Open the webcam using the selected index
-            self.capture = cv2.VideoCapture(self.webcam_index.get())
-            if not self.capture.isOpened():
-                messagebox.showerror("Error", "Cannot open webcam")
-                self.streaming = False
-                self.status_label.config(text="Disconnected", foreground="red")
-                return
-
-            # Allow the camera to warm up
-            time.sleep(1)
-
-            # Initialize bytes sent for bitrate calculation
-            self.bytes_sent = 0
-            self.last_update_time = time.time()
-
-            self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.client_socket.connect((self.ip_address.get(), self.port.get()))
-            print(f"Client: Connected to server at {self.ip_address.get()}:{self.port.get()}")
-            self.status_label.config(text="Connected", foreground="green")
-
-            self.update_video_frame()
-        except Exception as e:
-            messagebox.showerror("Error", str(e))
-            self.streaming = False
-            self.status_label.config(text="Disconnected", foreground="red")
+            self.core.stop()
+
+    def show_stats(self, stats):
+        if stats is not None:
+            bitrate_text, stage_text = stats
+            self.bitrate_label.config(text=bitrate_text)
+            self.stage_label.config(text=f"{stage_text} | {self.preview.report()}")
 
     def update_video_frame(self):
-        if self.streaming:
-            ret, frame = self.capture.read()
-            if ret:
-                # Serialize frame
-                data = pickle.dumps(frame)
-                # Send message length first
-                message_size = struct.pack("Q", len(data))
-                try:
-                    self.client_socket.sendall(message_size + data)
-                    # Update bytes sent
-                    self.bytes_sent += len(message_size + data)
-                except Exception as e:
-                    print(f"Client: Failed to send frame: {e}")
-                    self.status_label.config(text="Disconnected", foreground="red")
-                    self.streaming = False
-                    self.cleanup_resources()
-                    # Reset IP address and restart discovery
-                    self.ip_address.set("127.0.0.1")
-                    threading.Thread(target=self.start_discovery_listener, daemon=True).start()
-                    self.status_label.config(text="Stopped. Searching for server...", foreground="orange")
-                    return
-
-                # Display the frame in the GUI
-                cv2image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                img = Image.fromarray(cv2image)
-                imgtk = ImageTk.PhotoImage(image=img)
-                self.video_label.imgtk = imgtk
-                self.video_label.configure(image=imgtk)
-
-                # Update bitrate every second
-                current_time = time.time()
-                if current_time - self.last_update_time >= 1:
-                    bitrate = (self.bytes_sent * 8) / (current_time - self.last_update_time) / 1_000_000  # Mbps
-                    self.bitrate_label.config(text=f"Bitrate: {bitrate:.2f} Mbps")
-                    self.bytes_sent = 0
-                    self.last_update_time = current_time
-
-                # Schedule the next frame update
-                self.root.after(10, self.update_video_frame)
-            else:
-                print("Client: Failed to grab frame")
-                messagebox.showerror("Error", "Failed to grab frame from webcam")
-                self.streaming = False
-                self.cleanup_resources()
-                self.status_label.config(text="Disconnected", foreground="red")
-        else:
-            self.cleanup_resources()
-            self.status_label.config(text="Disconnected", foreground="red")
+        pipeline = self.core.pipeline
+        if not self.streaming or pipeline is None:
+            return
+        # Preview the latest captured frame; only fetched when a draw is due, since passthrough frames need decoding
+        if self.preview.due():
+            self.preview.show(pipeline.preview_frame())
 
-    def start_server_streaming(self):
-        try:
-            self.status_label.config(text="Waiting for connection...", foreground="orange")
-            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.server_socket.bind(('', self.port.get()))  # Bind to all interfaces
-            self.server_socket.listen(5)
-            print(f"Server: Listening on {self.get_local_ip()}:{self.port.get()}")
-
-            self.bytes_received = 0
-            self.last_update_time = time.time()
-
-            threading.Thread(target=self.accept_client_connection, daemon=True).start()
-        except Exception as e:
-            messagebox.showerror("Error", str(e))
-            self.streaming = False
-            if self.start_button:
-                self.start_button.config(text="Start")
-            if hasattr(self, 'server_socket'):
-                self.server_socket.close()
-            self.status_label.config(text="Disconnected", foreground="red")
+        # Update bitrate and pipeline stats every second
+        self.show_stats(self.core.collect_stats(time.time()))
 
-    def accept_client_connection(self):
-        try:
-            self.conn, addr = self.server_socket.accept()
-            print(f"Server: Connection from {addr}")
-            self.status_label.config(text="Connected", foreground="green")
-
-            # Initialize data variables
-            self.data = b""
-            self.payload_size = struct.calcsize("Q")
-
-            # Start receiving frames
-            self.receive_frame()
-        except Exception as e:
-            print(f"Server: Error accepting connection: {e}")
-            self.streaming = False
-            self.status_label.config(text=f"Error: {e}", foreground="red")
-
-    def receive_frame(self):
+        # Schedule the next preview update
+        self.root.after(30, self.update_video_frame)
+
+    def update_server_preview(self):
         if not self.streaming:
-            self.cleanup_resources()
-            self.status_label.config(text="Disconnected", foreground="red")
             return
-        try:
-            # Initialize virtual camera if not already
-            if not hasattr(self, 'virtual_cam'):
-                frame = self.get_next_frame()
-                if frame is None:
-                    return
-                height, width, _ = frame.shape
-                self.virtual_cam = pyvirtualcam.Camera(width=width, height=height, fps=20)
-                print(f'Server: Virtual camera initialized: {self.virtual_cam.device}')
-            else:
-                frame = self.get_next_frame()
-                if frame is None:
-                    return
-
-            # Display the frame in the GUI
-            cv2image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            img = Image.fromarray(cv2image)
-            imgtk = ImageTk.PhotoImage(image=img)
-            self.video_label.imgtk = imgtk
-            self.video_label.configure(image=imgtk)
-
-            # Send frame to virtual webcam
-            self.virtual_cam.send(cv2image)
-            self.virtual_cam.sleep_until_next_frame()
-
-            # Update bytes received
-            self.bytes_received += self.current_frame_size
-
-            # Update bitrate every second
-            current_time = time.time()
-            if current_time - self.last_update_time >= 1:
-                bitrate = (self.bytes_received * 8) / (current_time - self.last_update_time) / 1_000_000  # Mbps
-                self.bitrate_label.config(text=f"Bitrate: {bitrate:.2f} Mbps")
-                self.bytes_received = 0
-                self.last_update_time = current_time
-
-            # Schedule the next frame update
-            self.root.after(10, self.receive_frame)
-        except Exception as e:
-            messagebox.showerror("Error", str(e))
-            self.streaming = False
-            if self.start_button:
-                self.start_button.config(text="Start")
-            self.cleanup_resources()
-            self.status_label.config(text="Disconnected", foreground="red")
+        sessions = self.core.active_sessions()
+        # The preview shows the oldest session; no virtual camera waits for it. Only fetched when a draw
+        # is due, since raw frames in another format are converted for it
+        if sessions and self.preview.due():
+            self.preview.show(sessions[0].pipeline.preview_frame())
 
-    def get_next_frame(self):
-        try:
-            while len(self.data) < self.payload_size:
-                packet = self.conn.recv(4 * 1024)  # 4K
-                if not packet:
-                    self.streaming = False
-                    return None
-                self.data += packet
-            if not self.data:
-                self.streaming = False
-                return None
-            packed_msg_size = self.data[:self.payload_size]
-            self.data = self.data[self.payload_size:]
-            msg_size = struct.unpack("Q", packed_msg_size)[0]
-            self.current_frame_size = msg_size + self.payload_size  # For bitrate calculation
-
-            while len(self.data) < msg_size:
-                self.data += self.conn.recv(4 * 1024)
-            frame_data = self.data[:msg_size]
-            self.data = self.data[msg_size:]
-            frame = pickle.loads(frame_data)
-            return frame
-        except Exception as e:
-            print(f"Server: Error receiving frame: {e}")
-            return None
-
-    def get_local_ip(self):
-        # Retrieve the local IP address
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        try:
-            # Try to connect to an external IP address to get the local IP
-            s.connect(('8.8.8.8', 80))
-            local_ip = s.getsockname()[0]
-        except Exception:
-            # Fallback to '127.0.0.1'
-            local_ip = '127.0.0.1'
-        finally:
-            s.close()
-        return local_ip
+        # Update bitrate, per-client stats reports and pipeline stats every second
+        self.show_stats(self.core.collect_stats(time.time()))
+
+        self.root.after(20, self.update_server_preview)
 
 def main():
     root = tk.Tk()